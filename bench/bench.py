@@ -0,0 +1,195 @@
+"""
+Benchmark harn and plog on a synthetic struct-heavy C project (see bench/gen.py).
+
+Each stage is timed separately, taking the fastest of --repeat runs. With --tracemalloc, the peak memory Python allocated
+during each stage is measured too. The peak resident memory of the process so far is recorded after each stage, but as it
+only ever grows it says little about the stage itself. The stages are:
+- parse: parse every file with libclang
+- traverse: find the target function in each translation unit, as harn does
+- codegen: generate the test harness for each target
+- format: format the test harnesses with clang-format
+- index: build the symbol index of the project, as plog scans the original project
+- first_stmts: find the first statement of each target, as plog does
+
+Results are compared with a stored baseline, and the run fails if a stage got slower than the tolerance,
+or allocated more than it with --tracemalloc.
+"""
+
+from contextlib import contextmanager
+from mylog import log
+from pathlib import Path
+from symindex import SymbolIndex
+import argparse
+import json
+import logging
+import metrics
+import mylog
+import nodeutils
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from tools.harn import harn, fmt
+from tools.plog import plog
+from . import gen
+
+default_baseline = Path(__file__).parent / 'baseline.json'
+# Differences smaller than this are noise, whatever the tolerance
+MIN_SECONDS = 0.01
+
+
+class Bench:
+    """Timings and memory of each stage, over several runs"""
+
+    def __init__(self):
+        self.seconds = {}
+        # Cumulative: the peak resident memory of the whole process up to the end of the stage
+        self.maxrss_kb = {}
+        # Per stage: the peak traced memory during the stage, with --tracemalloc
+        self.traced_peak_kb = {}
+
+    @contextmanager
+    def stage(self, name):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] = min(seconds, self.seconds.get(name, seconds))
+            self.maxrss_kb[name] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if tracemalloc.is_tracing():
+                self.traced_peak_kb[name] = tracemalloc.get_traced_memory()[1] // 1024
+            log.debug(f'{name}: {seconds:.3f}s')
+
+    def stages(self):
+        return {name: {
+            'seconds': self.seconds[name],
+            'maxrss_kb': self.maxrss_kb[name],
+            **({'traced_peak_kb': self.traced_peak_kb[name]} if name in self.traced_peak_kb else {}),
+        } for name in self.seconds}
+
+
+def run(bench, root, paths, targets, args):
+    """Run every stage once over the generated project"""
+    with bench.stage('parse'):
+        cursors = [nodeutils.parse(str(p)) for p in paths]
+
+    with bench.stage('traverse'):
+        functions = [harn.select_target(name, cur) for name, cur in zip(targets, cursors)]
+
+    with bench.stage('codegen'):
+        harnesses = [harn.codegen(f, args.mode) for f in functions]
+    texts = [harn.render(harn.read_input_file(cur), h, no_format=True) for cur, h in zip(cursors, harnesses)]
+    del cursors, functions
+
+    if fmt.have_clang_format():
+        with bench.stage('format'):
+            for text in texts:
+                fmt.format_text(text)
+
+    db_path = root / 'symbols.db'
+    if db_path.exists():
+        db_path.unlink()
+    with SymbolIndex(root, db_path=db_path) as symbols:
+        with bench.stage('index'):
+            symbols.update(jobs=args.jobs)
+        with bench.stage('first_stmts'):
+            first_stmts = plog.find_first_stmts(symbols, targets)
+    assert len(first_stmts) == len(targets), 'not every target was found'
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each stage against the baseline and get the names of the stages which regressed
+    """
+    regressed = []
+    print(f'{"stage":<12} {"seconds":>9} {"baseline":>9} {"change":>8} {"traced MB":>10} {"process peak MB":>16}')
+    for name, now in results['stages'].items():
+        base = baseline['stages'].get(name) if baseline else None
+        line = f'{name:<12} {now["seconds"]:>9.3f}'
+        if base:
+            change = now['seconds'] / base['seconds'] - 1 if base['seconds'] else 0
+            line += f' {base["seconds"]:>9.3f} {change:>+8.1%}'
+            slower = now['seconds'] > base['seconds'] * (1 + tolerance) and now['seconds'] - base['seconds'] > MIN_SECONDS
+            # The process peak is cumulative, so only the per-stage traced peak can show a stage got bigger
+            bigger = 'traced_peak_kb' in now and 'traced_peak_kb' in base and now['traced_peak_kb'] > base['traced_peak_kb'] * (1 + tolerance)
+            if slower or bigger:
+                regressed.append(name)
+        else:
+            line += f' {"-":>9} {"-":>8}'
+        traced = f'{now["traced_peak_kb"] / 1024:.1f}' if 'traced_peak_kb' in now else '-'
+        line += f' {traced:>10} {now["maxrss_kb"] / 1024:>16.1f}'
+        print(line + ('  REGRESSED' if name in regressed else ''))
+    return regressed
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='bench', description='Benchmark harn and plog on a synthetic struct-heavy C project')
+    parser.add_argument('--files', type=int, default=20, help='Number of source files. Default: 20')
+    parser.add_argument('--functions', type=int, default=100, help='Number of functions in each file. Default: 100')
+    parser.add_argument('--depth', type=int, default=4, help='Depth of the struct nesting. Default: 4')
+    parser.add_argument('--width', type=int, default=8, help='Number of primitive fields in each struct. Default: 8')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated code. Default: 0')
+    parser.add_argument('-m', '--mode', choices=list(harn.templates), default='argv', help='Test harness mode, as in harn -m. Default: argv')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Run each stage this many times and keep the fastest. Default: 3')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for the symbol index. Default: number of CPUs')
+    parser.add_argument('-b', '--baseline', type=Path, default=default_baseline, help=f'Baseline results to compare with. Default: {default_baseline}')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the baseline instead of comparing with it')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='Fraction by which a stage may be slower than the baseline, or allocate more with --tracemalloc. Default: 0.25')
+    parser.add_argument('-o', '--output', type=Path, help='Write the results to a file as JSON')
+    parser.add_argument('-k', '--keep', type=Path, metavar='DIR', help='Generate the project in DIR and keep it, instead of a temporary directory')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    log.setLevel(logging.getLevelName(args.log_level) if args.log_level else logging.ERROR)
+    mylog.configure(args)
+    metrics.configure(args)
+
+    # tracemalloc slows every stage down, so runs with it are only compared with baselines saved with it
+    config = {k: getattr(args, k) for k in ('files', 'functions', 'depth', 'width', 'seed', 'mode', 'tracemalloc')}
+    root = args.keep or Path(tempfile.mkdtemp(prefix='pal-bench-'))
+    bench = Bench()
+    try:
+        with bench.stage('generate'):
+            paths, targets = gen.generate(root, args.files, args.functions, args.depth, args.width, args.seed)
+        for i in range(args.repeat):
+            log.info(f'run {i + 1} of {args.repeat}')
+            run(bench, root, paths, targets, args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    results = {'config': config, 'python': sys.version.split()[0], 'stages': bench.stages()}
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        compare(results, None, args.tolerance)
+        print(f'saved baseline to {args.baseline}')
+        return 0
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.is_file() else None
+    if baseline is None:
+        log.warning(f'no baseline at {args.baseline}, run with --save-baseline to save one')
+    elif baseline['config'] != config:
+        log.warning(f'baseline at {args.baseline} was run with {baseline["config"]}, not comparing')
+        baseline = None
+    regressed = compare(results, baseline, args.tolerance)
+    if regressed:
+        log.error(f'regressed stages: {", ".join(regressed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
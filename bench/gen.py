@@ -0,0 +1,65 @@
+"""
+Generate a synthetic C project with struct-heavy function signatures, for benchmarking.
+
+Each file defines a chain of structs depth levels deep. Every struct has width primitive fields,
+one nested struct and one pointer to the next level, a pointer to itself and a union.
+Each file also has many small functions calling each other and one target function taking the structs.
+"""
+
+import random
+
+PRIMITIVES = ['int', 'unsigned long', 'double', 'char', 'char*', 'short', 'float', 'long long']
+
+
+def struct_name(i, d):
+    return f's{i}_{d}'
+
+
+def gen_file(i, functions, depth, width, rng):
+    """Get the text of source file i"""
+    lines = ['#include <stddef.h>', '', f'union u{i} {{ int a; double b; char* c; }};', '']
+    for d in reversed(range(depth)):
+        lines.append(f'struct {struct_name(i, d)} {{')
+        for w in range(width):
+            lines.append(f'  {rng.choice(PRIMITIVES)} f{w};')
+        lines.append(f'  int arr[{rng.randint(2, 8)}];')
+        if d + 1 < depth:
+            lines.append(f'  struct {struct_name(i, d + 1)} inner;')
+            lines.append(f'  struct {struct_name(i, d + 1)}* child;')
+        lines.append(f'  struct {struct_name(i, d)}* next;')
+        lines.append(f'  union u{i} u;')
+        lines.append('};')
+        lines.append('')
+    lines.append(f'typedef struct {struct_name(i, 0)} t{i};')
+    lines.append('')
+
+    for j in range(functions):
+        lines.append(f'int f{i}_{j}(t{i}* p, int k) {{')
+        lines.append('  if (p == NULL) return 0;')
+        if j:
+            lines.append(f'  if (k > {rng.randint(0, 9)}) return f{i}_{j - 1}(p->next, k - 1) + p->arr[0];')
+        lines.append('  return (int)p->f0 + k;')
+        lines.append('}')
+        lines.append('')
+
+    lines.append(f'int target{i}(t{i}* p, union u{i} u, struct {struct_name(i, depth - 1)} leaf, char* s, int n) {{')
+    lines.append(f'  int r = f{i}_{functions - 1}(p, n);' if functions else '  int r = n;')
+    lines.append('  if (s != NULL) r += s[0];')
+    lines.append('  return r + u.a + leaf.arr[0];')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def generate(root, files=20, functions=100, depth=4, width=8, seed=0):
+    """
+    Write the project's files to the directory root.
+    Returns the paths of the source files and the names of the target functions.
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = root / f'file{i}.c'
+        path.write_text(gen_file(i, functions, depth, width, rng))
+        paths.append(path)
+    return paths, [f'target{i}' for i in range(files)]
@@ -0,0 +1,174 @@
+"""
+Per-file clang flags from a compilation database (compile_commands.json).
+
+The JSON file is read once into an on-disk index next to it (.paltools/compdb.db), keyed by the absolute path
+of each source file, and only read again when it changes. Only the flags which affect parsing are kept:
+include paths, macros, forced includes, the language standard, the target and -f/-m options.
+"""
+
+from mylog import log
+from pathlib import Path
+import json
+import os
+import shlex
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS commands (path TEXT PRIMARY KEY, dir TEXT, flags TEXT);
+CREATE INDEX IF NOT EXISTS commands_dir ON commands (dir);
+'''
+
+# Flags which take a path argument, relative to the command's directory
+PATH_FLAGS = ('-I', '-isystem', '-iquote', '-idirafter', '-include', '-imacros', '-isysroot', '--sysroot')
+# Other flags to keep; the ones which are a whole word may take a separate argument
+KEEP_FLAGS = ('-D', '-U', '-std=', '-f', '-m', '-target', '--target=', '-nostdinc')
+SEPARATE_ARG = {'-I', '-isystem', '-iquote', '-idirafter', '-include', '-imacros', '-isysroot', '--sysroot', '-D', '-U', '-target'}
+# Flags to drop along with their separate argument
+DROP_WITH_ARG = {'-o', '-MF', '-MT', '-MQ', '-x', '-Xclang'}
+
+
+def command_arguments(entry):
+    if 'arguments' in entry:
+        return list(entry['arguments'])
+    return shlex.split(entry['command'])
+
+
+def parse_flags(arguments, directory):
+    """
+    Get the flags of one compile command which affect parsing, with relative paths made absolute
+    """
+    flags = []
+    args = iter(arguments[1:])
+    for arg in args:
+        if arg in DROP_WITH_ARG:
+            next(args, None)
+            continue
+        flag = next((f for f in PATH_FLAGS + KEEP_FLAGS if arg.startswith(f)), None)
+        if flag is None:
+            continue
+        separate = arg in SEPARATE_ARG
+        if separate:
+            value = next(args, None)
+            if value is None:
+                break
+        else:
+            value = arg[len(flag):]
+            if flag == '--sysroot':
+                flag, value = '--sysroot=', value[1:]
+        if flag in PATH_FLAGS + ('--sysroot=',) and value:
+            value = os.path.normpath(os.path.join(directory, value))
+        flags += [flag, value] if separate else [flag + value]
+    return flags
+
+
+def source_key(filepath):
+    return os.path.normpath(os.path.abspath(str(filepath)))
+
+
+class CompilationDatabase:
+    """
+    Index of compile_commands.json from source file to clang flags.
+    Files which are not in the database, like headers, get the flags of a file in the same directory.
+    """
+
+    def __init__(self, path, db_path=None):
+        path = Path(path)
+        if path.is_dir():
+            path = path / 'compile_commands.json'
+        self.path = path.absolute()
+        if db_path is None:
+            db_path = self.path.parent / '.paltools' / 'compdb.db'
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = None
+        self.pid = None
+        self.cache = {}
+        self.update()
+
+    def connect(self):
+        """Get a connection for this process; forked workers open their own"""
+        if self.pid != os.getpid():
+            self.db = sqlite3.connect(str(self.db_path))
+            self.db.executescript(SCHEMA)
+            self.pid = os.getpid()
+        return self.db
+
+    def stamp(self):
+        st = os.stat(self.path)
+        return f'{self.path}:{st.st_mtime_ns}:{st.st_size}'
+
+    def update(self):
+        """Index the JSON file again if it changed since it was indexed"""
+        db = self.connect()
+        stamp = self.stamp()
+        row = db.execute('SELECT value FROM meta WHERE key = ?', ('source',)).fetchone()
+        if row is not None and row[0] == stamp:
+            return
+        with open(self.path) as f:
+            entries = json.load(f)
+        with db:
+            db.execute('DELETE FROM commands')
+            for entry in entries:
+                directory = entry.get('directory', str(self.path.parent))
+                path = source_key(os.path.join(directory, entry['file']))
+                flags = parse_flags(command_arguments(entry), directory)
+                db.execute('INSERT OR IGNORE INTO commands VALUES (?, ?, ?)', (path, os.path.dirname(path), json.dumps(flags)))
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('source', stamp))
+        log.debug(f'indexed {len(entries)} compile commands from {self.path}')
+        self.cache.clear()
+
+    def close(self):
+        if self.db is not None and self.pid == os.getpid():
+            self.db.close()
+        self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def flags(self, filepath):
+        """Get the clang flags for parsing filepath"""
+        key = source_key(filepath)
+        if key not in self.cache:
+            db = self.connect()
+            row = db.execute('SELECT flags FROM commands WHERE path = ?', (key,)).fetchone() or \
+                db.execute('SELECT flags FROM commands WHERE dir = ? ORDER BY path LIMIT 1', (os.path.dirname(key),)).fetchone()
+            if row is None:
+                log.debug(f'no compile command for {filepath}')
+            self.cache[key] = [] if row is None else json.loads(row[0])
+        return self.cache[key]
+
+
+_database = None
+
+
+def use(path):
+    """Take clang flags from the compilation database at path (a JSON file or its directory), or stop if path is None"""
+    global _database
+    _database = None if path is None else CompilationDatabase(path)
+
+
+def active():
+    return _database is not None
+
+
+def flags(filepath):
+    """Get the clang flags for filepath from the compilation database in use, if any"""
+    return [] if _database is None else _database.flags(filepath)
+
+
+def fingerprint():
+    """Identify the compilation database in use and its contents, for caches of parse results"""
+    return None if _database is None else _database.stamp()
+
+
+def add_arguments(parser):
+    parser.add_argument('--compdb', metavar='PATH', help='compile_commands.json, or the build directory containing it, to take each file\'s clang flags from')
+
+
+def configure(args):
+    if args.compdb:
+        use(args.compdb)
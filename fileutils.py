@@ -0,0 +1,33 @@
+"""
+Write files atomically, so that readers and concurrent writers never see a partially written file
+"""
+
+from pathlib import Path
+import os
+import tempfile
+
+# The process's umask, read once since reading it means setting it, which would race with other threads creating files
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def write_atomic(path, data):
+    """
+    Write data (text or bytes) to path through a private temporary file in the same directory, then rename it into place.
+    The file gets the mode of the file it replaces, or the mode a new file would get under the umask,
+    instead of the temporary file's owner-only mode.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=path.parent.absolute())
+    try:
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_umask
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,173 @@
+"""
+Limit the number of jobs running in parallel, sharing the limit with GNU make's jobserver when run from make -j.
+
+make passes the jobserver in MAKEFLAGS as --jobserver-auth=R,W (pipe file descriptors, older makes use --jobserver-fds)
+or --jobserver-auth=fifo:PATH (make 4.4). Every process owns one implicit job slot; each extra job in parallel
+reads one token byte from the jobserver and writes it back when it is done.
+For make to pass the pipe to a tool, the recipe line must be marked recursive with + or use $(MAKE).
+Without a jobserver, a pool runs as many tasks as its -j, or one per CPU by default.
+"""
+
+from concurrent.futures import Executor
+from mylog import log
+import errno
+import os
+import re
+import select
+import threading
+
+
+class JobServer:
+    """Job slots from make's jobserver"""
+
+    def __init__(self, read_fd, write_fd):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        # Another job can take the token between select and read, so the read must not block.
+        # make 4.3 and later make the pipe non-blocking itself, and other jobs must already cope with it
+        os.set_blocking(read_fd, False)
+        self.lock = threading.Lock()
+        self.implicit_free = True
+
+    def acquire(self):
+        """Wait for a job slot and return its token"""
+        while True:
+            with self.lock:
+                if self.implicit_free:
+                    self.implicit_free = False
+                    return None
+            # Wake up now and then in case the implicit slot was released meanwhile
+            readable, _, _ = select.select([self.read_fd], [], [], 0.1)
+            if readable:
+                try:
+                    return os.read(self.read_fd, 1)
+                except BlockingIOError:
+                    continue
+                except InterruptedError:
+                    continue
+
+    def release(self, token):
+        if token is None:
+            with self.lock:
+                self.implicit_free = True
+        else:
+            os.write(self.write_fd, token)
+
+
+class Semaphore:
+    """Job slots from a counting semaphore, when there is no jobserver"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.semaphore = threading.BoundedSemaphore(jobs)
+
+    def acquire(self):
+        self.semaphore.acquire()
+
+    def release(self, token):
+        self.semaphore.release()
+
+
+def jobserver_from_makeflags(makeflags):
+    """Connect to the jobserver described by MAKEFLAGS, or return None"""
+    fifo = re.findall(r'--jobserver-auth=fifo:(\S+)', makeflags)
+    fds = re.findall(r'--jobserver-(?:auth|fds)=(\d+),(\d+)', makeflags)
+    try:
+        if fifo:
+            fd = os.open(fifo[-1], os.O_RDWR | os.O_NONBLOCK)
+            return JobServer(fd, fd)
+        if fds:
+            read_fd, write_fd = (int(fd) for fd in fds[-1])
+            os.fstat(read_fd)
+            os.fstat(write_fd)
+            return JobServer(read_fd, write_fd)
+    except OSError as e:
+        if e.errno not in (errno.EBADF, errno.ENOENT, errno.EACCES):
+            raise
+        log.warning(f'make jobserver in MAKEFLAGS is not usable ({e}), mark the recipe with + to share make\'s job limit')
+    return None
+
+
+_server = None
+_checked = False
+_default_slots = None
+
+
+def server():
+    """Get make's jobserver for this process, or None if it was not run from make -j"""
+    global _server, _checked
+    if not _checked:
+        _server = jobserver_from_makeflags(os.environ.get('MAKEFLAGS', ''))
+        _checked = True
+        if _server is not None:
+            log.debug('using make jobserver for job slots')
+    return _server
+
+
+def slots(max_workers=None):
+    """
+    Get job slots for a pool of max_workers: make's jobserver if there is one.
+    Otherwise, a pool with an explicit number of workers gets as many slots,
+    and pools with the default number share one slot per CPU.
+    """
+    global _default_slots
+    if server() is not None:
+        return server()
+    if max_workers is not None:
+        return Semaphore(max_workers)
+    if _default_slots is None:
+        _default_slots = Semaphore(os.cpu_count() or 1)
+    return _default_slots
+
+
+def _run_chunk(fn, chunk):
+    return [fn(*args) for args in chunk]
+
+
+class LimitedExecutor(Executor):
+    """
+    Executor which holds a job slot for each running task.
+    Submitting blocks until a slot is free, and no more slots are held than the executor has workers.
+    """
+
+    def __init__(self, executor, slots, max_workers):
+        self.executor = executor
+        self.slots = slots
+        self.workers = threading.BoundedSemaphore(max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        self.workers.acquire()
+        token = self.slots.acquire()
+
+        def release(_=None):
+            self.slots.release(token)
+            self.workers.release()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except:
+            release()
+            raise
+        future.add_done_callback(release)
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        items = list(zip(*iterables))
+        futures = [self.submit(_run_chunk, fn, items[i:i + chunksize]) for i in range(0, len(items), chunksize)]
+
+        def results():
+            for future in futures:
+                yield from future.result(timeout)
+        return results()
+
+    def shutdown(self, wait=True, **kwargs):
+        self.executor.shutdown(wait, **kwargs)
+
+
+def executor(executor_class, max_workers=None, **kwargs):
+    """
+    Make an executor of executor_class which only runs a task while it holds a job slot.
+    max_workers defaults to the number of CPUs; make's jobserver can limit it further.
+    """
+    job_slots = slots(max_workers)
+    max_workers = max_workers or os.cpu_count() or 1
+    return LimitedExecutor(executor_class(max_workers=max_workers, **kwargs), job_slots, max_workers)
@@ -0,0 +1,99 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from mylog import log
+import atexit
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+
+"""
+Common profiling and metrics
+"""
+
+
+class Metrics:
+    """Named wall-clock timers and counters"""
+
+    def __init__(self) -> None:
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextmanager
+    def timer(self, name):
+        """Add the time spent in a with block to a timer"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def to_dict(self):
+        return {
+            'timers': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in self.seconds},
+            'counters': dict(self.counters),
+        }
+
+
+metrics = Metrics()
+timer = metrics.timer
+count = metrics.count
+
+profiler = None
+started = None
+
+
+def add_arguments(parser):
+    """Add the profiling and metrics options to an argparse parser"""
+    parser.add_argument('--profile', help='Profile with cProfile and dump the stats to a file, for pstats or snakeviz')
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace memory allocations and report the peak and the top allocation sites')
+    parser.add_argument('--metrics-out', help='Write the timers and counters to a file as JSON')
+
+
+def configure(args):
+    """Start the profilers chosen by the options from add_arguments. Results are written at exit."""
+    global profiler, started
+    if started is not None:
+        return
+    started = time.perf_counter()
+    if args.tracemalloc:
+        tracemalloc.start()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(finish, args)
+
+
+def finish(args):
+    global profiler
+    if profiler is not None:
+        profiler.disable()
+    metrics.seconds['total'] = time.perf_counter() - started
+    metrics.calls['total'] = 1
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        metrics.counters['tracemalloc_current_bytes'] = current
+        metrics.counters['tracemalloc_peak_bytes'] = peak
+        top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        tracemalloc.stop()
+        log.debug(f'peak traced memory: {peak / 2**20:.1f} MiB')
+        for stat in top:
+            log.debug(f'* {stat}')
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        log.debug(f'wrote profile to {args.profile}')
+        stats = pstats.Stats(args.profile)
+        log.debug('\n' + '\n'.join(f'{c[3]:8.3f}s {pstats.func_std_string(f)}'
+                                   for f, c in sorted(stats.stats.items(), key=lambda i: i[1][3], reverse=True)[:10]))
+        profiler = None
+    for name, seconds in sorted(metrics.seconds.items(), key=lambda i: i[1], reverse=True):
+        log.debug(f'{name}: {seconds:.3f}s in {metrics.calls[name]} calls')
+    if args.metrics_out:
+        with open(args.metrics_out, 'w') as f:
+            json.dump(metrics.to_dict(), f, indent=2)
@@ -1,4 +1,10 @@
+from collections import Counter
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
 """
@@ -13,21 +19,196 @@ log.addHandler(stdout_handler)
 log.setLevel(logging.ERROR)
 
 
+# Number of messages logged to each CappedLog category, whether or not they were emitted
+counts = Counter()
+
+
+class lazy:
+    """Defer a function call until the message which it is an argument of is formatted.
+
+    log.debug('node %s', lazy(nodeutils.pp, node)) only calls nodeutils.pp when DEBUG is enabled.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+logger_method_levels = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'exception': logging.ERROR,
+    'critical': logging.CRITICAL,
+}
+
+
 class CappedLog:
-    """Cap the number of logs to a fixed limit and note a message when the limit is hit."""
+    """Cap the number of logs to a fixed limit and note a message when the limit is hit.
+
+    Nothing is formatted unless the message will be emitted: pass %-style arguments,
+    or a callable which returns the message.
+    """
 
-    def __init__(self, limit=100, log_fn=log.debug) -> None:
+    def __init__(self, limit=100, log_fn=None, level=None, category=None, logger=log) -> None:
         self.count = 0
         self.limit = limit
+        if level is None:
+            # A logger method like log.warning gives the level and the logger; other functions need a level
+            level = logging.DEBUG if log_fn is None else logger_method_levels.get(getattr(log_fn, '__name__', None))
+            if level is None:
+                raise ValueError('level is required with a log_fn which is not a logger method')
+            if isinstance(getattr(log_fn, '__self__', None), logging.Logger):
+                logger = log_fn.__self__
+        self.level = level
+        self.logger = logger
+        self.category = category
+        if log_fn is None:
+            extra = {'category': category} if category is not None else None
+
+            def log_fn(msg, *args, **kwargs):
+                logger.log(level, msg, *args, extra=extra, **kwargs)
         self.log = log_fn
 
-    def __call__(self, *args, **kwargs):
-        if self.count < self.limit:
-            self.log(*args, **kwargs)
-            printed = True
-        else:
-            printed = False
+    def enabled(self):
+        return self.count < self.limit and self.logger.isEnabledFor(self.level)
+
+    def __call__(self, msg, *args, **kwargs):
+        """Log a message, returning whether it was emitted"""
+        if self.category is not None:
+            counts[self.category] += 1
+        if not self.enabled():
+            return False
+        if callable(msg):
+            msg = msg()
+        self.log(msg, *args, **kwargs)
         if self.count == self.limit - 1:
             self.log(f'^^^ CAPPING this log at {self.limit} items ^^^')
         self.count += 1
-        return printed
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop messages below WARNING once a category goes over its budget.
+
+    - rate: allow a burst of `rate` messages, refilled at `rate` messages per second
+    - sample: keep 1 of every `sample` messages
+    The category of a message is its CappedLog category, else its logger name.
+    """
+
+    def __init__(self, rate=None, sample=None):
+        super().__init__()
+        self.rate = rate
+        self.sample = sample
+        self.tokens = {}
+        self.seen = Counter()
+        self.dropped = Counter()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        category = getattr(record, 'category', record.name)
+        self.seen[category] += 1
+        keep = True
+        if self.sample and (self.seen[category] - 1) % self.sample != 0:
+            keep = False
+        if keep and self.rate:
+            tokens, last = self.tokens.get(category, (self.rate, record.created))
+            tokens = min(self.rate, tokens + (record.created - last) * self.rate)
+            keep = tokens >= 1
+            self.tokens[category] = (tokens - 1 if keep else tokens, record.created)
+        if not keep:
+            self.dropped[category] += 1
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each message as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'category'):
+            entry['category'] = record.category
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+listener = None
+
+
+def start_queue(stream=sys.stdout, json_lines=False, rate=None, sample=None):
+    """Write logs from a background thread, so that slow terminals and pipes do not stall the caller.
+    Messages are filtered and formatted by the caller, then queued for the writer thread.
+    """
+    global listener
+    if listener is not None:
+        return
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if json_lines else verbose_fmt)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    if rate or sample:
+        queue_handler.addFilter(RateLimitFilter(rate, sample))
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    log.removeHandler(stdout_handler)
+    log.addHandler(queue_handler)
+    listener.start()
+    atexit.register(stop_queue)
+    os.register_at_fork(after_in_child=_unqueue_in_child)
+
+
+def _unqueue_in_child():
+    """Forked workers do not have the writer thread, so they write their logs synchronously"""
+    global listener
+    if listener is None:
+        return
+    handler = listener.handlers[0]
+    for h in log.handlers:
+        if isinstance(h, logging.handlers.QueueHandler):
+            for f in h.filters:
+                handler.addFilter(f)
+            log.removeHandler(h)
+    log.addHandler(handler)
+    listener = None
+
+
+def stop_queue():
+    """Flush queued logs and go back to writing them synchronously"""
+    global listener
+    if listener is None:
+        return
+    queue_handler = next(h for h in log.handlers if isinstance(h, logging.handlers.QueueHandler))
+    for f in queue_handler.filters:
+        if isinstance(f, RateLimitFilter) and f.dropped:
+            log.warning('dropped %s messages by rate limit: %s', sum(f.dropped.values()), dict(f.dropped))
+    listener.stop()
+    listener.handlers[0].flush()
+    log.removeHandler(queue_handler)
+    log.addHandler(stdout_handler)
+    listener = None
+
+
+def add_arguments(parser):
+    """Add options for the log sink to an argparse parser"""
+    parser.add_argument('--log-queue', action='store_true', help='Write logs from a background thread')
+    parser.add_argument('--log-json', action='store_true', help='Write logs as JSON lines. Implies --log-queue')
+    parser.add_argument('--log-file', help='Write logs to a file instead of stdout. Implies --log-queue')
+    parser.add_argument('--log-rate', type=float, help='Maximum debug and info messages per second for each category. Implies --log-queue')
+    parser.add_argument('--log-sample', type=int, help='Keep 1 of every N debug and info messages for each category. Implies --log-queue')
+
+
+def configure(args):
+    """Start the log sink described by the options from add_arguments"""
+    if args.log_queue or args.log_json or args.log_file or args.log_rate or args.log_sample:
+        stream = open(args.log_file, 'a') if args.log_file else sys.stdout
+        start_queue(stream, args.log_json, args.log_rate, args.log_sample)
@@ -5,6 +5,7 @@ Utilities for nodes (cursors) in the Clang AST
 from clang.cindex import CursorKind
 from mylog import log
 import clang
+import compdb
 
 
 def pp(node):
@@ -60,8 +61,40 @@ class GlobalIndex:
 
 def parse(filepath, args=[]):
     """
-    Parse filepath and return a cursor to the translation unit
+    Parse filepath and return a cursor to the translation unit.
+    Flags from the compilation database in use come before args.
     """
     index = GlobalIndex.get()
-    translation_unit = index.parse(filepath, args=args)
+    translation_unit = index.parse(filepath, args=compdb.flags(filepath) + list(args))
     return translation_unit.cursor
+
+
+class ParseCache:
+    """
+    Parse each file once for each set of args and keep its translation unit,
+    for running several tools over the same sources in one process
+    """
+
+    def __init__(self):
+        self.cursors = {}
+
+    def parse(self, filepath, args=[]):
+        key = (str(filepath), tuple(args))
+        if key not in self.cursors:
+            self.cursors[key] = parse(str(filepath), args=args)
+        else:
+            log.debug(f'reusing parsed translation unit for {filepath}')
+        return self.cursors[key]
+
+
+def function_definitions(filepath, args=[], parse=parse):
+    """
+    Get (name, line, end line) of each function defined in filepath, not counting included files
+    """
+    root = parse(str(filepath), args=args)
+    definitions = []
+    for child in root.get_children():
+        if child.kind == CursorKind.FUNCTION_DECL and child.is_definition() and \
+                child.location.file is not None and child.location.file.name == str(filepath):
+            definitions.append((child.spelling, child.location.line, child.extent.end.line))
+    return definitions
@@ -0,0 +1,134 @@
+"""
+Persistent index of the functions defined in a project's source files
+"""
+
+from clang.cindex import TranslationUnitLoadError
+from concurrent.futures import ProcessPoolExecutor
+from mylog import log
+from pathlib import Path
+import compdb
+import hashlib
+import jobserver
+import json
+import os
+import sqlite3
+import nodeutils
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS symbols (name TEXT, path TEXT, line INTEGER, end_line INTEGER);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+'''
+
+
+def file_hash(path):
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+
+def index_file(path, clang_args):
+    """
+    Get the function definitions in one file. Runs in a worker process.
+    """
+    try:
+        return path, nodeutils.function_definitions(path, clang_args)
+    except TranslationUnitLoadError:
+        log.warning(f'error parsing file: {path}')
+        return path, []
+
+
+def reset_index():
+    """
+    Give each worker process its own Clang index instead of one inherited from the parent
+    """
+    nodeutils.GlobalIndex._instance = None
+
+
+class SymbolIndex:
+    """
+    On-disk index from function names to the files and lines where they are defined.
+    Files are only parsed again when their contents change.
+    """
+
+    def __init__(self, root, db_path=None):
+        self.root = Path(root).absolute()
+        if db_path is None:
+            db_path = self.root / '.paltools' / 'symbols.db'
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.db_path))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def stale_files(self, paths, clang_args):
+        """
+        Get the files which must be parsed again, updating the timestamps of files which were touched but not changed
+        """
+        args_key = json.dumps(clang_args if not compdb.active() else [clang_args, compdb.fingerprint()])
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', ('clang_args',)).fetchone()
+        if row is None or row[0] != args_key:
+            log.debug(f'clang args changed to {clang_args}, reindexing all files')
+            self.db.execute('DELETE FROM files')
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('clang_args', args_key))
+
+        known = {p: (m, s, h) for p, m, s, h in self.db.execute('SELECT path, mtime_ns, size, hash FROM files')}
+        stale = []
+        for path in paths:
+            st = os.stat(path)
+            if path in known:
+                mtime_ns, size, h = known[path]
+                if (st.st_mtime_ns, st.st_size) == (mtime_ns, size):
+                    continue
+                if st.st_size == size and file_hash(path) == h:
+                    self.db.execute('UPDATE files SET mtime_ns = ? WHERE path = ?', (st.st_mtime_ns, path))
+                    continue
+            stale.append(path)
+        return stale
+
+    def update(self, pattern='**/*.c', clang_args=[], jobs=None):
+        """
+        Bring the index up to date with the source files under root, parsing changed files in parallel
+        """
+        paths = sorted(str(p) for p in self.root.glob(pattern) if p.is_file())
+        with self.db:
+            path_set = set(paths)
+            removed = [p for p, in self.db.execute('SELECT path FROM files') if p not in path_set]
+            for path in removed:
+                self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+                self.db.execute('DELETE FROM symbols WHERE path = ?', (path,))
+
+            stale = self.stale_files(paths, clang_args)
+            log.debug(f'symbol index: {len(paths)} files, {len(stale)} to parse, {len(removed)} removed')
+            if not stale:
+                return
+
+            with jobserver.executor(ProcessPoolExecutor, max_workers=jobs, initializer=reset_index) as pool:
+                results = pool.map(index_file, stale, [clang_args] * len(stale), chunksize=8)
+                for path, definitions in results:
+                    st = os.stat(path)
+                    self.db.execute('DELETE FROM symbols WHERE path = ?', (path,))
+                    self.db.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?)',
+                                        ((name, path, line, end_line) for name, line, end_line in definitions))
+                    self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                    (path, st.st_mtime_ns, st.st_size, file_hash(path)))
+
+    def lookup(self, name):
+        """
+        Get (path, line, end_line) of each definition of the function name
+        """
+        return self.db.execute('SELECT path, line, end_line FROM symbols WHERE name = ? ORDER BY path, line', (name,)).fetchall()
+
+    def definitions(self, path):
+        """
+        Get (name, line, end_line) of each function defined in path
+        """
+        return self.db.execute('SELECT name, line, end_line FROM symbols WHERE path = ? ORDER BY line', (str(path),)).fetchall()
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import compdb
+from compdb import CompilationDatabase, command_arguments, parse_flags
+
+
+class TestParseFlags(unittest.TestCase):
+
+    def test_drops_output_compile_and_source(self):
+        flags = parse_flags(['cc', '-c', '-o', 'out/a.o', '-O2', '-Wall', '-DX=1', 'src/a.c', '-MF', 'a.d'], '/build')
+        self.assertEqual(['-DX=1'], flags)
+
+    def test_relative_paths_from_directory(self):
+        flags = parse_flags(['cc', '-Iinclude', '-I', '../common', '-I/usr/include/x', '-include', 'config.h', '--sysroot=sys', '-c', 'a.c'], '/build/proj')
+        self.assertEqual(['-I/build/proj/include', '-I', '/build/common', '-I/usr/include/x', '-include', '/build/proj/config.h',
+                          '--sysroot=/build/proj/sys'], flags)
+
+    def test_keeps_parsing_flags(self):
+        flags = parse_flags(['clang', '-std=c99', '-U', 'NDEBUG', '-target', 'x86_64-linux-gnu', '-fno-builtin', '-m32', '-x', 'c', 'a.c'], '/')
+        self.assertEqual(['-std=c99', '-U', 'NDEBUG', '-target', 'x86_64-linux-gnu', '-fno-builtin', '-m32'], flags)
+
+    def test_arguments_or_command(self):
+        arguments = ['cc', '-I', 'my dir', '-DNAME="a b"', '-c', 'a.c']
+        self.assertEqual(arguments, command_arguments({'arguments': arguments, 'command': 'ignored'}))
+        self.assertEqual(arguments, command_arguments({'command': 'cc -I "my dir" \'-DNAME="a b"\' -c a.c'}))
+        self.assertEqual(['-I', '/src/my dir', '-DNAME="a b"'], parse_flags(command_arguments({'command': 'cc -I "my dir" \'-DNAME="a b"\' -c a.c'}), '/src'))
+
+
+class TestCompilationDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        (self.root / 'src').mkdir()
+        self.write([
+            {'directory': str(self.root), 'file': 'src/a.c', 'arguments': ['cc', '-Iinc', '-DA', '-c', 'src/a.c']},
+            {'directory': str(self.root / 'src'), 'file': 'b.c', 'command': 'cc -DB -c b.c'},
+        ])
+        self.db = CompilationDatabase(self.root)
+        self.addCleanup(self.db.close)
+
+    def write(self, entries):
+        path = self.root / 'compile_commands.json'
+        path.write_text(json.dumps(entries))
+        if hasattr(self, 'db'):
+            # Make sure the change is seen even within the mtime's resolution
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def test_flags(self):
+        self.assertEqual([f'-I{self.root}/inc', '-DA'], self.db.flags(self.root / 'src' / 'a.c'))
+        self.assertEqual(['-DB'], self.db.flags(str(self.root / 'src' / 'b.c')))
+        self.assertEqual(self.root / '.paltools' / 'compdb.db', self.db.db_path)
+
+    def test_header_gets_flags_of_same_directory(self):
+        self.assertEqual([f'-I{self.root}/inc', '-DA'], self.db.flags(self.root / 'src' / 'a.h'))
+        self.assertEqual([], self.db.flags(self.root / 'other' / 'c.c'))
+
+    def test_reindexes_when_changed(self):
+        self.db.update()
+        self.assertEqual(['-DB'], self.db.flags(self.root / 'src' / 'b.c'))
+        self.write([{'directory': str(self.root / 'src'), 'file': 'b.c', 'arguments': ['cc', '-DC', '-c', 'b.c']}])
+        self.db.update()
+        self.assertEqual(['-DC'], self.db.flags(self.root / 'src' / 'b.c'))
+        # a.c is gone from the database, so it gets the flags of b.c in the same directory
+        self.assertEqual(['-DC'], self.db.flags(self.root / 'src' / 'a.c'))
+
+    def test_index_persists(self):
+        self.db.close()
+        with mock.patch.object(compdb.json, 'load', side_effect=AssertionError('read the JSON file again')), \
+                CompilationDatabase(self.root / 'compile_commands.json') as db:
+            stamp = db.stamp()
+            self.assertEqual(['-DB'], db.flags(self.root / 'src' / 'b.c'))
+        self.assertEqual(stamp, self.db.stamp())
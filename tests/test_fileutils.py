@@ -0,0 +1,48 @@
+import os
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import fileutils
+from fileutils import write_atomic
+
+
+class TestWriteAtomic(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = Path(self.tmpdir.name) / 'harness.c'
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.path).st_mode)
+
+    def test_text_and_bytes(self):
+        write_atomic(self.path, 'int x;\n')
+        self.assertEqual('int x;\n', self.path.read_text())
+        write_atomic(self.path, b'\0\1')
+        self.assertEqual(b'\0\1', self.path.read_bytes())
+        self.assertEqual(['harness.c'], os.listdir(self.tmpdir.name))
+
+    def test_new_file_mode_follows_umask(self):
+        with mock.patch.object(fileutils, '_umask', 0o022):
+            write_atomic(self.path, 'int x;\n')
+        self.assertEqual(0o644, self.mode())
+        self.path.unlink()
+        with mock.patch.object(fileutils, '_umask', 0o027):
+            write_atomic(self.path, 'int x;\n')
+        self.assertEqual(0o640, self.mode())
+
+    def test_keeps_mode_of_replaced_file(self):
+        self.path.write_text('old\n')
+        os.chmod(self.path, 0o664)
+        write_atomic(self.path, 'new\n')
+        self.assertEqual(0o664, self.mode())
+
+    def test_failed_write_leaves_file(self):
+        self.path.write_text('old\n')
+        with self.assertRaises(TypeError):
+            write_atomic(self.path, 42)
+        self.assertEqual('old\n', self.path.read_text())
+        self.assertEqual(['harness.c'], os.listdir(self.tmpdir.name))
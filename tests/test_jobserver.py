@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import jobserver
+from jobserver import JobServer, LimitedExecutor, Semaphore, jobserver_from_makeflags
+
+
+class TestJobServer(unittest.TestCase):
+
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, b'++')
+        self.makeflags = f' -j3 --jobserver-auth={self.read_fd},{self.write_fd}'
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def test_connects_from_makeflags(self):
+        server = jobserver_from_makeflags(self.makeflags)
+        self.assertIsInstance(server, JobServer)
+        self.assertEqual((self.read_fd, self.write_fd), (server.read_fd, server.write_fd))
+        self.assertIsInstance(jobserver_from_makeflags(f'--jobserver-fds={self.read_fd},{self.write_fd} -j'), JobServer)
+        self.assertIsNone(jobserver_from_makeflags('-j4'))
+
+    def test_unusable_fds_fall_back(self):
+        with self.assertLogs(jobserver.log, 'WARNING'):
+            self.assertIsNone(jobserver_from_makeflags('--jobserver-auth=1000,1001'))
+        with self.assertLogs(jobserver.log, 'WARNING'):
+            self.assertIsNone(jobserver_from_makeflags('--jobserver-auth=fifo:/nonexistent/fifo'))
+
+    def test_implicit_slot_then_tokens_returned(self):
+        server = jobserver_from_makeflags(self.makeflags)
+        tokens = [server.acquire() for _ in range(3)]
+        self.assertEqual([None, b'+', b'+'], tokens)
+        for token in tokens:
+            server.release(token)
+        self.assertEqual(b'++', os.read(self.read_fd, 10))
+
+    def test_token_taken_after_select(self):
+        # Another job takes the token between select and read, then the implicit slot is released
+        server = jobserver_from_makeflags(self.makeflags)
+        self.assertFalse(os.get_blocking(self.read_fd))
+        self.assertIsNone(server.acquire())
+        os.read(self.read_fd, 2)
+        tokens = []
+        with mock.patch.object(jobserver.select, 'select', return_value=([self.read_fd], [], [])):
+            thread = threading.Thread(target=lambda: tokens.append(server.acquire()), daemon=True)
+            thread.start()
+            time.sleep(0.05)
+            server.release(None)
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([None], tokens)
+        os.write(self.write_fd, b'++')
+
+    def test_executor_holds_at_most_the_jobservers_slots(self):
+        running = peak = 0
+        lock = threading.Lock()
+
+        def work(x):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return x * x
+
+        server = jobserver_from_makeflags(self.makeflags)
+        with LimitedExecutor(ThreadPoolExecutor(max_workers=8), server, 8) as pool:
+            results = list(pool.map(work, range(20), chunksize=3))
+        self.assertEqual([x * x for x in range(20)], results)
+        self.assertEqual(3, peak)
+        self.assertEqual(b'++', os.read(self.read_fd, 10))
+
+
+class TestWithoutJobServer(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(jobserver, _server=None, _checked=True, _default_slots=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_explicit_jobs_above_cpu_count(self):
+        jobs = (os.cpu_count() or 1) + 4
+        barrier = threading.Barrier(jobs, timeout=5)
+        with jobserver.executor(ThreadPoolExecutor, max_workers=jobs) as pool:
+            # Every task waits for all of the others, so this only finishes if all run at once
+            list(pool.map(lambda _: barrier.wait(), range(jobs)))
+
+    def test_default_pools_share_cpu_slots(self):
+        self.assertIs(jobserver.slots(), jobserver.slots())
+        self.assertIsInstance(jobserver.slots(), Semaphore)
+        self.assertIsNot(jobserver.slots(2), jobserver.slots(2))
@@ -0,0 +1,95 @@
+import io
+import json
+import logging
+import unittest
+import mylog
+from mylog import CappedLog, JsonFormatter, RateLimitFilter
+
+
+def record(msg='m', level=logging.INFO, created=0.0, category=None):
+    r = logging.LogRecord('test', level, __file__, 1, msg, None, None)
+    r.created = created
+    if category is not None:
+        r.category = category
+    return r
+
+
+class TestCappedLog(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test.mylog')
+        self.logger.setLevel(logging.DEBUG)
+
+    def test_caps_and_counts(self):
+        capped = CappedLog(limit=2, category='test cap', logger=self.logger)
+        before = mylog.counts['test cap']
+        with self.assertLogs(self.logger, logging.DEBUG) as logs:
+            printed = [capped('item %d', i) for i in range(5)]
+        self.assertEqual([True, True, False, False, False], printed)
+        self.assertEqual(['item 0', 'item 1', '^^^ CAPPING this log at 2 items ^^^'], [r.getMessage() for r in logs.records])
+        self.assertEqual(['test cap'] * 3, [r.category for r in logs.records])
+        self.assertEqual(5, mylog.counts['test cap'] - before)
+
+    def test_does_not_format_disabled_messages(self):
+        self.logger.setLevel(logging.INFO)
+        capped = CappedLog(logger=self.logger)
+        self.assertFalse(capped(lambda: self.fail('formatted a disabled message')))
+
+    def test_level_of_logger_method(self):
+        self.logger.setLevel(logging.WARNING)
+        capped = CappedLog(log_fn=self.logger.warning)
+        self.assertEqual(logging.WARNING, capped.level)
+        with self.assertLogs(self.logger, logging.WARNING):
+            self.assertTrue(capped('warned'))
+
+    def test_custom_log_fn_needs_level(self):
+        with self.assertRaises(ValueError):
+            CappedLog(log_fn=print)
+        self.assertEqual(logging.INFO, CappedLog(log_fn=print, level=logging.INFO).level)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_rate(self):
+        f = RateLimitFilter(rate=2)
+        kept = [f.filter(record(created=t)) for t in [0, 0, 0, 0.2, 1.0]]
+        self.assertEqual([True, True, False, False, True], kept)
+        self.assertEqual({'test': 2}, dict(f.dropped))
+
+    def test_sample_per_category(self):
+        f = RateLimitFilter(sample=3)
+        kept = [f.filter(record(category=c)) for c in ['a', 'a', 'b', 'a', 'a']]
+        self.assertEqual([True, False, True, False, True], kept)
+        self.assertEqual({'a': 2}, dict(f.dropped))
+
+    def test_never_drops_warnings(self):
+        f = RateLimitFilter(rate=1, sample=10)
+        self.assertTrue(all(f.filter(record(level=logging.WARNING)) for _ in range(5)))
+
+
+class TestJson(unittest.TestCase):
+
+    def test_json_lines(self):
+        entry = json.loads(JsonFormatter().format(record('hello %s', category='node')))
+        self.assertEqual(('INFO', 'node'), (entry['level'], entry['category']))
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            r = logging.LogRecord('test', logging.ERROR, __file__, 1, 'failed', None, __import__('sys').exc_info())
+        self.assertIn('ValueError: boom', json.loads(JsonFormatter().format(r))['exception'])
+
+    def test_queue_writes_json_and_reports_drops(self):
+        stream = io.StringIO()
+        level = mylog.log.level
+        mylog.log.setLevel(logging.INFO)
+        try:
+            mylog.start_queue(stream, json_lines=True, sample=2)
+            for i in range(4):
+                mylog.log.info('message %d', i)
+            mylog.stop_queue()
+        finally:
+            mylog.log.setLevel(level)
+        lines = [json.loads(l) for l in stream.getvalue().splitlines()]
+        self.assertEqual(['message 0', 'message 2'], [l['message'] for l in lines[:2]])
+        self.assertEqual(('WARNING', "dropped 2 messages by rate limit: {'root': 2}"), (lines[2]['level'], lines[2]['message']))
+        self.assertIn(mylog.stdout_handler, mylog.log.handlers)
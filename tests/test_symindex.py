@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from symindex import SymbolIndex
+
+
+class TestSymbolIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'a.c').write_text('int f(int x) { return x; }\n')
+        (self.root / 'b.c').write_text('int g(int x) {\n  return x;\n}\n')
+        self.index = SymbolIndex(self.root)
+        self.index.update(jobs=1)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return str(self.root.absolute() / name)
+
+    def touch(self, name, text=None):
+        """Rewrite a file with a newer mtime"""
+        path = self.root / name
+        if text is not None:
+            path.write_text(text)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def stale(self):
+        return self.index.stale_files([self.path('a.c'), self.path('b.c')], [])
+
+    def test_lookup(self):
+        self.assertEqual([(self.path('a.c'), 1, 1)], self.index.lookup('f'))
+        self.assertEqual([(self.path('b.c'), 1, 3)], self.index.lookup('g'))
+        self.assertEqual([('g', 1, 3)], self.index.definitions(self.path('b.c')))
+        self.assertEqual([], self.stale())
+
+    def test_touched_but_unchanged_file_is_not_parsed(self):
+        self.touch('a.c')
+        self.assertEqual([], self.stale())
+        # The new mtime was recorded, so the file is not even hashed next time
+        self.assertEqual([], self.stale())
+
+    def test_changed_file_is_parsed(self):
+        self.touch('a.c', 'int h(int x) { return x; }\n')
+        self.assertEqual([self.path('a.c')], self.stale())
+        self.index.update(jobs=1)
+        self.assertEqual([], self.index.lookup('f'))
+        self.assertEqual([(self.path('a.c'), 1, 1)], self.index.lookup('h'))
+
+    def test_resized_file_is_parsed(self):
+        self.touch('b.c', 'int g(int x) {\n  return x + 1;\n}\n')
+        self.assertEqual([self.path('b.c')], self.stale())
+
+    def test_removed_file(self):
+        (self.root / 'b.c').unlink()
+        self.index.update(jobs=1)
+        self.assertEqual([], self.index.lookup('g'))
+        self.assertEqual([(self.path('a.c'), 1, 1)], self.index.lookup('f'))
+
+    def test_changed_clang_args_reindex_everything(self):
+        self.assertEqual([self.path('a.c'), self.path('b.c')],
+                         self.index.stale_files([self.path('a.c'), self.path('b.c')], ['-DX']))
+
+    def test_index_persists(self):
+        with SymbolIndex(self.root) as index:
+            self.assertEqual([(self.path('a.c'), 1, 1)], index.lookup('f'))
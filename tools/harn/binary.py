@@ -0,0 +1,178 @@
+"""
+Binary input encoding for test harnesses generated with -m mmap.
+
+An input file is the magic bytes HARN, a little-endian u32 layout id, then each field in layout order:
+- int: i64
+- uint: u64
+- double, float: f64
+- char: one byte
+- string: u32 length, the bytes and a NUL terminator. The length 0xffffffff with no bytes is NULL.
+- array: u32 element count, then each element encoded as above
+"""
+
+from mylog import log
+from pathlib import Path
+import argparse
+import json
+import logging
+import re
+import struct
+import zlib
+
+MAGIC = b'HARN'
+NULL_LENGTH = 0xffffffff
+LAYOUT_VERSION = 1
+
+formats = {
+    'int': '<q',
+    'uint': '<Q',
+    'double': '<d',
+    'float': '<d',
+    'char': '<c',
+}
+
+c_readers = {
+    'int': 'read_i64()',
+    'uint': 'read_u64()',
+    'double': 'read_f64()',
+    'float': 'read_f64()',
+    'char': 'read_char()',
+    'string': 'read_str()',
+}
+
+
+class BinaryInput:
+    """
+    Read each input field from a memory-mapped binary input file and record the layout of the fields
+    """
+    arrays = True
+
+    def __init__(self):
+        self.fields = []
+
+    def read(self, kind, varname, type):
+        self.fields.append({'name': varname, 'kind': kind, 'type': type.spelling})
+        return c_readers[kind]
+
+    def read_array(self, kind, varname, type):
+        capacity = type.element_count
+        self.fields.append({'name': varname, 'kind': 'array', 'type': type.spelling, 'element': kind, 'capacity': capacity})
+        return f'for (uint32_t harn_i = 0, harn_n = read_count({capacity}); harn_i < harn_n; harn_i++)\n  {varname}[harn_i] = {c_readers[kind]};'
+
+    def finish(self, inits):
+        """
+        Order the fields as the initializers read them, since stmts_for_param yields nested fields first
+        """
+        def position(field):
+            for i, stmt in enumerate(inits):
+                if stmt.startswith(f'{field["name"]} = ') or f'\n  {field["name"]}[harn_i] = ' in stmt:
+                    return i
+            return len(inits)
+        self.fields.sort(key=position)
+
+    @property
+    def layout_id(self):
+        return layout_id(self.fields)
+
+    def layout(self):
+        return {'version': LAYOUT_VERSION, 'layout_id': self.layout_id, 'fields': self.fields}
+
+
+def layout_id(fields):
+    """
+    Identify a layout by the kinds of its fields, so that inputs encoded for a different layout are rejected
+    """
+    kinds = ','.join(f.get('element', f['kind']) + ('[]' if f['kind'] == 'array' else '') for f in fields)
+    return zlib.crc32(kinds.encode())
+
+
+def c_int(text):
+    """
+    Parse text like atoi and strtoul, reading the longest prefix which is a decimal integer
+    """
+    m = re.match(r'\s*[+-]?\d+', text)
+    return int(m.group(0)) if m else 0
+
+
+def c_float(text):
+    """
+    Parse text like strtod, reading the longest prefix which is a decimal float
+    """
+    m = re.match(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?', text)
+    return float(m.group(0)) if m else 0.0
+
+
+def encode_value(kind, text):
+    if kind == 'int':
+        return struct.pack(formats[kind], (c_int(text) + 2**63) % 2**64 - 2**63)
+    elif kind == 'uint':
+        return struct.pack(formats[kind], c_int(text) % 2**64)
+    elif kind in ('double', 'float'):
+        return struct.pack(formats[kind], c_float(text))
+    elif kind == 'char':
+        return text.encode()[:1] or b'\0'
+    elif kind == 'string':
+        if text == 'NULL':
+            return struct.pack('<I', NULL_LENGTH)
+        data = text.encode()
+        return struct.pack('<I', len(data)) + data + b'\0'
+    else:
+        raise Exception(f'invalid field kind: {kind}')
+
+
+def encode(layout, values):
+    """
+    Encode textual input values, one per field of the layout, to binary.
+    Array values are whitespace-separated elements, except char arrays which hold the characters of the text.
+    """
+    fields = layout['fields']
+    if len(values) < len(fields):
+        raise Exception(f'expected {len(fields)} input values, got {len(values)}')
+    elif len(values) > len(fields):
+        log.warning(f'ignoring {len(values) - len(fields)} extra input values')
+
+    data = [MAGIC, struct.pack('<I', layout['layout_id'])]
+    for field, text in zip(fields, values):
+        if field['kind'] == 'array':
+            if field['element'] == 'char':
+                elements = list(text) + ([''] if len(text) < field['capacity'] else [])
+            else:
+                elements = text.split()
+            if len(elements) > field['capacity']:
+                raise Exception(f'{field["name"]} holds {field["capacity"]} elements, got {len(elements)}')
+            data.append(struct.pack('<I', len(elements)))
+            data += (encode_value(field['element'], e) for e in elements)
+        else:
+            data.append(encode_value(field['kind'], text))
+    return b''.join(data)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='harn encode', description='Encode textual inputs (one value per line) to the binary input format of -m mmap')
+    parser.add_argument('layout', help='Path to the layout file written by harn -m mmap')
+    parser.add_argument('inputs', nargs='+', help='Textual input files')
+    parser.add_argument('-o', '--output-dir', help='Directory to write binary inputs to, with the same file names. Default: next to each input with the suffix .bin', type=Path)
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (ex. DEBUG, INFO, ERROR)', type=str)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+
+    layout = json.loads(Path(args.layout).read_text())
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+    for input_file in map(Path, args.inputs):
+        if args.output_dir:
+            output_file = args.output_dir / input_file.name
+        else:
+            output_file = input_file.with_name(input_file.name + '.bin')
+        try:
+            output_file.write_bytes(encode(layout, input_file.read_text().splitlines()))
+            log.info(f'encoded {input_file} to {output_file}')
+        except:
+            log.exception(f'error encoding {input_file}')
+            return 1
+    return 0
@@ -0,0 +1,28 @@
+"""
+Format generated C code with clang-format
+"""
+
+from mylog import log
+import shutil
+import subprocess
+
+STYLE = 'Google'
+
+
+def have_clang_format():
+    if shutil.which('clang-format'):
+        return True
+    log.warning('clang-format not found')
+    return False
+
+
+def format_text(text, style=STYLE):
+    """
+    Format one source text by piping it through clang-format's stdin.
+    Returns the text unchanged if clang-format is not installed.
+    """
+    if not have_clang_format():
+        return text
+    proc = subprocess.run(['clang-format', f'-style={style}', '-assume-filename=harness.c'],
+                          input=text, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return proc.stdout
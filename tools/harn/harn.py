@@ -7,18 +7,95 @@ Generate a test harness for a code segment
 from clang.cindex import CursorKind, TypeKind
 
 import argparse
-import shutil
-import subprocess
-import os
+import hashlib
+import json
 import logging
 import re
+import sys
 
 from mylog import log
+import compdb
+import fileutils
+import metrics
+import mylog
 from pathlib import Path
 from nodeutils import find, parse, pp
+from symindex import SymbolIndex
+from . import fmt, run, binary
+from .binary import BinaryInput
+from .templates import templates, VERSION as TEMPLATE_VERSION
 
+FINGERPRINT_PREFIX = '// harn fingerprint: '
 
-def stmts_for_param(type, varname, stack=[]):
+
+def declaration(type_spelling, varname):
+    """
+    Declare varname with pointers aligned to the type, as clang-format's Google style does
+    """
+    type_spelling = re.sub(r'\s*\*', '*', type_spelling)
+    type_spelling = re.sub(r'\*(?=\w)', '* ', type_spelling)
+    array = re.match(r'(.*?)\s*(\[.*\])$', type_spelling)
+    if array:
+        return f'{array.group(1)} {varname}{array.group(2)};'
+    return f'{type_spelling} {varname};'
+
+
+def indent(stmts, level=1):
+    """
+    Indent statements to be placed in a function body, including every line of multi-line statements
+    """
+    return '\n'.join(('  ' * level + l) if l else l for s in stmts for l in s.split('\n'))
+
+
+class TextInput:
+    """
+    Read each input field from the text of one argument
+    """
+    arrays = False
+    layout_id = None
+
+    def read(self, kind, varname, type):
+        shift_argv = 'shift_argi()'
+        return {
+            'int': f'atoi({shift_argv})',
+            'uint': f'strtoul({shift_argv}, NULL, 10)',
+            'double': f'strtod({shift_argv}, NULL)',
+            'float': f'atof({shift_argv})',
+            'char': f'{shift_argv}[0]',
+            'string': shift_argv,
+        }[kind]
+
+    def finish(self, inits):
+        pass
+
+
+def primitive_kind(type):
+    """
+    Get the kind of input field for a primitive type, or None if the type is not primitive
+    """
+    if type.kind == TypeKind.INT or \
+        type.kind == TypeKind.SHORT or \
+        type.kind == TypeKind.LONG or \
+        type.kind == TypeKind.LONGLONG or \
+        type.kind == TypeKind.INT128 or \
+        type.kind == TypeKind.ENUM:
+        return 'int'
+    elif type.kind == TypeKind.UINT or \
+        type.kind == TypeKind.ULONG or \
+        type.kind == TypeKind.ULONGLONG or \
+        type.kind == TypeKind.UINT128:
+        return 'uint'
+    elif type.kind == TypeKind.DOUBLE or type.kind == TypeKind.LONGDOUBLE:
+        return 'double'
+    elif type.kind == TypeKind.FLOAT:
+        return 'float'
+    elif type.kind == TypeKind.CHAR_S:
+        return 'char'
+    else:
+        return None
+
+
+def stmts_for_param(type, varname, stack=[], reader=TextInput()):
     """
     Yields input variables for type t's fields, down to primitives
     """
@@ -27,12 +104,11 @@ def stmts_for_param(type, varname, stack=[]):
 
     decls = []
     inits = []
-    shift_argv = 'shift_argi()'
 
     log.debug(f'variable {varname} type {type.spelling} (kind {type.kind})')
 
     if not (type.kind == TypeKind.FUNCTIONPROTO or (type.kind == TypeKind.POINTER and type.get_pointee().kind == TypeKind.FUNCTIONPROTO)):
-        decls.append(f'{type.spelling} {varname.replace(".", "_")};')
+        decls.append(declaration(type.spelling, varname.replace(".", "_")))
 
     if type.kind == TypeKind.ELABORATED or type.kind == TypeKind.RECORD:
         td = type.get_declaration()
@@ -50,46 +126,32 @@ def stmts_for_param(type, varname, stack=[]):
                         inits.append(f'// TODO recursive {child_varname} = <{type.spelling}>;')
                     else:
                         if child.type.get_pointee().kind == TypeKind.CHAR_S:
-                            inits.append(f'{child_varname} = {shift_argv};')
+                            inits.append(f'{child_varname} = {reader.read("string", child_varname, child.type)};')
                         elif child.type.spelling in (s.spelling for s in stack):
                             pass
                         else:
                             valname = f'{child.spelling.replace(".", "_")}_v'
-                            yield from stmts_for_param(child.type.get_pointee(), valname, stack=stack+[child.type])
+                            yield from stmts_for_param(child.type.get_pointee(), valname, stack=stack+[child.type], reader=reader)
                             inits.append(f'{child_varname} = &{valname};')
                 else:
-                    child_inits = zip(*stmts_for_param(child.type, f'{child_varname}', stack=stack+[child.type]))
+                    child_inits = zip(*stmts_for_param(child.type, f'{child_varname}', stack=stack+[child.type], reader=reader))
                     yield from (([], c) for l in child_inits for c in l)
         else:
             log.warning(f'no fields found for type {type.spelling} (kind {type.kind})')
     elif type.kind == TypeKind.POINTER:
         if type.get_pointee().kind == TypeKind.CHAR_S:
-            inits.append(f'{varname} = {shift_argv};')
+            inits.append(f'{varname} = {reader.read("string", varname, type)};')
         elif type.get_pointee().kind == TypeKind.FUNCTIONPROTO:
             inits.append(f'// TODO functionptr {varname} = <{type.spelling}>;')
         else:
             valname = f'{varname}_v'
-            yield from stmts_for_param(type.get_pointee(), valname, stack=stack+[type])
+            yield from stmts_for_param(type.get_pointee(), valname, stack=stack+[type], reader=reader)
             if type.get_pointee().kind != TypeKind.FUNCTIONPROTO:
                 inits.append(f'{varname} = &{valname};')
-    elif type.kind == TypeKind.INT or \
-        type.kind == TypeKind.SHORT or \
-        type.kind == TypeKind.LONG or \
-        type.kind == TypeKind.LONGLONG or \
-        type.kind == TypeKind.INT128 or \
-        type.kind == TypeKind.ENUM:
-        inits.append(f'{varname} = atoi({shift_argv});')
-    elif type.kind == TypeKind.UINT or \
-        type.kind == TypeKind.ULONG or \
-        type.kind == TypeKind.ULONGLONG or \
-        type.kind == TypeKind.UINT128:
-        inits.append(f'{varname} = strtoul({shift_argv}, NULL, 10);')
-    elif type.kind == TypeKind.DOUBLE or type.kind == TypeKind.LONGDOUBLE:
-        inits.append(f'{varname} = strtod({shift_argv}, NULL);')
-    elif type.kind == TypeKind.FLOAT:
-        inits.append(f'{varname} = atof({shift_argv});')
-    elif type.kind == TypeKind.CHAR_S:
-        inits.append(f'{varname} = {shift_argv}[0];')
+    elif primitive_kind(type):
+        inits.append(f'{varname} = {reader.read(primitive_kind(type), varname, type)};')
+    elif type.kind == TypeKind.CONSTANTARRAY and primitive_kind(type.element_type.get_canonical()) and reader.arrays:
+        inits.append(reader.read_array(primitive_kind(type.element_type.get_canonical()), varname, type))
     elif type.kind == TypeKind.FUNCTIONPROTO:
         pass
     else:
@@ -98,7 +160,7 @@ def stmts_for_param(type, varname, stack=[]):
     yield decls, inits
 
 
-def stmtgen(parameters):
+def stmtgen(parameters, reader=TextInput()):
     """
     Get declaration and initializer statements for the given parameters
     """
@@ -106,7 +168,7 @@ def stmtgen(parameters):
     inits = []
 
     for i, parm in enumerate(parameters):
-        stmts = list(stmts_for_param(parm.type, parm.displayname))
+        stmts = list(stmts_for_param(parm.type, parm.displayname, reader=reader))
         parm_decls, parm_inits = zip(*stmts)
         log.info(
             f'parameter {pp(parm)}({i}) produces {len(parm_decls)} local variable declarations and {len(parm_inits)} initializer statements')
@@ -126,57 +188,78 @@ def callgen(fn, parameters):
     return f'{fn.spelling}({parameters_text});'
 
 
-def codegen(target):
+def codegen(target, mode='argv', reader=None):
     """
     Generate code for parameter names and code statements
     """
+    if reader is None:
+        reader = BinaryInput() if mode == 'mmap' else TextInput()
     
     parameters = list(target.get_arguments())
     log.info(f'target function has {len(parameters)} parameters')
 
-    decls, inits = stmtgen(parameters)
+    decls, inits = stmtgen(parameters, reader)
     call = callgen(target, parameters)
+    reader.finish(inits)
+    num_fields = sum(i.count('shift_argi()') for i in inits)
+    log.info(f'test harness reads {num_fields} input fields')
 
-    template = '''
-#include <assert.h>
-#include <stdio.h>
-#include <stdlib.h>
-#include <string.h>
-
-// argi is used for iterating through the input arguments
-int argi = 1;
-int global_argc;
-char **global_argv;
-
-char *shift_argi() {{
-    int old_argi = argi;
-    argi++;
-    assert(old_argi < global_argc);
-    char *return_value = global_argv[old_argi];
-    if (strcmp(return_value, "NULL") == 0) {{
-        return_value = NULL;
-    }}
-    return return_value;
-}}
-
-int main(int argc, char **argv) {{
-global_argc = argc;
-global_argv = argv;
-
-// declarations
-{declarations}
-
-// initializers
-{initializers}
-
-// call into segment
-{call}
-}}
-'''
-    sub = template.format(declarations='\n'.join(decls), initializers='\n'.join(inits), call=call)
+    template = templates[mode]
+    sub = template.format(declarations=indent(decls), initializers=indent(inits), call=indent([call]), num_fields=num_fields, layout_id=reader.layout_id)
     return sub
 
 
+def type_closure(type, closure):
+    """
+    Add the canonical types reachable from type, with the fields of each record, to closure
+    """
+    type = type.get_canonical()
+    if type.spelling in closure:
+        return
+    closure[type.spelling] = [str(type.kind)]
+    if type.kind == TypeKind.ELABORATED or type.kind == TypeKind.RECORD:
+        for child in type.get_declaration().get_children():
+            closure[type.spelling].append([str(child.kind), child.spelling, child.type.get_canonical().spelling])
+            type_closure(child.type, closure)
+    elif type.kind == TypeKind.POINTER:
+        type_closure(type.get_pointee(), closure)
+    elif type.kind == TypeKind.CONSTANTARRAY:
+        type_closure(type.element_type, closure)
+
+
+def fingerprint(target, mode, input_text, no_format=False):
+    """
+    Hash everything the test harness is generated from: the template version and mode,
+    the target's signature, the closure of types its parameters reach and the input file's text
+    """
+    parameters = list(target.get_arguments())
+    closure = {}
+    for parm in parameters:
+        type_closure(parm.type, closure)
+    key = {
+        'version': TEMPLATE_VERSION,
+        'mode': mode,
+        'no_format': no_format,
+        'target': target.spelling,
+        'parameters': [[p.displayname, p.type.get_canonical().spelling] for p in parameters],
+        'types': closure,
+        'input': hashlib.sha256(input_text.encode()).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def read_fingerprint(path):
+    """
+    Get the fingerprint on the first line of a generated test harness, or None
+    """
+    try:
+        with open(path) as f:
+            line = f.readline()
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
+    return line[len(FINGERPRINT_PREFIX):].strip() if line.startswith(FINGERPRINT_PREFIX) else None
+
+
 def select_target(func_name, cur):
     """
     Select target function with the given name from cur
@@ -195,10 +278,15 @@ def select_target(func_name, cur):
 
 def get_clang_flags(args):
     """
-    Aggregate clang flags from args and Makefile if specified
+    Aggregate clang flags from args and Makefile if specified.
+    A compilation database (--compdb, or compile_commands.json in the project directory) is preferred to the Makefile.
     """
     clang_flags = args.clang_flags[0].split() if args.clang_flags else []
-    if args.directory:
+    if not compdb.active() and args.directory and (args.directory/'compile_commands.json').is_file():
+        compdb.use(args.directory)
+    if compdb.active():
+        log.debug('taking clang flags from the compilation database')
+    elif args.directory:
         makefile = args.directory/'Makefile'
         log.debug(f'path to Makefile: {makefile}')
         assert(makefile.is_file())
@@ -207,44 +295,69 @@ def get_clang_flags(args):
     return clang_flags
 
 
-def output(args, input_text, test_harness):
+def render(input_text, test_harness, no_format=False, fingerprint=None):
     """
-    Output test_harness to file or stdout, depending on args
+    Put the test harness after the input file's text and format it, with the fingerprint on the first line if given
     """
-    outfile = args.output[0] if args.output else None
-
     raw_text = f'''
 {input_text}
 // test harness
-{test_harness}
+{test_harness.rstrip()}
 '''
+    text = raw_text if no_format else fmt.format_text(raw_text)
+    return text if fingerprint is None else f'{FINGERPRINT_PREFIX}{fingerprint}\n{text}'
+
+
+def output(args, input_text, test_harness, fingerprint=None):
+    """
+    Output test_harness to file or stdout, depending on args.
+    The fingerprint is only written to an output file, since only files are compared with it.
+    """
+    outfile = args.output[0] if args.output else None
+    text = render(input_text, test_harness, args.no_format, fingerprint if outfile else None)
 
     if outfile:
         log.info(f'writing to output file {outfile}')
-        with open(outfile, 'w') as f:
-            f.write(raw_text)
-        if not args.no_format:
-            if shutil.which('clang-format'):
-                subprocess.call(['clang-format', outfile, '-i', '-style=Google'])
-            else:
-                log.warn('clang-format not found')
+        fileutils.write_atomic(outfile, text)
     else:
         log.info('generated test harness:')
-        if not args.no_format:
-            if shutil.which('clang-format'):
-                tmp_filename = '/tmp/parse.py.fmt.c'
-                log.info(f'writing to temporary file {tmp_filename}')
-                with open(tmp_filename, 'w') as f:
-                    f.write(raw_text)
-                subprocess.call(['clang-format', tmp_filename, '-i', '-style=Google'])
-                with open(tmp_filename, 'r') as f:
-                    formatted_text = f.read()
-                os.remove(tmp_filename)
-                print(formatted_text)
-            else:
-                log.warn('clang-format not found')
-        else:
-            print(raw_text)
+        print(text)
+
+
+def guess_input_file(directory, func_name):
+    """
+    Find the file which defines the target function, or else main, using the project's symbol index
+    """
+    with SymbolIndex(directory) as symbols:
+        symbols.update()
+        for name in filter(None, (func_name, 'main')):
+            definitions = symbols.lookup(name)
+            if definitions:
+                return Path(definitions[0][0])
+    return next(directory.glob('**/*main*.c'))
+
+
+def layout_path(args):
+    """
+    Get the path of the binary input layout: the file given by --layout, or next to the output file
+    """
+    if args.layout:
+        return Path(args.layout)
+    elif args.output:
+        return Path(args.output[0]).with_suffix('.layout.json')
+    return None
+
+
+def output_layout(args, reader):
+    """
+    Output the binary input layout next to the output file, or to the file given by --layout
+    """
+    layout_file = layout_path(args)
+    if layout_file is None:
+        log.warning('not writing the binary input layout, specify --layout or -o')
+        return
+    log.info(f'writing binary input layout to {layout_file}')
+    fileutils.write_atomic(layout_file, json.dumps(reader.layout(), indent=2))
 
 
 def read_input_file(translation_unit):
@@ -260,7 +373,7 @@ def read_input_file(translation_unit):
 
 def get_args():
     parser = argparse.ArgumentParser(description='Process some integers.')
-    parser.add_argument('input_file', nargs='?', help="Path to the input file. Can be a full filepath or, if -d is specified a path relative to the project directory. Omitting causes harn to search automatically for an input file named something close to main.c")
+    parser.add_argument('input_file', nargs='?', help="Path to the input file. Can be a full filepath or, if -d is specified a path relative to the project directory. Omitting causes harn to look up the file defining the target function (or main) in the project\'s symbol index")
     parser.add_argument(
         '-d', '--directory', help='Directory of input project', type=str, default=Path.cwd())
     parser.add_argument(
@@ -268,10 +381,23 @@ def get_args():
     parser.add_argument('-c', '--clang_flags',
                         help='Flags to pass to clang e.g. -I</path/to/include>', type=str, nargs=1)
     parser.add_argument(
-        '-f', '--no-format', help='Don\'t format the output file with clang-format', action="store_true")
+        '-f', '--no-format', help='Don\'t format the output file with clang-format. The test harness is generated in clang-format\'s Google style already, so only the original file text is left as-is', action="store_true")
     parser.add_argument(
         '-n', '--func-name', help='Target a specific function (defaults to the last function in the input file)', type=str, nargs=1)
+    parser.add_argument(
+        '-m', '--mode', help='How the test harness reads input: argv reads one input per process from the command line, '
+        'persistent reads many tab-separated records, one per line, from stdin, '
+        'libfuzzer defines LLVMFuzzerTestOneInput and reads one field per line from the input buffer, '
+        'mmap reads a binary input file (see harn encode)',
+        choices=list(templates), default='argv')
+    parser.add_argument(
+        '--layout', help='Path to write the binary input layout to with -m mmap. Default: the output file with the suffix .layout.json', type=str)
+    parser.add_argument(
+        '--force', help='Generate the test harness even if the output file\'s fingerprint shows it is up to date', action='store_true')
     parser.add_argument('-l', '--log-level', help='Display logs at a certain level (ex. DEBUG, INFO, ERROR)', type=str)
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
 
     arguments = parser.parse_args()
     if isinstance(arguments.directory, str):
@@ -280,11 +406,19 @@ def get_args():
 
 
 def main():
+    if sys.argv[1:2] == ['run']:
+        exit(run.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['encode']:
+        exit(binary.main(sys.argv[2:]))
+
     args = get_args()
     if args.log_level:
         log.setLevel(logging.getLevelName(args.log_level))
     else:
         log.setLevel(logging.ERROR)
+    mylog.configure(args)
+    metrics.configure(args)
+    compdb.configure(args)
 
     func_name = args.func_name[0] if args.func_name else None
     clang_flags = get_clang_flags(args)
@@ -296,15 +430,30 @@ def main():
             if not infile.is_file():
                 infile = args.directory / args.input_file
         else:
-            infile = next(args.directory.glob('**/*main*.c'))
+            infile = guess_input_file(args.directory, func_name)
         assert(infile.is_file())
         log.info(f'infile={infile}')
-        cur = parse(infile, args=clang_flags)
+        with metrics.timer('parse'):
+            cur = parse(infile, args=clang_flags)
 
         target = select_target(func_name, cur)
-        test_harness = codegen(target)
         input_text = read_input_file(cur)
-        output(args, input_text, test_harness)
+        digest = None
+        if args.output:
+            with metrics.timer('fingerprint'):
+                digest = fingerprint(target, args.mode, input_text, args.no_format)
+            up_to_date = read_fingerprint(args.output[0]) == digest and (args.mode != 'mmap' or layout_path(args).is_file())
+            if up_to_date and not args.force:
+                log.info(f'{args.output[0]} is up to date')
+                metrics.count('up_to_date')
+                return
+        reader = BinaryInput() if args.mode == 'mmap' else TextInput()
+        with metrics.timer('codegen'):
+            test_harness = codegen(target, args.mode, reader)
+        with metrics.timer('output'):
+            output(args, input_text, test_harness, digest)
+        if args.mode == 'mmap':
+            output_layout(args, reader)
     except:
         log.exception(f'error generating test harness from {args.input_file}')
         exit(1)
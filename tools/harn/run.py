@@ -0,0 +1,255 @@
+"""
+Compile a test harness and run it over a corpus of inputs
+"""
+
+from mylog import log
+import metrics
+import mylog
+import jobserver
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')
+    return Path(cache_home) / 'pal-tools' / 'harn'
+
+
+def compiler_identity(cc):
+    """
+    Identify the compiler by its resolved path and version, so that upgrading it invalidates the cache
+    """
+    cc_path = shutil.which(cc)
+    if cc_path is None:
+        raise Exception(f'compiler not found: {cc}')
+    version = subprocess.run([cc_path, '--version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    return f'{os.path.realpath(cc_path)}\n{version}'
+
+
+def cache_key(source_text, cc, cflags):
+    h = hashlib.sha256()
+    h.update(source_text)
+    h.update(b'\0')
+    h.update(compiler_identity(cc).encode())
+    h.update(b'\0')
+    h.update('\0'.join(cflags).encode())
+    return h.hexdigest()
+
+
+def compile_cached(source, cc, cflags, cache_dir):
+    """
+    Compile source, reusing an executable from cache_dir if the same source was compiled with the same compiler and flags.
+    Returns the path to the executable and whether it came from the cache.
+    """
+    source = Path(source)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    exe = cache_dir / cache_key(source.read_bytes(), cc, cflags)
+    if exe.is_file():
+        log.info(f'using cached executable {exe}')
+        return exe, True
+
+    fd, tmp_exe = tempfile.mkstemp(prefix=f'.{exe.name}.', dir=cache_dir)
+    os.close(fd)
+    try:
+        cmd = [cc, str(source.absolute()), '-o', tmp_exe] + cflags
+        log.info(f'compiling with command: {" ".join(cmd)}')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        if proc.returncode != 0:
+            for l in proc.stdout.splitlines():
+                log.error(f'* {l}')
+            raise Exception(f'could not compile {source}')
+        os.replace(tmp_exe, exe)
+    finally:
+        if os.path.exists(tmp_exe):
+            os.unlink(tmp_exe)
+    return exe, False
+
+
+def corpus_files(paths):
+    """
+    Expand files and directories of inputs to a sorted list of files
+    """
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files += sorted(f for f in p.glob('**/*') if f.is_file())
+        elif p.is_file():
+            files.append(p)
+        else:
+            log.warning(f'no such input file or directory: {p}')
+    return files
+
+
+def command_for(exe, input_file, feed):
+    """
+    Get the arguments and stdin to run exe on input_file.
+    - argv: each line of the input is one argument
+    - stdin: the input is piped to stdin
+    - path: the path to the input is the only argument
+    """
+    if feed == 'argv':
+        return [str(exe)] + input_file.read_text().splitlines(), None
+    elif feed == 'stdin':
+        return [str(exe)], input_file.read_bytes()
+    elif feed == 'path':
+        return [str(exe), str(input_file.absolute())], None
+    else:
+        raise Exception(f'invalid feed: {feed}')
+
+
+crash_patterns = [
+    re.compile(r'ERROR: \w+Sanitizer: [\w-]+'),
+    re.compile(r'runtime error: .*'),
+    re.compile(r'Assertion .* failed'),
+]
+
+
+def crash_site(stderr):
+    """
+    Get a short description of why the harness failed from its error stream, with addresses and numbers masked
+    """
+    lines = stderr.decode(errors='replace').splitlines()
+    for pattern in crash_patterns:
+        for l in lines:
+            m = pattern.search(l)
+            if m:
+                return re.sub(r'0x[0-9a-fA-F]+|\d+', 'N', m.group(0))
+    return ''
+
+
+def run_one(exe, input_file, feed, timeout):
+    """
+    Run exe on one input and return a summary of the run
+    """
+    args, stdin = command_for(exe, input_file, feed)
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(args, input=stdin, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, timeout=timeout)
+        returncode, stderr, timed_out = proc.returncode, proc.stderr, False
+    except subprocess.TimeoutExpired as e:
+        returncode, stderr, timed_out = None, e.stderr or b'', True
+    seconds = time.perf_counter() - start
+
+    signal_name = None
+    if returncode is not None and returncode < 0:
+        try:
+            signal_name = signal.Signals(-returncode).name
+        except ValueError:
+            signal_name = f'signal {-returncode}'
+
+    if timed_out:
+        bucket = 'timeout'
+    elif signal_name:
+        bucket = f'{signal_name} {crash_site(stderr)}'.strip()
+    elif returncode != 0:
+        bucket = f'exit {returncode} {crash_site(stderr)}'.strip()
+    else:
+        bucket = 'ok'
+
+    return {
+        'input': str(input_file),
+        'exit_code': returncode,
+        'signal': signal_name,
+        'timeout': timed_out,
+        'seconds': seconds,
+        'bucket': bucket,
+    }
+
+
+def run_corpus(exe, inputs, feed='argv', timeout=None, jobs=None):
+    """
+    Run exe over all inputs with a pool of workers
+    """
+    with jobserver.executor(ThreadPoolExecutor, max_workers=jobs) as pool:
+        return list(pool.map(lambda f: run_one(exe, f, feed, timeout), inputs))
+
+
+def summarize(results):
+    buckets = defaultdict(list)
+    for r in results:
+        buckets[r['bucket']].append(r)
+    seconds = [r['seconds'] for r in results]
+    return {
+        'runs': len(results),
+        'total_seconds': sum(seconds),
+        'max_seconds': max(seconds, default=0),
+        'buckets': {
+            b: {'count': len(rs), 'inputs': [r['input'] for r in rs]}
+            for b, rs in sorted(buckets.items(), key=lambda p: len(p[1]), reverse=True)
+        },
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='harn run', description='Compile a test harness and run it over a corpus of inputs')
+    parser.add_argument('harness', help='Path to the test harness source file')
+    parser.add_argument('inputs', nargs='*', help='Input files or directories of input files')
+    parser.add_argument('--cc', help='C compiler. Default: $CC or cc', default=os.environ.get('CC', 'cc'))
+    parser.add_argument('--cflags', help='Flags to pass to the compiler, e.g. "-g -O0 -fsanitize=address"', default='-g -O0')
+    parser.add_argument('--cache-dir', help=f'Directory of cached executables. Default: {default_cache_dir()}', type=Path, default=default_cache_dir())
+    parser.add_argument('--feed', choices=['argv', 'stdin', 'path'], default='argv',
+                        help='How inputs are passed to the harness: argv passes each line as an argument (for -m argv), '
+                        'stdin pipes the file (for -m persistent), path passes the file path')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of inputs to run in parallel. Default: number of CPUs')
+    parser.add_argument('-t', '--timeout', type=float, help='Timeout in seconds for each run')
+    parser.add_argument('-s', '--summary', help='Write a JSON summary of all runs to a file')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (ex. DEBUG, INFO, ERROR)', type=str)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+    mylog.configure(args)
+    metrics.configure(args)
+
+    try:
+        start = time.perf_counter()
+        with metrics.timer('compile'):
+            exe, cached = compile_cached(args.harness, args.cc, shlex.split(args.cflags), args.cache_dir)
+        compile_seconds = time.perf_counter() - start
+
+        inputs = corpus_files(args.inputs)
+        log.info(f'running {exe} on {len(inputs)} inputs')
+        with metrics.timer('run'):
+            results = run_corpus(exe, inputs, args.feed, args.timeout, args.jobs)
+        metrics.count('inputs', len(inputs))
+    except:
+        log.exception(f'error running test harness {args.harness}')
+        return 1
+
+    summary = {
+        'harness': args.harness,
+        'executable': str(exe),
+        'cached': cached,
+        'compile_seconds': compile_seconds,
+        **summarize(results),
+        'results': results,
+    }
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    print(f'{summary["runs"]} runs in {summary["total_seconds"]:.3f}s')
+    for bucket, info in summary['buckets'].items():
+        print(f'{info["count"]:6} {bucket}')
+    return 0
@@ -0,0 +1,259 @@
+"""
+Templates for the test harness entry point.
+
+Templates are formatted with declarations, initializers, call, num_fields
+(the number of shift_argi() calls) and layout_id (the binary input layout, for mmap).
+"""
+
+# Bump when the templates or the code generated for parameters change, so that harn regenerates fingerprinted harnesses
+VERSION = 2
+
+includes = '''
+#include <assert.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+'''
+
+# Read one input per process from the command line arguments
+argv = includes + '''
+// argi is used for iterating through the input arguments
+int argi = 1;
+int global_argc;
+char** global_argv;
+
+char* shift_argi() {{
+  int old_argi = argi;
+  argi++;
+  assert(old_argi < global_argc);
+  char* return_value = global_argv[old_argi];
+  if (strcmp(return_value, "NULL") == 0) {{
+    return_value = NULL;
+  }}
+  return return_value;
+}}
+
+int main(int argc, char** argv) {{
+  global_argc = argc;
+  global_argv = argv;
+
+  // declarations
+{declarations}
+
+  // initializers
+{initializers}
+
+  // call into segment
+{call}
+}}
+'''
+
+# Split an input record into fields and run the segment once per record
+record = includes + '''
+#define NUM_FIELDS {num_fields}
+
+// record_fields holds the fields of the current input record
+char* record_fields[NUM_FIELDS + 1];
+int record_num_fields;
+int record_field_i;
+
+char* shift_argi() {{
+  assert(record_field_i < record_num_fields);
+  char* return_value = record_fields[record_field_i++];
+  if (strcmp(return_value, "NULL") == 0) {{
+    return_value = NULL;
+  }}
+  return return_value;
+}}
+
+// Split record into fields in place. Returns 0 if there are too few fields.
+int split_record(char* record, char delimiter) {{
+  record_num_fields = 0;
+  record_field_i = 0;
+  while (record_num_fields < NUM_FIELDS) {{
+    record_fields[record_num_fields++] = record;
+    record = strchr(record, delimiter);
+    if (record == NULL) {{
+      break;
+    }}
+    *record++ = '\\0';
+  }}
+  return record_num_fields == NUM_FIELDS;
+}}
+
+void test_one() {{
+  // declarations
+{declarations}
+
+  // initializers
+{initializers}
+
+  // call into segment
+{call}
+}}
+'''
+
+# Read many tab-separated records, one per line, from stdin in a single process
+persistent = record + '''
+int main() {{
+  char* record = NULL;
+  size_t record_n = 0;
+  ssize_t length;
+  while ((length = getline(&record, &record_n, stdin)) != -1) {{
+    if (length > 0 && record[length - 1] == '\\n') {{
+      record[length - 1] = '\\0';
+    }}
+    if (!split_record(record, '\\t')) {{
+      fprintf(stderr, "skipping record with fewer than %d fields\\n",
+              NUM_FIELDS);
+      continue;
+    }}
+    test_one();
+  }}
+  free(record);
+}}
+'''
+
+# libFuzzer entry point. The input buffer holds one field per line.
+libfuzzer = record + '''
+int LLVMFuzzerTestOneInput(const uint8_t* data, size_t size) {{
+  char* record = malloc(size + 1);
+  memcpy(record, data, size);
+  record[size] = '\\0';
+  if (split_record(record, '\\n')) {{
+    test_one();
+  }}
+  free(record);
+  return 0;
+}}
+'''
+
+# Read fields from a memory-mapped binary input file, see binary.py for the encoding
+mmap = '''
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+// input_cursor points to the next field in the memory-mapped input file
+char* input_cursor;
+char* input_end;
+
+void fail(const char* message) {{
+  fprintf(stderr, "harness: %s\\n", message);
+  exit(1);
+}}
+
+// The input may be corrupt, so every read is checked, also under NDEBUG
+void read_bytes(void* dest, size_t n) {{
+  if (n > (size_t)(input_end - input_cursor)) {{
+    fail("the input file is truncated");
+  }}
+  memcpy(dest, input_cursor, n);
+  input_cursor += n;
+}}
+
+int64_t read_i64() {{
+  int64_t value;
+  read_bytes(&value, sizeof(value));
+  return value;
+}}
+
+uint64_t read_u64() {{
+  uint64_t value;
+  read_bytes(&value, sizeof(value));
+  return value;
+}}
+
+double read_f64() {{
+  double value;
+  read_bytes(&value, sizeof(value));
+  return value;
+}}
+
+char read_char() {{
+  char value;
+  read_bytes(&value, sizeof(value));
+  return value;
+}}
+
+uint32_t read_u32() {{
+  uint32_t value;
+  read_bytes(&value, sizeof(value));
+  return value;
+}}
+
+// Point into the input instead of copying, the encoder NUL-terminates strings
+char* read_str() {{
+  uint32_t length = read_u32();
+  if (length == UINT32_MAX) {{
+    return NULL;
+  }}
+  if (length >= (size_t)(input_end - input_cursor)) {{
+    fail("the input file is truncated");
+  }}
+  char* value = input_cursor;
+  input_cursor += length + 1;
+  return value;
+}}
+
+uint32_t read_count(uint32_t capacity) {{
+  uint32_t count = read_u32();
+  if (count > capacity) {{
+    fail("array count exceeds capacity");
+  }}
+  return count;
+}}
+
+int main(int argc, char** argv) {{
+  if (argc != 2) {{
+    fail("usage: harness <input file>");
+  }}
+  int fd = open(argv[1], O_RDONLY);
+  if (fd == -1) {{
+    fail("cannot open the input file");
+  }}
+  struct stat st;
+  if (fstat(fd, &st) != 0 || st.st_size < 8) {{
+    fail("the input file is too short");
+  }}
+  // Map privately so that the segment can modify strings without changing
+  // the input file
+  input_cursor =
+      mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_PRIVATE, fd, 0);
+  if (input_cursor == MAP_FAILED) {{
+    fail("cannot map the input file");
+  }}
+  input_end = input_cursor + st.st_size;
+  close(fd);
+  if (memcmp(input_cursor, "HARN", 4) != 0) {{
+    fail("the input file is not a harn input, see harn encode");
+  }}
+  input_cursor += 4;
+  uint32_t layout_id = read_u32();
+  if (layout_id != {layout_id}u) {{
+    fail("the input file was encoded for another layout");
+  }}
+
+  // declarations
+{declarations}
+
+  // initializers
+{initializers}
+
+  // call into segment
+{call}
+}}
+'''
+
+templates = {
+    'argv': argv,
+    'persistent': persistent,
+    'libfuzzer': libfuzzer,
+    'mmap': mmap,
+}
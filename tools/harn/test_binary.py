@@ -0,0 +1,45 @@
+import struct
+import unittest
+from tools.harn.binary import MAGIC, NULL_LENGTH, encode, layout_id
+
+fields = [
+    {'name': 'x', 'kind': 'int', 'type': 'int'},
+    {'name': 'y', 'kind': 'uint', 'type': 'unsigned int'},
+    {'name': 's', 'kind': 'string', 'type': 'char *'},
+    {'name': 'p', 'kind': 'string', 'type': 'char *'},
+    {'name': 'a', 'kind': 'array', 'type': 'long[4]', 'element': 'int', 'capacity': 4},
+    {'name': 'name', 'kind': 'array', 'type': 'char[4]', 'element': 'char', 'capacity': 4},
+]
+layout = {'version': 1, 'layout_id': layout_id(fields), 'fields': fields}
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_encodes_fields_in_order(self):
+        data = encode(layout, ['-12', '4000000000', 'hello', 'NULL', '1 2', 'ab'])
+        expected = MAGIC + struct.pack('<I', layout['layout_id'])
+        expected += struct.pack('<q', -12)
+        expected += struct.pack('<Q', 4000000000)
+        expected += struct.pack('<I', 5) + b'hello\0'
+        expected += struct.pack('<I', NULL_LENGTH)
+        expected += struct.pack('<I', 2) + struct.pack('<qq', 1, 2)
+        expected += struct.pack('<I', 3) + b'ab\0'
+        self.assertEqual(expected, data)
+
+    def test_parses_numbers_like_c(self):
+        int_layout = {'layout_id': 0, 'fields': [fields[0]]}
+        self.assertEqual(encode(int_layout, ['42abc']), encode(int_layout, ['42']))
+        self.assertEqual(encode(int_layout, ['abc']), encode(int_layout, ['0']))
+
+    def test_rejects_too_few_values_and_long_arrays(self):
+        with self.assertRaises(Exception):
+            encode(layout, ['1'])
+        with self.assertRaises(Exception):
+            encode(layout, ['1', '2', 's', 'p', '1 2 3 4 5', 'ab'])
+
+    def test_layout_id_depends_on_kinds(self):
+        self.assertNotEqual(layout_id(fields), layout_id(fields[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import tempfile
+import unittest
+from argparse import Namespace
+from contextlib import redirect_stdout
+from pathlib import Path
+from nodeutils import parse
+from tools.harn.harn import fingerprint, output, read_fingerprint, render, select_target
+
+header = '''
+struct node { int v; struct node* next; };
+typedef struct node node_t;
+'''
+source = '''
+#include "node.h"
+int g(node_t* n, int k) { return n->v + k; }
+'''
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        (self.dir / 'node.h').write_text(header)
+        (self.dir / 'g.c').write_text(source)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def digest(self, mode='argv'):
+        target = select_target('g', parse(str(self.dir / 'g.c')))
+        return fingerprint(target, mode, source)
+
+    def test_same_sources_same_fingerprint(self):
+        self.assertEqual(self.digest(), self.digest())
+        self.assertNotEqual(self.digest(), self.digest('persistent'))
+
+    def test_reached_struct_changes_fingerprint(self):
+        before = self.digest()
+        (self.dir / 'node.h').write_text(header.replace('int v;', 'long v;'))
+        self.assertNotEqual(before, self.digest())
+
+    def test_unreached_code_keeps_fingerprint(self):
+        before = self.digest()
+        (self.dir / 'node.h').write_text(header + 'struct other { double d; };\nint h(void);\n')
+        self.assertEqual(before, self.digest())
+
+    def test_fingerprint_on_first_line(self):
+        path = self.dir / 'harness.c'
+        path.write_text(render('int x;', 'int main() {}', no_format=True, fingerprint='abc'))
+        self.assertEqual('abc', read_fingerprint(path))
+        self.assertIsNone(read_fingerprint(self.dir / 'g.c'))
+        self.assertIsNone(read_fingerprint(self.dir / 'missing.c'))
+
+    def test_fingerprint_only_in_output_files(self):
+        with redirect_stdout(io.StringIO()) as out:
+            output(Namespace(output=None, no_format=True), 'int x;', 'int main() {}', 'abc')
+        self.assertNotIn('fingerprint', out.getvalue())
+        path = self.dir / 'harness.c'
+        output(Namespace(output=[str(path)], no_format=True), 'int x;', 'int main() {}', 'abc')
+        self.assertEqual('abc', read_fingerprint(path))
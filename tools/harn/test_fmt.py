@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from tools.harn import fmt
+
+unformatted = 'int main(){int x=1;\nreturn x;}\n'
+formatted = 'int main() {\n  int x = 1;\n  return x;\n}\n'
+
+
+class TestFormat(unittest.TestCase):
+
+    @unittest.skipUnless(fmt.shutil.which('clang-format'), 'clang-format not installed')
+    def test_format_over_stdin(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                self.assertEqual(formatted, fmt.format_text(unformatted))
+                self.assertEqual([], os.listdir(tmpdir))
+            finally:
+                os.chdir(cwd)
+
+    def test_missing_clang_format(self):
+        with mock.patch.object(fmt.shutil, 'which', return_value=None), self.assertLogs(fmt.log, 'WARNING') as logs:
+            self.assertEqual(unformatted, fmt.format_text(unformatted))
+        self.assertIn('clang-format not found', logs.output[0])
@@ -0,0 +1,61 @@
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from nodeutils import parse
+from tools.harn import harn
+from tools.harn.binary import BinaryInput, encode
+
+source = '''#include <stdio.h>
+struct s { int a[4]; char* name; };
+int target(struct s v, int n) { printf("%s %d %d\\n", v.name, v.a[0], n); return 0; }
+'''
+
+
+@unittest.skipUnless(shutil.which('cc'), 'no C compiler')
+class TestMmapHarness(unittest.TestCase):
+    """The harness checks its input also when built with -DNDEBUG, since fuzzed inputs are often corrupt"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.dir = Path(cls.tmpdir.name)
+        (cls.dir / 'target.c').write_text(source)
+        cursor = parse(str(cls.dir / 'target.c'))
+        reader = BinaryInput()
+        test_harness = harn.codegen(harn.select_target('target', cursor), 'mmap', reader)
+        (cls.dir / 'harness.c').write_text(harn.render(harn.read_input_file(cursor), test_harness, no_format=True))
+        cls.layout = reader.layout()
+        cls.exe = cls.dir / 'harness'
+        subprocess.run(['cc', '-DNDEBUG', '-o', str(cls.exe), str(cls.dir / 'harness.c')], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def run_harness(self, data):
+        input_file = self.dir / 'input'
+        input_file.write_bytes(data)
+        return subprocess.run([str(self.exe), str(input_file)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def encoded(self):
+        return encode(self.layout, ['7 8', 'hello', '3'])
+
+    def test_valid_input(self):
+        proc = self.run_harness(self.encoded())
+        self.assertEqual((0, 'hello 7 3\n'), (proc.returncode, proc.stdout))
+
+    def test_truncated_input(self):
+        data = self.encoded()
+        string_start = len(data) - 8 - len('hello\0')
+        for size in (len(data) - 8, len(data) - 1, string_start + 2, string_start - 2):
+            proc = self.run_harness(data[:size])
+            self.assertEqual((1, 'harness: the input file is truncated\n'), (proc.returncode, proc.stderr), size)
+
+    def test_count_exceeds_capacity(self):
+        data = bytearray(self.encoded())
+        data[8:12] = struct.pack('<I', 5)
+        proc = self.run_harness(bytes(data))
+        self.assertEqual((1, 'harness: array count exceeds capacity\n'), (proc.returncode, proc.stderr))
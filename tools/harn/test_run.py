@@ -0,0 +1,132 @@
+import jobserver
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from tools.harn.run import cache_key, compile_cached, crash_site, run_corpus, run_one, summarize
+
+
+def write_script(path, text):
+    path.write_text(f'#!/bin/sh\n{text}\n')
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.cc = write_script(self.dir / 'cc', 'echo "fake cc 1.0"')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_cache_key(self):
+        key = cache_key(b'int x;', str(self.cc), ['-O0'])
+        self.assertEqual(key, cache_key(b'int x;', str(self.cc), ['-O0']))
+        self.assertNotEqual(key, cache_key(b'int y;', str(self.cc), ['-O0']))
+        self.assertNotEqual(key, cache_key(b'int x;', str(self.cc), ['-O2']))
+        self.assertNotEqual(key, cache_key(b'int x;', str(self.cc), ['-O', '0']))
+
+    def test_compiler_identity(self):
+        key = cache_key(b'int x;', str(self.cc), [])
+        write_script(self.cc, 'echo "fake cc 2.0"')
+        self.assertNotEqual(key, cache_key(b'int x;', str(self.cc), []))
+        other = write_script(self.dir / 'cc2', 'echo "fake cc 2.0"')
+        self.assertNotEqual(cache_key(b'int x;', str(self.cc), []), cache_key(b'int x;', str(other), []))
+        with self.assertRaises(Exception):
+            cache_key(b'int x;', str(self.dir / 'missing-cc'), [])
+
+    @unittest.skipUnless(shutil.which('cc'), 'no C compiler')
+    def test_compile_cached(self):
+        source = self.dir / 'harness.c'
+        source.write_text('int main(void) { return 0; }\n')
+        cache_dir = self.dir / 'cache'
+        exe, cached = compile_cached(source, 'cc', ['-O0'], cache_dir)
+        self.assertFalse(cached)
+        self.assertEqual((exe, True), compile_cached(source, 'cc', ['-O0'], cache_dir))
+        self.assertEqual([exe.name], os.listdir(cache_dir))
+
+
+class TestBuckets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.input = self.dir / 'input'
+        self.input.write_text('1\n2\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_crash_site(self):
+        asan = b'==4242==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x602000000011 at pc 0x4f1'
+        self.assertEqual('ERROR: AddressSanitizer: heap-buffer-overflow', crash_site(asan))
+        self.assertEqual('runtime error: signed integer overflow: N + N cannot be represented in type \'int\'',
+                         crash_site(b'a.c:3:12: runtime error: signed integer overflow: 2147483647 + 1 cannot be represented in type \'int\'\n'))
+        self.assertEqual('Assertion `n < N\' failed', crash_site(b'prog: a.c:7: main: Assertion `n < 10\' failed.\n'))
+        self.assertEqual('', crash_site(b'just some output\n\xff'))
+
+    def test_same_crash_at_different_addresses_shares_bucket(self):
+        a = crash_site(b'==1==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000010')
+        b = crash_site(b'==2==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000020')
+        self.assertEqual(a, b)
+
+    def bucket(self, script, timeout=None):
+        return run_one(write_script(self.dir / 'harness', script), self.input, 'argv', timeout)['bucket']
+
+    def test_run_buckets(self):
+        self.assertEqual('ok', self.bucket('test "$1 $2" = "1 2"'))
+        self.assertEqual('exit 3', self.bucket('exit 3'))
+        (self.dir / 'stderr').write_text('prog: a.c:7: main: Assertion `x < 10\' failed.\n')
+        self.assertEqual('exit 1 Assertion `x < N\' failed', self.bucket(f'cat {self.dir}/stderr >&2; exit 1'))
+        self.assertEqual('SIGSEGV', self.bucket('kill -SEGV $$'))
+        self.assertEqual('timeout', self.bucket('sleep 5', timeout=0.2))
+
+    def test_summarize(self):
+        results = [
+            {'input': 'a', 'bucket': 'ok', 'seconds': 0.5},
+            {'input': 'b', 'bucket': 'SIGSEGV', 'seconds': 1.0},
+            {'input': 'c', 'bucket': 'SIGSEGV', 'seconds': 0.25},
+        ]
+        summary = summarize(results)
+        self.assertEqual(3, summary['runs'])
+        self.assertEqual(1.75, summary['total_seconds'])
+        self.assertEqual(1.0, summary['max_seconds'])
+        self.assertEqual(['SIGSEGV', 'ok'], list(summary['buckets']))
+        self.assertEqual({'count': 2, 'inputs': ['b', 'c']}, summary['buckets']['SIGSEGV'])
+        self.assertEqual({'runs': 0, 'total_seconds': 0, 'max_seconds': 0, 'buckets': {}}, summarize([]))
+
+
+class TestRunCorpus(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(jobserver, _server=None, _checked=True, _default_slots=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dir = Path(self.tmpdir.name)
+
+    def test_jobs_above_cpu_count(self):
+        # Every run waits until all of them have started, so they only all pass if -j runs more inputs at once than there are CPUs
+        jobs = (os.cpu_count() or 1) + 2
+        started = self.dir / 'started'
+        started.mkdir()
+        exe = write_script(self.dir / 'harness', f'''touch {started}/$1
+i=0
+while [ $(ls {started} | wc -l) -lt {jobs} ]; do
+  i=$((i + 1)); [ $i -gt 100 ] && exit 1
+  sleep 0.05
+done''')
+        inputs = []
+        for i in range(jobs):
+            inputs.append(self.dir / f'input{i}')
+            inputs[-1].write_text(f'{i}\n')
+        results = run_corpus(exe, inputs, 'argv', timeout=30, jobs=jobs)
+        self.assertEqual([str(f) for f in inputs], [r['input'] for r in results])
+        self.assertEqual(['ok'] * jobs, [r['bucket'] for r in results])
@@ -1,13 +1,20 @@
 #!/bin/python3
 
 from mylog import log
-import logging
+import metrics
+import mylog
+import jobserver
+from concurrent.futures import ProcessPoolExecutor
+from .snapshot import snapshot, modes as snapshot_modes
+from collections import defaultdict, namedtuple
 import argparse
-import pandas
+import csv
+import hashlib
+import json
+import logging
 import os
 import re
-import subprocess
-import shutil
+import sys
 import difflib
 
 '''
@@ -19,10 +26,23 @@ def parse_args():
     parser.add_argument('filter', nargs='?', help='Filter bugs to a certain filter')
     parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Display verbose logs in -lDEBUG')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of bugs to process in parallel. Default: number of CPUs')
+    parser.add_argument('-f', '--force', action='store_true', help='Regenerate all patches, even if their inputs did not change')
+    parser.add_argument('--notes', default='notes.tsv', help='Path to the notes file. Default: notes.tsv')
+    parser.add_argument('-s', '--snapshot', choices=snapshot_modes, default='reflink',
+                        help='How to make the buggy copy of each source tree: reflink clones files where the filesystem can, falling back to copies, '
+                        'copy copies every file, hardlink links files to the source tree. '
+                        'With hardlink, writing a file in place in the buggy copy (configure, sed -i, some editors) also changes the source tree. '
+                        'The file which gets the assertion is always an independent copy. Default: reflink')
+    parser.add_argument('--manifest', default='pert.manifest.json', help='Path to the manifest of generated patches. Default: pert.manifest.json')
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
     arguments = parser.parse_args()
-    
+
     if arguments.log_level:
         log.setLevel(logging.getLevelName(arguments.log_level))
+    mylog.configure(arguments)
+    metrics.configure(arguments)
     if arguments.verbose:
         global verbose
         verbose = True
@@ -30,29 +50,40 @@ def parse_args():
 
     return arguments
 
-args = parse_args()
 verbose=False
 
-def parse(dirname, buggy_dirname, assertion):
-    dirname = os.path.abspath(dirname)
-    m = re.match(r'([^,]+),\s*(before|after)\s*line\s*([0-9]+)\s*\((.*)\),\s*(assert\(.*\);)', assertion)
-    file_path = os.path.join(dirname, m.group(1))
-    buggy_file_path = os.path.join(dirname, m.group(1))
-    before_after = m.group(2)
-    line_no = int(m.group(3))
-    expr = m.group(4).strip()
-    assert_stmt = m.group(5)
-    assert_args = re.match(r'assert\((.*)\);', assert_stmt).group(1)
-    my_assert_stmt = f'if (!{assert_args}) {{*((int*)0) = 0;}} // my_assert'
-    my_assert_stmt += '\n'
-    
-    log.info(f'{before_after} {file_path}:{line_no} "{my_assert_stmt}"')
+assertion_re = re.compile(r'([^,]+),\s*(before|after)\s*line\s*([0-9]+)\s*\((.*)\),\s*(assert\(.*\);)')
 
-    fromlines = open(file_path, 'r').readlines()
-    
+Assertion = namedtuple('Assertion', 'file before_after line_no expr assert_stmt')
+
+def parse_assertion(assertion):
+    """
+    Parse a human readable assertion "file, before|after line N (code), assert(...);"
+    """
+    m = assertion_re.match(assertion)
+    if m is None:
+        raise ValueError(f'malformed assertion: {assertion}')
+    return Assertion(os.path.normpath(m.group(1)), m.group(2), int(m.group(3)), m.group(4).strip(), m.group(5))
+
+def assertion_file(assertion):
+    """
+    Get the path of the file an assertion goes in, relative to the source directory
+    """
+    return parse_assertion(assertion).file
+
+def my_assert(assertion):
+    assert_args = re.match(r'assert\((.*)\);', assertion.assert_stmt).group(1)
+    return f'if (!({assert_args})) {{*((int*)0) = 0;}} // my_assert\n'
+
+def locate(fromlines, assertion, file_path):
+    """
+    Get the index in fromlines to insert an assertion at.
+    The line number is moved to the closest match of the assertion's code within a line of it.
+    """
+    line_no = assertion.line_no
     matchto = [l.strip() for l in fromlines[line_no-2:line_no+2]]
-    matches = difflib.get_close_matches(expr, matchto)
-    log.debug(f'close matching "{expr}"')
+    matches = difflib.get_close_matches(assertion.expr, matchto)
+    log.debug(f'close matching "{assertion.expr}"')
     assert(len(matches) > 0)
     new_line_no = line_no-2 + matchto.index(matches[0])+1
     if new_line_no != line_no:
@@ -60,50 +91,165 @@ def parse(dirname, buggy_dirname, assertion):
         line_no = new_line_no
     log.debug(f'close matched {file_path}:{line_no} "{fromlines[line_no-1]}"')
 
-    if before_after == 'before':
-        tolines = fromlines[:line_no-1] + [my_assert_stmt] + fromlines[line_no-1:]
-    elif before_after == 'after':
-        tolines = fromlines[:line_no] + [my_assert_stmt] + fromlines[line_no:]
+    if assertion.before_after == 'before':
+        return line_no-1
+    elif assertion.before_after == 'after':
+        return line_no
     else:
-        log.critical(f'before_after is not valid: {before_after}')
-        return
+        raise Exception(f'before_after is not valid: {assertion.before_after}')
+
+def gen_file_patch(dirname, file, assertions):
+    """
+    Generate one patch inserting all assertions into a file.
+    Every line number refers to the original file, so insertions are applied in order of position.
+    """
+    dirname = os.path.abspath(dirname)
+    file_path = os.path.join(dirname, file)
+    fromlines = open(file_path, 'r').readlines()
 
-    unidiff = difflib.unified_diff(fromlines, tolines, fromfile=buggy_file_path, tofile=buggy_file_path)
-    patch = ''.join(unidiff)
-    return patch
+    insertions = []
+    for i, assertion in enumerate(assertions):
+        stmt = my_assert(assertion)
+        log.info(f'{assertion.before_after} {file_path}:{assertion.line_no} "{stmt}"')
+        insertions.append((locate(fromlines, assertion, file_path), i, stmt))
+
+    tolines = []
+    prev = 0
+    for position, _, stmt in sorted(insertions):
+        tolines += fromlines[prev:position]
+        tolines.append(stmt)
+        prev = position
+    tolines += fromlines[prev:]
+
+    unidiff = difflib.unified_diff(fromlines, tolines, fromfile=file_path, tofile=file_path)
+    return ''.join(unidiff)
+
+def gen_patch(dirname, assertions):
+    """
+    Generate a patch for all of a bug's assertions, with one multi-hunk patch for each file
+    """
+    by_file = defaultdict(list)
+    for assertion in assertions:
+        by_file[assertion.file].append(assertion)
+    return ''.join(gen_file_patch(dirname, file, file_assertions) for file, file_assertions in by_file.items())
+
+def parse(dirname, buggy_dirname, assertion):
+    return gen_patch(dirname, [parse_assertion(assertion)])
+
+def read_notes(path, filters=None):
+    """
+    Stream the rows of the notes file, keeping bugs which begin with one of the comma-separated filters
+    """
+    regexes = [re.compile(f'^{f}') for f in filters.split(',')] if filters else None
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            if regexes is None or any(r.search(row['Bug']) for r in regexes):
+                yield row
+
+def bug_dirnames(row):
+    """
+    Get the source and buggy directories of a bug
+    """
+    name = row['Name']
+    bug = row['Bug']
+    buggy_version = bug.split('-')[-2]
+    dirname = os.path.join('functional', bug)
+    return os.path.join(dirname, name), os.path.join(dirname, f'buggy.{buggy_version}')
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def inputs_of(rows):
+    """
+    Get the inputs which determine a bug's patch: the assertions and the hashes of the files they go in
+    """
+    src_dirname, _ = bug_dirnames(rows[0])
+    assertions = [row['Assert'] for row in rows]
+    files = sorted({assertion_file(a) for a in assertions})
+    return {
+        'assertions': assertions,
+        'source_hashes': {f: sha256(os.path.join(src_dirname, f)) for f in files},
+    }
+
+def is_up_to_date(entry, inputs, assert_file):
+    if entry is None or any(entry.get(k) != v for k, v in inputs.items()):
+        return False
+    return os.path.isfile(assert_file) and sha256(assert_file) == entry['patch_hash']
+
+def make_patch(rows, snapshot_mode='reflink'):
+    """
+    Snapshot a bug's source to its buggy directory and write the patch for all of its assertions.
+    Runs in a worker process.
+    """
+    src_dirname, buggy_dirname = bug_dirnames(rows[0])
+    assertions = [parse_assertion(row['Assert']) for row in rows]
+
+    # Snapshot to buggy folder
+    if not os.path.isdir(buggy_dirname):
+        log.info(f'copying {src_dirname} to {buggy_dirname}')
+        snapshot(src_dirname, buggy_dirname, snapshot_mode, materialized=[a.file for a in assertions])
+
+    patch = gen_patch(src_dirname, assertions)
+    assert_file = os.path.join(buggy_dirname, 'my_assert.patch')
+    log.info(f'generated patch {assert_file}')
+    open(assert_file, 'w').write(patch)
+    return sha256(assert_file)
+
+def load_manifest(path):
+    if os.path.isfile(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(path, manifest):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
 
 def main():
-    df = pandas.read_csv('notes.tsv', sep='\t')
-    filtered = []
-    if args.filter:
-        for name_regex in args.filter.split(','):
-            name_regex = f'^{name_regex}'
-            filtered.append(df.loc[df['Bug'].str.contains(name_regex), :])
-        df = pandas.concat(filtered)
-
-    for i, row in df.iterrows():
-        name = row['Name']
-        bug = row['Bug']
-        buggy_version = bug.split('-')[-2]
-        assertion = row['Assert']
-
-        dirname = os.path.join('functional', bug)
-
-        # Copy to buggy folder
-        src_dirname = os.path.join(dirname, name)
-        buggy_dirname = os.path.join(dirname, f'buggy.{buggy_version}')
-        if not os.path.isdir(buggy_dirname):
+    if sys.argv[1:2] == ['verify']:
+        from . import verify
+        return verify.main(sys.argv[2:])
+
+    global args
+    args = parse_args()
+
+    # Each bug has one patch file with all of its assertions
+    rows = defaultdict(list)
+    for row in read_notes(args.notes, args.filter):
+        rows[row['Bug']].append(row)
+
+    manifest = load_manifest(args.manifest)
+    stale = []
+    failed = 0
+    for bug, bug_rows in rows.items():
+        _, buggy_dirname = bug_dirnames(bug_rows[0])
+        try:
+            inputs = inputs_of(bug_rows)
+        except:
+            log.exception(f'error reading the assertions of {bug}')
+            manifest.pop(bug, None)
+            failed += 1
+            continue
+        if args.force or not is_up_to_date(manifest.get(bug), inputs, os.path.join(buggy_dirname, 'my_assert.patch')):
+            stale.append((bug, bug_rows, inputs))
+    log.info(f'{len(rows)} bugs, {len(stale)} patches to generate')
+
+    metrics.count('bugs', len(rows))
+    metrics.count('patches', len(stale))
+    with metrics.timer('generate'), jobserver.executor(ProcessPoolExecutor, max_workers=args.jobs) as pool:
+        futures = [(bug, inputs, pool.submit(make_patch, bug_rows, args.snapshot)) for bug, bug_rows, inputs in stale]
+        for bug, inputs, future in futures:
             try:
-                print('copying', src_dirname, 'to', buggy_dirname)
-                shutil.copytree(src_dirname, buggy_dirname)
+                manifest[bug] = {**inputs, 'patch_hash': future.result()}
             except:
-                print('error, trying cp -r')
-                subprocess.check_call(args=['cp', '-r', src_dirname, buggy_dirname])
-
-        patch = parse(src_dirname, buggy_dirname, assertion)
-        assert_file = os.path.join(buggy_dirname, 'my_assert.patch')
-        log.info(f'generated patch {assert_file}')
-        open(assert_file, 'w').write(patch)
+                log.exception(f'error generating patch for {bug}')
+                manifest.pop(bug, None)
+                failed += 1
+    save_manifest(args.manifest, manifest)
+    return 1 if failed else 0
 
 if __name__ == '__main__':
     main()
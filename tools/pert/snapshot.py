@@ -0,0 +1,134 @@
+"""
+Snapshot a directory tree with reflinks, or hardlinks when asked for, instead of copying every file
+"""
+
+from mylog import log
+from collections import Counter
+import errno
+import fcntl
+import os
+import shutil
+
+# ioctl request to clone a file's extents (reflink) on Linux, from linux/fs.h
+FICLONE = 0x40049409
+
+modes = ['reflink', 'copy', 'hardlink']
+
+
+def reflink(src, dst):
+    """
+    Clone src to dst so they share data blocks until one of them is written.
+    Raises OSError if the filesystem does not support it.
+    """
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+def materialize(path):
+    """
+    Replace a hardlinked file with an independent copy, so that writing it does not change the other links
+    """
+    if os.stat(path).st_nlink > 1:
+        tmp_path = f'{path}.materialize'
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+class Snapshotter:
+    """
+    Place files with the cheapest method which works, and stop trying methods once they fail
+    """
+
+    def __init__(self, mode):
+        self.try_reflink = mode == 'reflink'
+        self.try_hardlink = mode == 'hardlink'
+        self.counts = Counter()
+
+    def clone(self, src, dst):
+        """
+        Place an independent copy of src at dst, reflinking if possible
+        """
+        if self.try_reflink:
+            try:
+                reflink(src, dst)
+                self.counts['reflink'] += 1
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF):
+                    raise
+                log.debug(f'reflinks are not supported for {dst}: {e}')
+                self.try_reflink = False
+        shutil.copy2(src, dst)
+        self.counts['copy'] += 1
+
+    def place(self, src, dst):
+        """
+        Place src at dst, sharing the file with a reflink or hardlink if possible
+        """
+        if self.try_reflink:
+            self.clone(src, dst)
+            return
+        if self.try_hardlink:
+            try:
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                os.link(src, dst)
+                self.counts['hardlink'] += 1
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                log.debug(f'hardlinks are not supported for {dst}: {e}')
+                self.try_hardlink = False
+        self.clone(src, dst)
+
+
+def snapshot(src, dst, mode='reflink', materialized=()):
+    """
+    Snapshot the tree at src to dst.
+    - reflink: clone files, falling back to copies
+    - copy: copy every file
+    - hardlink: hardlink files, falling back to copies. The snapshot shares files with src,
+      so writing one of them in place changes src too; only use it for snapshots which are not built or edited
+    Files in materialized (paths relative to src) are never hardlinked, so they can be patched safely.
+    The snapshot is built next to dst and renamed into place, so dst is never left half-written.
+    Returns the number of files placed with each method.
+    """
+    materialized = {os.path.normpath(p) for p in materialized}
+    snapshotter = Snapshotter(mode)
+    tmp_dst = f'{dst}.snapshot'
+    if os.path.lexists(tmp_dst):
+        shutil.rmtree(tmp_dst)
+
+    dirs = []
+    try:
+        for dirpath, dirnames, filenames in os.walk(src):
+            reldir = os.path.relpath(dirpath, src)
+            os.makedirs(os.path.join(tmp_dst, reldir))
+            dirs.append(reldir)
+            for name in dirnames + filenames:
+                relpath = os.path.normpath(os.path.join(reldir, name))
+                src_path = os.path.join(src, relpath)
+                dst_path = os.path.join(tmp_dst, relpath)
+                if os.path.islink(src_path):
+                    os.symlink(os.readlink(src_path), dst_path)
+                    if name in dirnames:
+                        # os.walk does not descend into symlinks to directories
+                        dirnames.remove(name)
+                elif name in filenames:
+                    if relpath in materialized:
+                        snapshotter.clone(src_path, dst_path)
+                    else:
+                        snapshotter.place(src_path, dst_path)
+        # Copy the directories' modes once they are filled, deepest first, as shutil.copytree does,
+        # so that read-only directories can be snapshotted
+        for reldir in reversed(dirs):
+            shutil.copystat(os.path.join(src, reldir), os.path.join(tmp_dst, reldir))
+    except:
+        shutil.rmtree(tmp_dst, ignore_errors=True)
+        raise
+
+    os.rename(tmp_dst, dst)
+    log.debug(f'snapshot {src} to {dst}: {dict(snapshotter.counts)}')
+    return snapshotter.counts
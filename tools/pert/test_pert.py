@@ -0,0 +1,76 @@
+import os
+import tempfile
+import json
+import unittest
+from unittest import mock
+from tools.pert.pert import gen_patch, main, parse_assertion
+
+source = '''int f(int x) {
+  int y = x + 1;
+  int w = y * 2;
+  return w;
+}
+'''
+
+
+class TestGenPatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirname = self.tmpdir.name
+        with open(os.path.join(self.dirname, 'a.c'), 'w') as f:
+            f.write(source)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_negates_whole_expression(self):
+        patch = gen_patch(self.dirname, [parse_assertion('a.c, after line 2 (int y = x + 1;), assert(y > 0);')])
+        self.assertIn('+if (!(y > 0)) {*((int*)0) = 0;} // my_assert\n', patch)
+
+    def test_assertions_in_same_file_use_original_line_numbers(self):
+        assertions = [
+            parse_assertion('a.c, before line 4 (return w;), assert(w < 10);'),
+            parse_assertion('a.c, after line 2 (int y = x + 1;), assert(y > 0);'),
+            parse_assertion('./a.c, before line 3 (int w = y * 2;), assert(y < 5);'),
+        ]
+        patch = gen_patch(self.dirname, assertions)
+        self.assertEqual(patch.count('--- '), 1)
+        added = [l[1:] for l in patch.splitlines() if l.startswith('+') and not l.startswith('+++')]
+        self.assertEqual(added, [
+            'if (!(y > 0)) {*((int*)0) = 0;} // my_assert',
+            'if (!(y < 5)) {*((int*)0) = 0;} // my_assert',
+            'if (!(w < 10)) {*((int*)0) = 0;} // my_assert',
+        ])
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        for bug, name in [('good-1-2', 'good'), ('bad-1-2', 'bad')]:
+            os.makedirs(os.path.join('functional', bug, name))
+            with open(os.path.join('functional', bug, name, 'a.c'), 'w') as f:
+                f.write(source)
+        with open('notes.tsv', 'w') as f:
+            f.write('Bug\tName\tAssert\n')
+            f.write('bad-1-2\tbad\ta.c line 2 assert(y > 0);\n')
+            f.write('missing-1-2\tmissing\ta.c, after line 2 (int y = x + 1;), assert(y > 0);\n')
+            f.write('good-1-2\tgood\ta.c, after line 2 (int y = x + 1;), assert(y > 0);\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_bad_rows_do_not_stop_other_bugs(self):
+        with mock.patch('sys.argv', ['pert', '-s', 'copy', '-j', '1']):
+            self.assertEqual(1, main())
+        self.assertTrue(os.path.isfile('functional/good-1-2/buggy.1/my_assert.patch'))
+        with open('pert.manifest.json') as f:
+            self.assertEqual(['good-1-2'], list(json.load(f)))
+
+
+if __name__ == '__main__':
+    unittest.main()
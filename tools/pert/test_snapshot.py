@@ -0,0 +1,104 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from tools.pert import snapshot as snapshot_module
+from tools.pert.snapshot import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmpdir.name, 'src')
+        self.dst = os.path.join(self.tmpdir.name, 'dst')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        for name in ['a.c', 'b.c', 'sub/c.c']:
+            with open(os.path.join(self.src, name), 'w') as f:
+                f.write(f'// {name}\n')
+        os.symlink('a.c', os.path.join(self.src, 'link.c'))
+        os.symlink('sub', os.path.join(self.src, 'sublink'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def same_file(self, name):
+        return os.path.samefile(os.path.join(self.src, name), os.path.join(self.dst, name))
+
+    def test_symlinks_are_copied_as_links(self):
+        snapshot(self.src, self.dst, 'copy')
+        self.assertEqual('a.c', os.readlink(os.path.join(self.dst, 'link.c')))
+        self.assertEqual('sub', os.readlink(os.path.join(self.dst, 'sublink')))
+        with open(os.path.join(self.dst, 'sub/c.c')) as f:
+            self.assertEqual('// sub/c.c\n', f.read())
+
+    def test_default_files_are_independent(self):
+        counts = snapshot(self.src, self.dst)
+        self.assertEqual(3, sum(counts.values()))
+        self.assertNotIn('hardlink', counts)
+        self.assertFalse(any(self.same_file(name) for name in ['a.c', 'b.c', 'sub/c.c']))
+
+    def test_hardlink_keeps_materialized_files_independent(self):
+        counts = snapshot(self.src, self.dst, 'hardlink', materialized=['./a.c'])
+        self.assertEqual({'hardlink': 2, 'copy': 1}, dict(counts))
+        self.assertFalse(self.same_file('a.c'))
+        self.assertTrue(self.same_file('sub/c.c'))
+        with open(os.path.join(self.dst, 'a.c'), 'w') as f:
+            f.write('patched\n')
+        with open(os.path.join(self.src, 'a.c')) as f:
+            self.assertEqual('// a.c\n', f.read())
+
+    def test_reflink_falls_back_to_copy_once(self):
+        reflink = mock.Mock(side_effect=OSError(errno.EOPNOTSUPP, 'not supported'))
+        with mock.patch.object(snapshot_module, 'reflink', reflink):
+            counts = snapshot(self.src, self.dst, 'reflink')
+        self.assertEqual({'copy': 3}, dict(counts))
+        self.assertEqual(1, reflink.call_count)
+
+    def test_hardlink_falls_back_to_copy(self):
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device link')):
+            counts = snapshot(self.src, self.dst, 'hardlink')
+        self.assertEqual({'copy': 3}, dict(counts))
+
+    def test_failed_snapshot_leaves_no_destination(self):
+        copy2 = shutil.copy2
+        calls = []
+
+        def failing_copy2(src, dst, **kwargs):
+            calls.append(src)
+            if len(calls) == 2:
+                raise OSError(errno.EIO, 'I/O error')
+            return copy2(src, dst, **kwargs)
+
+        with mock.patch('shutil.copy2', failing_copy2):
+            with self.assertRaises(OSError):
+                snapshot(self.src, self.dst, 'copy')
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(f'{self.dst}.snapshot'))
+        snapshot(self.src, self.dst, 'copy')
+        self.assertTrue(os.path.isfile(os.path.join(self.dst, 'sub/c.c')))
+        self.assertFalse(os.path.exists(f'{self.dst}.snapshot'))
+
+    def test_read_only_directories(self):
+        os.makedirs(os.path.join(self.src, 'ro/deeper'))
+        for name in ['ro/f.c', 'ro/deeper/g.c']:
+            with open(os.path.join(self.src, name), 'w') as f:
+                f.write(f'// {name}\n')
+        os.chmod(os.path.join(self.src, 'ro/deeper'), 0o555)
+        os.chmod(os.path.join(self.src, 'ro'), 0o555)
+        copystat = shutil.copystat
+
+        def check_copystat(src, dst, **kwargs):
+            # A directory's mode is only copied once everything in it is placed, which root would not notice
+            if os.path.isdir(src) and not os.path.islink(src):
+                self.assertEqual(sorted(os.listdir(src)), sorted(os.listdir(dst)))
+            return copystat(src, dst, **kwargs)
+
+        with mock.patch('shutil.copystat', check_copystat):
+            snapshot(self.src, self.dst, 'copy')
+        self.assertEqual(0o555, os.stat(os.path.join(self.dst, 'ro')).st_mode & 0o777)
+        self.assertEqual(0o555, os.stat(os.path.join(self.dst, 'ro/deeper')).st_mode & 0o777)
+        with open(os.path.join(self.dst, 'ro/deeper/g.c')) as f:
+            self.assertEqual('// ro/deeper/g.c\n', f.read())
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+from tools.pert.pert import make_patch
+from tools.pert.verify import is_triggered, strip_level, verify_bug
+
+source = '''#include <stdlib.h>
+int main(int argc, char** argv) {
+  int x = atoi(argv[1]);
+  return x - 5;
+}
+'''
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        os.makedirs('functional/prog-1-2/prog')
+        with open('functional/prog-1-2/prog/a.c', 'w') as f:
+            f.write(source)
+        self.row = {'Bug': 'prog-1-2', 'Name': 'prog', 'Assert': 'a.c, after line 3 (int x = atoi(argv[1]);), assert(x != 5);'}
+        make_patch([self.row], 'copy')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def verify(self, test):
+        args = Namespace(build='cc -o prog a.c', test=test, timeout=10, build_timeout=None, snapshot='copy')
+        return verify_bug('prog-1-2', self.row, args)
+
+    def test_assertion_triggers(self):
+        result = self.verify('./prog 5')
+        self.assertEqual('triggered', result['status'])
+        self.assertTrue(result['applied'] and result['built'])
+        with open('functional/prog-1-2/buggy.1/a.c') as f:
+            self.assertNotIn('my_assert', f.read())
+
+    def test_assertion_does_not_trigger(self):
+        result = self.verify('./prog 6')
+        self.assertEqual('not triggered (exit 1)', result['status'])
+        self.assertFalse(result['triggered'])
+
+    def test_test_timeout(self):
+        args = Namespace(build='true', test='sleep 10', timeout=0.2, build_timeout=None, snapshot='copy')
+        self.assertEqual('test timeout', verify_bug('prog-1-2', self.row, args)['status'])
+
+    def test_strip_level(self):
+        patch = '--- /x/y/functional/prog-1-2/prog/a.c\n+++ /x/y/functional/prog-1-2/prog/a.c\n'
+        self.assertEqual(6, strip_level(patch, 'functional/prog-1-2/buggy.1'))
+
+    def test_asan_report_triggers(self):
+        self.assertTrue(is_triggered(1, b'==1==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000000 (pc 0x1)'))
+        self.assertFalse(is_triggered(1, b'==1==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000010'))
+        self.assertFalse(is_triggered(0, b''))
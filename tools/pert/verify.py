@@ -0,0 +1,184 @@
+"""
+Check that each bug's assertion patch applies, builds and triggers on the failing test
+"""
+
+from mylog import log
+import metrics
+import mylog
+import jobserver
+from concurrent.futures import ProcessPoolExecutor
+from .pert import bug_dirnames, read_notes
+from .snapshot import snapshot
+from collections import defaultdict
+import argparse
+import csv
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+
+FIELDS = ['bug', 'status', 'applied', 'built', 'triggered', 'patch_seconds', 'build_seconds', 'test_seconds', 'workspace']
+
+# The assertion writes to address 0, which crashes with SIGSEGV, or makes AddressSanitizer report it
+asan_null_write = re.compile(rb'SEGV on unknown address 0x0+\b')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='pert verify', description='Apply each bug\'s my_assert.patch to a snapshot of its buggy directory, build it and check that the failing test triggers the assertion')
+    parser.add_argument('filter', nargs='?', help='Filter bugs to a certain filter')
+    parser.add_argument('-b', '--build', default='make', help='Shell command to build a bug, run in its snapshot. Default: make')
+    parser.add_argument('-t', '--test', required=True, help='Shell command to run the failing test, run in the snapshot. '
+                        'It should run the program on the failing input as its last command, so that its crash is the command\'s exit status')
+    parser.add_argument('--timeout', type=float, default=60, help='Timeout in seconds for the test. Default: 60')
+    parser.add_argument('--build-timeout', type=float, help='Timeout in seconds for the build. Default: none')
+    parser.add_argument('-s', '--snapshot', choices=['reflink', 'copy'], default='reflink',
+                        help='How to snapshot each buggy directory: reflink clones files where the filesystem can, falling back to copies, '
+                        'copy copies every file. Files are never hardlinked, since the build writes to the snapshot. Default: reflink')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of bugs to verify in parallel. Default: number of CPUs')
+    parser.add_argument('-o', '--results', default='pert.verify.tsv', help='Path to the results table. Default: pert.verify.tsv')
+    parser.add_argument('-k', '--keep', action='store_true', help='Keep every snapshot. By default only the snapshots of bugs which did not trigger are kept')
+    parser.add_argument('--notes', default='notes.tsv', help='Path to the notes file. Default: notes.tsv')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def strip_level(patch_text, root):
+    """
+    Get the -p level for patch at which the files named in the patch exist under root.
+    pert writes the paths of the original source tree into patches, so the level depends on where it was run.
+    """
+    paths = [l[4:].split('\t')[0].strip() for l in patch_text.splitlines() if l.startswith('--- ')]
+    if not paths:
+        raise Exception('no files in patch')
+    for p in range(max(path.count('/') for path in paths) + 1):
+        stripped = ['/'.join(path.split('/')[p:]) for path in paths]
+        if not any(os.path.isabs(s) for s in stripped) and all(os.path.isfile(os.path.join(root, s)) for s in stripped):
+            return p
+    raise Exception(f'files in patch not found in {root}: {", ".join(paths)}')
+
+
+def run_command(cmd, cwd, log_path, timeout=None, env=None):
+    """
+    Run a shell command with its output going to log_path.
+    On timeout, its whole process group is killed. Returns the exit status (None on timeout) and the seconds taken.
+    """
+    start = time.perf_counter()
+    with open(log_path, 'wb') as out:
+        proc = subprocess.Popen(cmd, shell=True, cwd=cwd, stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT,
+                                env=env, start_new_session=True)
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+            returncode = None
+    return returncode, time.perf_counter() - start
+
+
+def is_triggered(returncode, output):
+    """
+    Check whether a test run crashed on the assertion's write to address 0
+    """
+    if returncode in (-signal.SIGSEGV, 128 + signal.SIGSEGV):
+        return True
+    return returncode not in (0, None) and asan_null_write.search(output) is not None
+
+
+def verify_bug(bug, row, args):
+    """
+    Snapshot a bug's buggy directory, apply its patch, build it and run the failing test.
+    Runs in a worker process.
+    """
+    src_dirname, buggy_dirname = bug_dirnames(row)
+    patch_path = os.path.abspath(os.path.join(buggy_dirname, 'my_assert.patch'))
+    workspace = f'{buggy_dirname}.verify'
+    result = {'bug': bug, 'status': 'error', 'applied': False, 'built': False, 'triggered': False, 'workspace': workspace}
+
+    if os.path.lexists(workspace):
+        shutil.rmtree(workspace)
+    snapshot(buggy_dirname, workspace, args.snapshot)
+    env = dict(os.environ, PERT_BUG=bug, PERT_NAME=row['Name'], PERT_SOURCE=os.path.abspath(src_dirname),
+               PERT_WORKSPACE=os.path.abspath(workspace))
+
+    with open(patch_path) as f:
+        level = strip_level(f.read(), workspace)
+    returncode, result['patch_seconds'] = run_command(f'patch -p{level} --batch --forward -i {shlex.quote(patch_path)}', workspace,
+                                                      os.path.join(workspace, 'verify.patch.log'), env=env)
+    if returncode != 0:
+        result['status'] = 'patch failed'
+        return result
+    result['applied'] = True
+
+    returncode, result['build_seconds'] = run_command(args.build, workspace, os.path.join(workspace, 'verify.build.log'),
+                                                      args.build_timeout, env)
+    if returncode != 0:
+        result['status'] = 'build timeout' if returncode is None else 'build failed'
+        return result
+    result['built'] = True
+
+    test_log = os.path.join(workspace, 'verify.test.log')
+    returncode, result['test_seconds'] = run_command(args.test, workspace, test_log, args.timeout, env)
+    with open(test_log, 'rb') as f:
+        result['triggered'] = is_triggered(returncode, f.read())
+    if result['triggered']:
+        result['status'] = 'triggered'
+    else:
+        result['status'] = 'test timeout' if returncode is None else f'not triggered (exit {returncode})'
+    return result
+
+
+def write_results(path, results):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, FIELDS, delimiter='\t', restval='')
+        writer.writeheader()
+        for result in results:
+            writer.writerow({k: f'{v:.3f}' if isinstance(v, float) else v for k, v in result.items()})
+    os.replace(tmp_path, path)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+    mylog.configure(args)
+    metrics.configure(args)
+
+    # One patch per bug, in the buggy directory pert made
+    rows = {}
+    for row in read_notes(args.notes, args.filter):
+        rows.setdefault(row['Bug'], row)
+    missing = [bug for bug, row in rows.items() if not os.path.isfile(os.path.join(bug_dirnames(row)[1], 'my_assert.patch'))]
+    for bug in missing:
+        log.warning(f'no patch for {bug}, run pert first')
+    log.info(f'verifying {len(rows) - len(missing)} bugs')
+
+    results = []
+    with metrics.timer('verify'), jobserver.executor(ProcessPoolExecutor, max_workers=args.jobs) as pool:
+        futures = [(bug, pool.submit(verify_bug, bug, row, args)) for bug, row in rows.items() if bug not in missing]
+        for bug, future in futures:
+            try:
+                result = future.result()
+            except:
+                log.exception(f'error verifying {bug}')
+                result = {'bug': bug, 'status': 'error'}
+            log.info(f'{bug}: {result["status"]}')
+            if result.get('triggered') and not args.keep:
+                shutil.rmtree(result['workspace'], ignore_errors=True)
+                result['workspace'] = ''
+            results.append(result)
+    results += [{'bug': bug, 'status': 'no patch'} for bug in missing]
+    write_results(args.results, results)
+
+    statuses = defaultdict(int)
+    for result in results:
+        statuses[result['status']] += 1
+        metrics.count(result['status'])
+    log.info(f'wrote {args.results}: {dict(statuses)}')
+    return 0 if statuses['triggered'] == len(results) else 1
@@ -0,0 +1,169 @@
+"""
+Run trace, plog and harn for a code segment in one process.
+
+The segment and the original file which defines its target are parsed once and shared by all stages,
+along with one Clang index and one symbol index lookup.
+"""
+
+from argparse import Namespace
+from mylog import log
+from nodeutils import ParseCache
+from pathlib import Path
+from symindex import SymbolIndex
+import argparse
+import compdb
+import fileutils
+import json
+import logging
+import metrics
+import mylog
+import re
+import sys
+
+from tools.harn import harn
+from tools.harn.binary import BinaryInput
+from tools.plog import plog
+from tools.trace import trace
+from tools.trace.pin import Pin
+
+default_pinroot = Path(__file__).parent.parent / 'trace' / 'pin-3.16'
+
+
+def parse_args(argv):
+    if '--' not in argv:
+        raise argparse.ArgumentTypeError('A delimiter -- before the command is required')
+    command = argv[argv.index('--')+1:]
+    argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(prog='paltool pipeline', description='Trace the program, generate the gdb script for the segment and generate its test harness, in one process')
+    parser.add_argument('segment_file', help='Segment file')
+    parser.add_argument('original_dir', help='Directory of the original project')
+    parser.add_argument('-o', '--output-dir', default='.', help='Directory to write the trace, gdb script and test harness to. Default: .')
+    parser.add_argument('-c', '--clang-args', default='', help='Arguments to clang (e.g. -I..., -W...)')
+    parser.add_argument('-t', '--target', help='Target function in the segment')
+    parser.add_argument('-a', '--array', action='append', default=[], help='Assign length expressions for array variables, in the format "array:length"')
+    parser.add_argument('-m', '--mode', choices=list(harn.templates), default='argv', help='How the test harness reads input, as in harn -m')
+    parser.add_argument('-f', '--no-format', action='store_true', help='Don\'t format the test harness with clang-format')
+    parser.add_argument('-d', '--depth', type=int, default=0, help='Also trace callees of the target up to this many calls deep. Default: 0')
+    parser.add_argument('-p', '--pin-root', type=Path, default=default_pinroot, help=f'Path to Pin root. Default: {default_pinroot}')
+    parser.add_argument('--include_source_prefix', nargs='+', default=['/home', '/root'], help='Prefixes from which to include source files in the trace, as in trace')
+    parser.add_argument('--no-trace', action='store_true', help='Skip the trace stage, which needs Pin')
+    parser.add_argument('--capture', action='store_true', help='Also capture the segment\'s inputs by running the program under gdb, as in plog capture')
+    parser.add_argument('-i', '--stdin', help='File to pass to the program on stdin when capturing')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for indexing the original project. Default: number of CPUs')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if not command:
+        parser.error('no program given after --')
+    args.program, args.program_args = command[0], command[1:]
+    return args
+
+
+class Pipeline:
+    """State shared by the stages for one segment"""
+
+    def __init__(self, args):
+        self.args = args
+        self.clang_args = args.clang_args.split()
+        self.cache = ParseCache()
+        self.output_dir = Path(args.output_dir)
+        self.stem = Path(args.segment_file).stem
+        self.arrays = dict(a.split(':') for a in args.array)
+
+    def resolve(self):
+        """Find the segment's target and the first statement of the original function, parsing each file once"""
+        with metrics.timer('resolve'):
+            self.seg_cur = self.cache.parse(self.args.segment_file, self.clang_args)
+            self.seg_target = plog.select_target(self.seg_cur, target_name=self.args.target)
+            self.target_name = re.match(r'helium_(.*)', self.seg_target.spelling).group(1)
+            with SymbolIndex(self.args.original_dir) as symbols:
+                symbols.update(clang_args=self.clang_args, jobs=self.args.jobs)
+                first_stmts = plog.find_first_stmts(symbols, [self.target_name], parse=self.cache.parse, clang_args=self.clang_args)
+            if self.target_name not in first_stmts:
+                raise Exception(f'could not find a definition of {self.target_name} in {self.args.original_dir}')
+            self.location = first_stmts[self.target_name]
+            log.info(f'target {self.target_name} starts at {self.location[0]}:{self.location[1]}')
+
+    def harness(self):
+        """Generate the segment's test harness, as harn does"""
+        with metrics.timer('harn'):
+            reader = BinaryInput() if self.args.mode == 'mmap' else harn.TextInput()
+            test_harness = harn.codegen(self.seg_target, self.args.mode, reader)
+            text = harn.render(harn.read_input_file(self.seg_cur), test_harness, self.args.no_format)
+            path = self.output_dir / f'{self.stem}.harness.c'
+            fileutils.write_atomic(path, text)
+            log.info(f'wrote test harness {path}')
+            if self.args.mode == 'mmap':
+                layout_path = self.output_dir / f'{self.stem}.harness.layout.json'
+                fileutils.write_atomic(layout_path, json.dumps(reader.layout(), indent=2))
+
+    def trace(self):
+        """Trace the target's activations with Pin, as trace --function does"""
+        with metrics.timer('trace'):
+            pin = Pin(Namespace(pin_root=self.args.pin_root.absolute(), keep_logfile=False))
+            if not pin.is_valid():
+                raise Exception(f'{self.args.pin_root} is not a valid Pin installation, see tools/trace/install.sh or use --no-trace')
+
+            def scope(locs):
+                return trace.iter_in_function(locs, self.target_name, self.args.depth, self.clang_args, self.cache.parse)
+            locations = pin.run(Path(self.args.program), self.args.program_args, lambda locs: trace.select_dynamic_locations(
+                locs, self.args.include_source_prefix, scope=scope))
+            path = self.output_dir / f'{self.stem}.trace.txt'
+            with open(path, 'w') as f:
+                f.writelines(f'{l.filepath}:{l.lineno}\n' for l in trace.slim(locations, False, False))
+            log.info(f'wrote {len(locations)} trace locations to {path}')
+
+    def gdb_script(self):
+        """Generate the gdb script which prints the segment's inputs, as plog does"""
+        with metrics.timer('plog'):
+            parms = list(self.seg_target.get_arguments())
+            self.parms = [p.spelling for p in parms]
+            stmts = [plog.gen_breakpoint(*self.location)] + list(plog.gen_printfs(parms, self.arrays))
+            path = self.output_dir / f'{self.stem}.gdb'
+            path.write_text('\n'.join(stmts) + '\n')
+            log.info(f'wrote gdb script {path}')
+
+    def capture(self):
+        """Capture the segment's inputs under gdb, as plog capture does"""
+        from tools.plog import capture
+        with metrics.timer('capture'):
+            segment = {
+                'segment': self.args.segment_file,
+                'location': self.location,
+                'parms': self.parms,
+                'arrays': {p: self.arrays[p] for p in self.parms if p in self.arrays},
+            }
+            capture.capture([segment], self.args.program, self.args.program_args,
+                            self.output_dir / f'{self.stem}.capture.json', self.args.stdin)
+
+
+def main(argv):
+    args = parse_args(argv)
+    log.setLevel(logging.INFO)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+    mylog.configure(args)
+    metrics.configure(args)
+    compdb.configure(args)
+
+    pipeline = Pipeline(args)
+    pipeline.output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        pipeline.resolve()
+        pipeline.harness()
+        pipeline.gdb_script()
+        if not args.no_trace:
+            pipeline.trace()
+        if args.capture:
+            pipeline.capture()
+    except:
+        log.exception(f'error running the pipeline for {args.segment_file}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
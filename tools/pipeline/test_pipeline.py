@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import nodeutils
+from tools.pipeline import pipeline
+from tools.trace.trace import FunctionExtents
+
+segment = '''int helium_work(int n, char *s) {
+  int t = n * SCALE;
+  return t + s[0];
+}
+'''
+original = '''int work(int n, char *s) {
+  int t = n * SCALE;
+  return t + s[0];
+}
+int main(int argc, char **argv) {
+  return work(argc, argv[0]);
+}
+'''
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        (self.dir / 'orig').mkdir()
+        (self.dir / 'orig' / 'prog.c').write_text(original)
+        (self.dir / 'seg.c').write_text(segment)
+        self.out = self.dir / 'out'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def argv(self, *extra):
+        return [str(self.dir / 'seg.c'), str(self.dir / 'orig'), '-o', str(self.out), '-c=-DSCALE=2',
+                '--no-trace', '-f', '-j', '1', *extra, '--', str(self.dir / 'prog')]
+
+    def test_writes_artifacts(self):
+        self.assertEqual(0, pipeline.main(self.argv('-m', 'mmap')))
+        harness = (self.out / 'seg.harness.c').read_text()
+        self.assertIn('helium_work(n, s);', harness)
+        self.assertTrue((self.out / 'seg.harness.layout.json').is_file())
+        script = (self.out / 'seg.gdb').read_text().splitlines()
+        self.assertEqual('b prog.c:1', script[0])
+        self.assertEqual(['print n', 'print *s'], script[1:])
+
+    def test_parses_each_file_once(self):
+        args = pipeline.parse_args(self.argv())
+        p = pipeline.Pipeline(args)
+        p.output_dir.mkdir()
+        with mock.patch('nodeutils.parse', wraps=nodeutils.parse) as parse:
+            p.resolve()
+            p.harness()
+            p.gdb_script()
+            # The trace stage finds function extents in the original file with the same cache and args
+            extents = FunctionExtents(p.clang_args, p.cache.parse)
+            self.assertEqual('work', extents.function_at(str(self.dir / 'orig' / 'prog.c'), 3)[1])
+        parsed = sorted(os.path.basename(c.args[0]) for c in parse.call_args_list)
+        self.assertEqual(['prog.c', 'seg.c'], parsed)
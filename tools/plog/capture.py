@@ -0,0 +1,143 @@
+"""
+Capture the input variables of many code segments in one gdb session
+"""
+
+from mylog import log
+import compdb
+import metrics
+import mylog
+from pathlib import Path
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+from . import plog
+
+gdb_script = Path(__file__).parent / 'gdb_capture.py'
+
+
+def capture_config(segments, output, stdin=None, max_depth=8, max_elements=1000):
+    """
+    Get the config which tells gdb_capture.py where to break and what to capture
+    """
+    return {
+        'segments': [
+            {
+                'segment': s['segment'],
+                'location': f'{s["location"][0]}:{s["location"][1]}',
+                'parms': s['parms'],
+                'arrays': s['arrays'],
+            } for s in segments
+        ],
+        'stdin': str(Path(stdin).absolute()) if stdin else None,
+        'max_depth': max_depth,
+        'max_elements': max_elements,
+        'output': str(Path(output).absolute()),
+    }
+
+
+def gdb_command(gdb, config_file, program, program_args):
+    return [gdb, '-nx', '-batch',
+            '-ex', f'python CAPTURE_CONFIG = {str(config_file)!r}',
+            '-x', str(gdb_script),
+            '--args', str(program), *program_args]
+
+
+def read_captures(output):
+    """
+    Read the variables gdb captured, warning about segments whose breakpoint was not hit
+    """
+    captures = json.loads(Path(output).read_text())
+    missed = [s for s, c in captures.items() if c is None]
+    for s in missed:
+        log.warning(f'breakpoint for segment {s} was not hit')
+    log.info(f'captured {len(captures) - len(missed)} of {len(captures)} segments to {output}')
+    return captures
+
+
+def capture(segments, program, program_args, output, stdin=None, max_depth=8, max_elements=1000, gdb='gdb', timeout=None):
+    """
+    Run program once under gdb with a breakpoint for every segment and write the captured variables to output as JSON
+    """
+    if shutil.which(gdb) is None:
+        raise Exception(f'gdb not found: {gdb}')
+
+    if Path(output).is_file():
+        Path(output).unlink()
+
+    with tempfile.TemporaryDirectory(prefix='plog-capture-') as tmpdir:
+        config_file = Path(tmpdir) / 'config.json'
+        config_file.write_text(json.dumps(capture_config(segments, output, stdin, max_depth, max_elements)))
+
+        cmd = gdb_command(gdb, config_file, program, program_args)
+        log.debug(f'gdb command: {cmd}')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+        for l in proc.stdout.decode(errors='replace').splitlines():
+            log.debug(f'* {l}')
+        if not Path(output).is_file():
+            raise Exception(f'gdb exited with code {proc.returncode} without writing {output}')
+
+    return read_captures(output)
+
+
+def parse_args(argv):
+    if '--' not in argv:
+        raise argparse.ArgumentTypeError('A delimiter -- before the command is required')
+    command = argv[argv.index('--')+1:]
+    argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(prog='plog capture', description='Capture the input variables of many segments by running the program with the failure inducing input once under gdb')
+    parser.add_argument('original_dir', help='Directory of the original project')
+    parser.add_argument('segment_files', nargs='+', help='Segment files')
+    parser.add_argument('-o', '--output', help='Path to write the captured variables to as JSON', default='capture.json')
+    parser.add_argument('-i', '--stdin', help='File to pass to the program on stdin')
+    parser.add_argument('-d', '--max-depth', type=int, default=8, help='How many levels of pointers and struct fields to capture')
+    parser.add_argument('--max-elements', type=int, default=1000, help='How many elements of each array to capture')
+    parser.add_argument('--gdb', default='gdb', help='Path to gdb')
+    parser.add_argument('--timeout', type=float, help='Timeout in seconds for the gdb session')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    parser.add_argument('-a', '--array', action='append', default=[], help='Assign length expressions for array variables in all segments, in the format "array:length"')
+    parser.add_argument('-t', '--target', help='Target function in each segment')
+    parser.add_argument('-c', '--clang-args', help='Arguments to clang (e.g. -I..., -W...)', default='')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for parsing. Default: number of CPUs')
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if not command:
+        parser.error('no program given after --')
+    args.program, args.program_args = command[0], command[1:]
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(args.log_level)
+    mylog.configure(args)
+    metrics.configure(args)
+    compdb.configure(args)
+
+    if shutil.which(args.gdb) is None:
+        log.error(f'gdb not found: {args.gdb}. Install gdb or give its path with --gdb')
+        return 1
+
+    with metrics.timer('resolve'):
+        segments = plog.resolve_segments(args.original_dir, args.segment_files, args.clang_args.split(), args.target, args.array, args.jobs)
+    segments = [s for s in segments if s['location'] is not None]
+    arrays = dict(a.split(':') for a in args.array)
+    for s in segments:
+        s['arrays'] = {p: arrays[p] for p in s['parms'] if p in arrays}
+    if not segments:
+        log.error('no segments to capture')
+        return 1
+
+    try:
+        with metrics.timer('capture'):
+            capture(segments, args.program, args.program_args, args.output, args.stdin,
+                    args.max_depth, args.max_elements, args.gdb, args.timeout)
+    except:
+        log.exception('error capturing segments')
+        return 1
+    return 0
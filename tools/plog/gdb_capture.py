@@ -0,0 +1,115 @@
+"""
+Capture the input variables of code segments. Runs inside gdb:
+
+gdb -nx -batch -ex "python CAPTURE_CONFIG = '<config.json>'" -x gdb_capture.py --args <program> <args>
+
+The config lists the segments with their breakpoint location, parameter names and array length expressions.
+Each segment's variables are captured the first time its breakpoint is hit and written to the config's output file.
+"""
+
+import gdb
+import json
+
+config = json.load(open(CAPTURE_CONFIG))
+max_depth = config['max_depth']
+max_elements = config['max_elements']
+
+
+def to_json(value, depth, seen=frozenset()):
+    """
+    Convert a gdb value to JSON, following pointers and fields up to depth levels deep
+    """
+    t = value.type.strip_typedefs()
+    if t.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_BOOL):
+        return int(value)
+    elif t.code == gdb.TYPE_CODE_FLT:
+        return float(value)
+    elif t.code == gdb.TYPE_CODE_ENUM:
+        return str(value)
+    elif t.code == gdb.TYPE_CODE_PTR:
+        address = int(value)
+        if address == 0:
+            return None
+        target = t.target().strip_typedefs()
+        pointer = {'address': hex(address)}
+        try:
+            if target.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR) and target.sizeof == 1:
+                pointer['string'] = value.string(errors='replace')
+            elif target.code == gdb.TYPE_CODE_FUNC:
+                pointer['function'] = str(value)
+            elif depth > 0 and address not in seen and target.code != gdb.TYPE_CODE_VOID:
+                pointer['value'] = to_json(value.dereference(), depth - 1, seen | {address})
+        except gdb.MemoryError as e:
+            pointer['error'] = str(e)
+        return pointer
+    elif t.code == gdb.TYPE_CODE_ARRAY:
+        low, high = t.range()
+        high = min(high, low + max_elements - 1)
+        return [to_json(value[i], depth, seen) for i in range(low, high + 1)]
+    elif t.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+        if depth < 0:
+            return '...'
+        return {f.name or f'<anonymous {i}>': to_json(value[f], depth - 1, seen)
+                for i, f in enumerate(t.fields()) if not f.artificial}
+    else:
+        return str(value)
+
+
+class SegmentBreakpoint(gdb.Breakpoint):
+    """
+    Breakpoint at the first statement of a segment's target function
+    """
+
+    def __init__(self, segment):
+        super().__init__(segment['location'], internal=True)
+        self.segment = segment
+        self.capture = None
+
+    def stop(self):
+        if self.capture is not None:
+            return False
+        frame = gdb.selected_frame()
+        variables = {}
+        for name in self.segment['parms']:
+            try:
+                if name in self.segment['arrays']:
+                    value = gdb.parse_and_eval(f'*{name}@{self.segment["arrays"][name]}')
+                else:
+                    value = frame.read_var(name)
+                variables[name] = to_json(value, max_depth)
+            except (gdb.error, ValueError) as e:
+                variables[name] = {'error': str(e)}
+        self.capture = {
+            'function': frame.name(),
+            'location': self.segment['location'],
+            'variables': variables,
+        }
+        # Stop so that the driver can disable this breakpoint, which is not allowed inside stop()
+        return True
+
+
+def main():
+    gdb.execute('set pagination off')
+    gdb.execute('set confirm off')
+    gdb.execute('set breakpoint pending on')
+    breakpoints = [SegmentBreakpoint(s) for s in config['segments']]
+
+    run = 'run'
+    if config['stdin']:
+        run += f' < {config["stdin"]}'
+    gdb.execute(run)
+    while gdb.selected_inferior().pid != 0:
+        for bp in breakpoints:
+            if bp.capture is not None and bp.enabled:
+                bp.enabled = False
+        if all(bp.capture is not None for bp in breakpoints):
+            gdb.execute('kill')
+            break
+        gdb.execute('continue')
+
+    captures = {bp.segment['segment']: bp.capture for bp in breakpoints}
+    with open(config['output'], 'w') as f:
+        json.dump(captures, f, indent=2)
+
+
+main()
@@ -2,20 +2,39 @@ from nodeutils import find, parse, pp
 from clang.cindex import CursorKind, TypeKind
 
 from mylog import log
+import compdb
+import metrics
+import mylog
+import jobserver
+from symindex import SymbolIndex, reset_index
+from collections import defaultdict
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import logging
-import difflib
 import argparse
+import re
+import sys
 
 verbose = False
 
 def main():
     log.setLevel(logging.INFO)
 
+    if sys.argv[1:2] == ['batch']:
+        exit(batch_main(sys.argv[2:]))
+    if sys.argv[1:2] == ['capture']:
+        from . import capture
+        exit(capture.main(sys.argv[2:]))
+
     args = parse_args()
 
     if args.log_level:
         log.setLevel(args.log_level)
         log.debug(f'setting log level to {args.log_level}')
+    mylog.configure(args)
+    metrics.configure(args)
+    compdb.configure(args)
 
     seg_c = args.segment_file
     orig_dir = args.original_file
@@ -35,28 +54,138 @@ def main():
     parms = list(seg_target.get_arguments())
 
     log.debug(f'target: {pp(seg_target)}')
-    import re
     target_name = re.match(r'helium_(.*)', seg_target.spelling).group(1)
-    
-    from pathlib import Path
-    for orig_c in Path(orig_dir).glob('**/*.c'):
-        orig_cur = parse(orig_c)
-        orig_funcdecls = find(orig_cur, CursorKind.FUNCTION_DECL, verbose)
-        orig_target = next((f.get_definition() for f in orig_funcdecls if is_the_same(f, seg_target) and f.get_definition() is not None), None)
-        if orig_target is not None:
-            break
-    log.debug(f'target: {pp(orig_target)}')
-    orig_body = find(orig_target, lambda c: c is not None and c.kind.is_statement(), verbose=verbose)
-    first_stmt = next(iter(orig_body))
-    first_stmt_file, first_stmt_line = first_stmt.location.file.name, first_stmt.location.line
+
+    with SymbolIndex(orig_dir) as symbols, metrics.timer('index'):
+        symbols.update(jobs=args.jobs)
+        first_stmts = find_first_stmts(symbols, [target_name])
+    if target_name not in first_stmts:
+        log.error(f'could not find a definition of {target_name} in {orig_dir}')
+        exit(1)
+    first_stmt_file, first_stmt_line = first_stmts[target_name]
 
     diff = gen_patch(first_stmt_file, first_stmt_line, parms, args.array)
     print('\n'.join(diff))
 
+
+def find_first_stmts(symbols, target_names, parse=parse, clang_args=[]):
+    """
+    Get the file and line of the first statement of each target function in the original project.
+    Each file with a target function is parsed only once, with clang_args.
+    """
+    targets_by_file = defaultdict(set)
+    for name in target_names:
+        for path, _, _ in symbols.lookup(name):
+            targets_by_file[path].add(name)
+
+    first_stmts = {}
+    for path, names in targets_by_file.items():
+        orig_cur = parse(path, clang_args)
+        for f in orig_cur.get_children():
+            if f.kind == CursorKind.FUNCTION_DECL and f.spelling in names and f.is_definition() and f.spelling not in first_stmts:
+                log.debug(f'target: {pp(f)}')
+                orig_body = find(f, lambda c: c is not None and c.kind.is_statement(), verbose=verbose)
+                first_stmt = next(iter(orig_body))
+                first_stmts[f.spelling] = (first_stmt.location.file.name, first_stmt.location.line)
+    return first_stmts
+
+
+def segment_info(seg_c, clang_args, target, array_expressions):
+    """
+    Get the name of the original target function, the parameter names and the print commands for one segment.
+    Runs in a worker process.
+    """
+    try:
+        seg_cur = parse(seg_c, clang_args)
+        seg_target = select_target(seg_cur, target_name=target)
+        target_name = re.match(r'helium_(.*)', seg_target.spelling).group(1)
+        arrays = dict(a.split(':') for a in array_expressions)
+        parms = list(seg_target.get_arguments())
+        return target_name, [p.spelling for p in parms], list(gen_printfs(parms, arrays))
+    except:
+        log.exception(f'error parsing segment {seg_c}')
+        return None, [], []
+
+
+def resolve_segments(original_dir, segment_files, clang_args, target, array_expressions, jobs=None):
+    """
+    Parse segments in parallel and find the first statement of each segment's target function
+    with one scan of the original project.
+    Returns a dict for each segment, with location None if the target was not found.
+    """
+    with jobserver.executor(ProcessPoolExecutor, max_workers=jobs, initializer=reset_index) as pool:
+        infos = list(pool.map(segment_info, segment_files, repeat(clang_args), repeat(target), repeat(array_expressions)))
+    log.info(f'parsed {len(infos)} segments')
+
+    with SymbolIndex(original_dir) as symbols:
+        symbols.update(jobs=jobs)
+        first_stmts = find_first_stmts(symbols, {name for name, _, _ in infos if name})
+
+    segments = []
+    for seg_c, (target_name, parms, printfs) in zip(segment_files, infos):
+        location = first_stmts.get(target_name)
+        if target_name and location is None:
+            log.error(f'could not find a definition of {target_name} for segment {seg_c}')
+        segments.append({'segment': seg_c, 'target': target_name, 'parms': parms, 'printfs': printfs, 'location': location})
+    return segments
+
+
+def script_names(segment_files):
+    """
+    Get the name of each segment's gdb script, named after the segment.
+    Raises an exception if two segments would get the same script.
+    """
+    names = [f'{Path(seg_c).stem}.gdb' for seg_c in segment_files]
+    by_name = defaultdict(list)
+    for seg_c, name in zip(segment_files, names):
+        by_name[name].append(seg_c)
+    collisions = {name: files for name, files in by_name.items() if len(files) > 1}
+    if collisions:
+        raise Exception('segments would overwrite each other\'s gdb scripts: ' +
+                        '; '.join(f'{", ".join(files)} -> {name}' for name, files in collisions.items()))
+    return names
+
+
+def batch_main(argv):
+    """
+    Generate gdb scripts for many segments with one scan of the original project
+    """
+    args = parse_batch_args(argv)
+    if args.log_level:
+        log.setLevel(args.log_level)
+    mylog.configure(args)
+    metrics.configure(args)
+    compdb.configure(args)
+
+    try:
+        names = script_names(args.segment_files)
+    except Exception as e:
+        log.error(str(e))
+        return 1
+
+    with metrics.timer('resolve'):
+        segments = resolve_segments(args.original_dir, args.segment_files, args.clang_args.split(), args.target, args.array, args.jobs)
+    metrics.count('segments', len(segments))
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    failed = 0
+    for segment, name in zip(segments, names):
+        if segment['location'] is None:
+            failed += 1
+            continue
+        script = output_dir / name
+        stmts = [gen_breakpoint(*segment['location'])] + segment['printfs']
+        script.write_text('\n'.join(stmts) + '\n')
+        log.debug(f'wrote {script}')
+    log.info(f'wrote {len(segments) - failed} gdb scripts to {output_dir}, {failed} failed')
+    return 1 if failed else 0
+
+
 def gen_patch(file, line, parms, array_expressions):
     stmts = []
 
-    stmts.append(f'b {file.split("/")[-1]}:{line}')
+    stmts.append(gen_breakpoint(file, line))
 
     arrays = dict(a.split(':') for a in array_expressions)
     log.debug(f'{len(parms)} parameters')
@@ -66,6 +195,10 @@ def gen_patch(file, line, parms, array_expressions):
 
     return stmts
 
+
+def gen_breakpoint(file, line):
+    return f'b {file.split("/")[-1]}:{line}'
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('segment_file')
@@ -75,9 +208,28 @@ def parse_args():
     parser.add_argument('-a', '--array', action='append', default=[], help='Assign length expressions for array variables. Length expressions are in the format "array:length", where array is the name of the array and length is a C expression to be evaluated at runtime, typically a number or variable reference')
     parser.add_argument('-t', '--target', help='Target function in the segment')
     parser.add_argument('-c', '--clang-args', help='Arguments to clang (e.g. -I..., -W...)', default='')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for parsing. Default: number of CPUs')
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
     args = parser.parse_args()
     return args
 
+def parse_batch_args(argv):
+    parser = argparse.ArgumentParser(prog='plog batch', description='Generate gdb scripts for many segments with one scan of the original project')
+    parser.add_argument('original_dir', help='Directory of the original project')
+    parser.add_argument('segment_files', nargs='+', help='Segment files')
+    parser.add_argument('-o', '--output-dir', help='Directory to write one gdb script per segment to, named after the segment', default='.')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    parser.add_argument('-a', '--array', action='append', default=[], help='Assign length expressions for array variables in all segments, in the format "array:length"')
+    parser.add_argument('-t', '--target', help='Target function in each segment')
+    parser.add_argument('-c', '--clang-args', help='Arguments to clang (e.g. -I..., -W...)', default='')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for parsing. Default: number of CPUs')
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
 def is_the_same(orig_cursor, seg_cursor):
     """
     Compare a cursor from the original and the segment to see if they refer to the same function in the project
@@ -102,7 +254,7 @@ def select_target(cur, target_name=None):
         eligible = filter(lambda f: '.c' in f.location.file.name and f.spelling != 'main', func_decls)
         return max(eligible, key=lambda f: f.location.line)
 
-def gen_printfs(parms):
+def gen_printfs(parms, arrays={}):
     """
     Generate printf statements for a set of function parmameters, otherwise leave a to do comment
     """
@@ -112,7 +264,9 @@ def gen_printfs(parms):
 
         log.debug(f'name {name} type kind {t.kind}')
 
-        if t.kind == TypeKind.POINTER:
+        if name in arrays:
+            name = f'*{name}@{arrays[name]}'
+        elif t.kind == TypeKind.POINTER:
             name = f'*{name}'
         yield f'print {name}'
 
@@ -0,0 +1,12 @@
+import unittest
+from tools.plog.plog import script_names
+
+
+class TestScriptNames(unittest.TestCase):
+
+    def test_named_after_segments(self):
+        self.assertEqual(['a.gdb', 'b.gdb'], script_names(['x/a.c', 'y/b.c']))
+
+    def test_same_stem_in_different_directories(self):
+        with self.assertRaisesRegex(Exception, 'x/a.c, y/a.c -> a.gdb'):
+            script_names(['x/a.c', 'y/a.c', 'z/b.c'])
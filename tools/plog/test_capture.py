@@ -0,0 +1,53 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from tools.plog import capture
+
+segments = [
+    {'segment': 'seg1.c', 'location': ('/src/a.c', 12), 'parms': ['n', 'buf'], 'arrays': {'buf': 'n'}},
+    {'segment': 'seg2.c', 'location': ('/src/b.c', 3), 'parms': ['s'], 'arrays': {}},
+]
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dir = Path(self.tmpdir.name)
+
+    def test_config(self):
+        config = capture.capture_config(segments, self.dir / 'out.json', stdin=self.dir / 'input', max_depth=2)
+        self.assertEqual([
+            {'segment': 'seg1.c', 'location': '/src/a.c:12', 'parms': ['n', 'buf'], 'arrays': {'buf': 'n'}},
+            {'segment': 'seg2.c', 'location': '/src/b.c:3', 'parms': ['s'], 'arrays': {}},
+        ], config['segments'])
+        self.assertEqual((str(self.dir / 'input'), str(self.dir / 'out.json'), 2, 1000),
+                         (config['stdin'], config['output'], config['max_depth'], config['max_elements']))
+        self.assertIsNone(capture.capture_config(segments, 'out.json')['stdin'])
+        json.dumps(config)
+
+    def test_gdb_command(self):
+        cmd = capture.gdb_command('gdb', self.dir / 'config.json', './prog', ['-x', 'in put'])
+        self.assertEqual(['gdb', '-nx', '-batch', '-ex', f'python CAPTURE_CONFIG = {str(self.dir / "config.json")!r}',
+                          '-x', str(capture.gdb_script), '--args', './prog', '-x', 'in put'], cmd)
+        self.assertTrue(capture.gdb_script.is_file())
+
+    def test_read_captures(self):
+        output = self.dir / 'out.json'
+        captured = {'function': 'helium_f', 'location': '/src/a.c:12', 'variables': {'n': 2, 'buf': [1, 2]}}
+        output.write_text(json.dumps({'seg1.c': captured, 'seg2.c': None}))
+        with self.assertLogs(capture.log, 'WARNING') as logs:
+            self.assertEqual({'seg1.c': captured, 'seg2.c': None}, capture.read_captures(output))
+        self.assertIn('breakpoint for segment seg2.c was not hit', logs.output[0])
+
+    def test_missing_gdb(self):
+        missing = str(self.dir / 'no-gdb')
+        with self.assertRaisesRegex(Exception, 'gdb not found'):
+            capture.capture(segments, './prog', [], self.dir / 'out.json', gdb=missing)
+        with mock.patch.object(capture.plog, 'resolve_segments') as resolve, self.assertLogs(capture.log, 'ERROR') as logs:
+            self.assertEqual(1, capture.main([str(self.dir), 'seg1.c', '--gdb', missing, '--', './prog']))
+        resolve.assert_not_called()
+        self.assertIn(f'gdb not found: {missing}', logs.output[0])
@@ -0,0 +1,78 @@
+"""
+Line execution counts from a stream of trace events
+"""
+
+from array import array
+import numpy as np
+
+BATCH_EVENTS = 1 << 16
+
+
+class LineCounts:
+    """
+    Count the events at each (file, line).
+    Each location gets a dense ID; IDs are buffered and counted into a NumPy array a batch at a time.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = array('q')
+
+    def add(self, filepath, lineno):
+        key = (filepath, lineno)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        self.pending.append(i)
+        if len(self.pending) >= BATCH_EVENTS:
+            self.flush()
+
+    def tap(self, locs):
+        """Count a stream of locations while passing it through"""
+        for l in locs:
+            self.add(l.filepath, l.lineno)
+            yield l
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch = np.bincount(np.frombuffer(self.pending, dtype=np.int64), minlength=len(self.keys))
+        if len(self.counts) < len(batch):
+            self.counts = np.concatenate([self.counts, np.zeros(len(batch) - len(self.counts), dtype=np.int64)])
+        self.counts += batch
+        self.pending = array('q')
+
+    @property
+    def total(self):
+        self.flush()
+        return int(self.counts.sum())
+
+    def most_common(self, n=None):
+        """Get ((filepath, lineno), count) from the most to the least executed line"""
+        self.flush()
+        order = np.argsort(-self.counts, kind='stable')
+        if n is not None:
+            order = order[:n]
+        return [(self.keys[i], int(self.counts[i])) for i in order]
+
+    def write_profile(self, stream):
+        """Write a flat profile: count, percent of all events and location, hottest first"""
+        total = self.total
+        stream.write('count\tpercent\tlocation\n')
+        for (filepath, lineno), count in self.most_common():
+            stream.write(f'{count}\t{100 * count / total:.2f}\t{filepath}:{lineno}\n')
+
+    def write_annotated(self, stream, source_lines):
+        """
+        Write each source line with its count.
+        source_lines is {filepath: [(lineno, text)]}, as from trace.debug_print_code.
+        """
+        self.flush()
+        for filepath, lines in source_lines.items():
+            stream.write(f'{filepath}\n')
+            for lineno, text in lines:
+                count = self.counts[self.ids[(filepath, lineno)]]
+                stream.write(f'{count:>10} {lineno:6}  {text}\n')
@@ -0,0 +1,102 @@
+"""
+Control-flow edge profiles: how many times execution moved from one line to the next.
+
+Edge tables are TSV files with a header and one edge per line:
+
+count	source	destination
+12	/root/src/a.c:10	/root/src/a.c:11
+"""
+
+from collections import Counter
+from mylog import log
+import argparse
+import logging
+import sys
+
+HEADER = 'count\tsource\tdestination\n'
+
+
+class EdgeCounts:
+    """
+    Count the transitions between consecutive events at different lines.
+    Each location gets a dense ID, and each edge is counted under one integer key made of its two IDs.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.counts = Counter()
+        self.prev = None
+
+    def add(self, filepath, lineno):
+        key = (filepath, lineno)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        if self.prev is not None and self.prev != i:
+            self.counts[self.prev << 32 | i] += 1
+        self.prev = i
+
+    def tap(self, locs):
+        """Count the edges in a stream of locations while passing it through"""
+        for l in locs:
+            self.add(l.filepath, l.lineno)
+            yield l
+
+    def edges(self):
+        """Get {(source, destination): count} with locations formatted as file:line"""
+        names = [f'{filepath}:{lineno}' for filepath, lineno in self.keys]
+        return Counter({(names[k >> 32], names[k & 0xffffffff]): count for k, count in self.counts.items()})
+
+
+def write_edges(stream, edges):
+    """Write an edge table, most frequent edge first"""
+    stream.write(HEADER)
+    for (source, destination), count in edges.most_common():
+        stream.write(f'{count}\t{source}\t{destination}\n')
+
+
+def read_edges(stream):
+    edges = Counter()
+    for i, line in enumerate(stream):
+        if i == 0 and line == HEADER:
+            continue
+        count, source, destination = line.rstrip('\n').split('\t')
+        edges[(source, destination)] += int(count)
+    return edges
+
+
+def merge(paths):
+    """Sum the edge tables at paths"""
+    edges = Counter()
+    for path in paths:
+        with open(path) as f:
+            edges.update(read_edges(f))
+    return edges
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='trace edges', description='Work with edge tables from trace --edges')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge', help='Sum edge tables from several runs')
+    merge.add_argument('tables', nargs='+', help='Edge tables')
+    merge.add_argument('-o', '--output-file', help='Output to a file instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+
+    if args.command == 'merge':
+        edges = merge(args.tables)
+        log.info(f'merged {len(args.tables)} tables into {len(edges)} edges')
+        if args.output_file:
+            with open(args.output_file, 'w') as f:
+                write_edges(f, edges)
+        else:
+            write_edges(sys.stdout, edges)
+    return 0
@@ -3,14 +3,20 @@ Location = namedtuple('Location', 'filepath lineno column node')
 
 
 class Location:
-    def __init__(self, filepath, lineno, column, node=None):
+    """
+    A location in a trace.
+    code and spelling are copied out of the Clang AST, so that no cursor keeps a translation unit alive.
+    """
+
+    def __init__(self, filepath, lineno, column, code=None, spelling=None):
         self.filepath = filepath
         self.lineno = lineno
         self.column = column
-        self.node = node
+        self.code = code
+        self.spelling = spelling
 
     def __repr__(self):
-        return f'{self.filepath}:{self.lineno}:{self.column} {self.node.spelling if self.node else None}'
+        return f'{self.filepath}:{self.lineno}:{self.column} {self.spelling}'
 
 
 SlimLocation = namedtuple('SlimLocation', 'filepath lineno column code')
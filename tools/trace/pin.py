@@ -4,20 +4,26 @@ import subprocess
 from .location import Location
 
 
+def iter_pinlog(logfile):
+    """
+    Stream the trace locations from a Pin log file, one line at a time.
+    """
+    with open(logfile) as f:
+        for line in f:
+            split = line.rstrip('\n').split(':')
+            if len(split) < 3:
+                continue
+            filepath = split[0]
+            lineno = int(split[1])
+            column = int(split[2])
+            yield Location(filepath, lineno, column)
+
+
 def parse_pinlog(logfile):
     """
     Parse a Pin log file and return the trace locations.
     """
-    logtext = logfile.read_text()
-    loglines = logtext.splitlines()
-    locations = []
-    for line in loglines:
-        split = line.split(':')
-        filepath = split[0]
-        lineno = int(split[1])
-        column = int(split[2])
-        locations.append(Location(filepath, lineno, column))
-    return locations
+    return list(iter_pinlog(logfile))
 
 
 class Pin:
@@ -74,10 +80,12 @@ class Pin:
 
         return pin
 
-    def run(self, target, target_args):
+    def run(self, target, target_args, process=list):
         """
         Run Pin. Collect results in temporary file pin.log
         and return a list of trace locations (filepath:lineno:column).
+        process is called with an iterator over the trace locations while the log file is streamed,
+        and its result is returned instead.
         """
         if not target.is_file():
             log.error(f'No such file for target executable: {target}')
@@ -125,7 +133,7 @@ class Pin:
             if not logfile.is_file():
                 raise Exception(
                     f'Something went wrong running Pin -- {logfile} is missing.')
-            return parse_pinlog(logfile)
+            return process(iter_pinlog(logfile))
         finally:
             if logfile.is_file() and not self.keep_logfile:
                 logfile.unlink()
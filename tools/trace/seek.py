@@ -0,0 +1,196 @@
+"""
+Seekable trace files.
+
+A seekable trace is a gzip file made of independent gzip members of block_events lines each,
+so zcat still reads it, with a sparse index in a sidecar file <trace>.idx.json:
+
+{"version": 1, "block_events": N, "events": total,
+ "blocks": [{"offset": byte offset, "length": compressed bytes, "events": lines, "files": [source files]}, ...]}
+
+Event i is in block i // block_events, so reading it decompresses one block.
+"""
+
+from collections import OrderedDict
+from mylog import log
+from pathlib import Path
+import argparse
+import gzip
+import json
+import logging
+import sys
+
+INDEX_VERSION = 1
+BLOCK_EVENTS = 65536
+
+
+def index_path(path):
+    return Path(f'{path}.idx.json')
+
+
+class TraceWriter:
+    """Write trace lines to a seekable trace file"""
+
+    def __init__(self, path, block_events=BLOCK_EVENTS):
+        self.path = Path(path)
+        self.block_events = block_events
+        self.stream = open(self.path, 'wb')
+        self.blocks = []
+        self.lines = []
+        self.offset = 0
+        self.events = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) == self.block_events:
+            self.flush_block()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush_block(self):
+        if not self.lines:
+            return
+        data = gzip.compress(''.join(self.lines).encode(), mtime=0)
+        self.stream.write(data)
+        files = sorted({l.split(':', 1)[0] for l in self.lines})
+        self.blocks.append({'offset': self.offset, 'length': len(data), 'events': len(self.lines), 'files': files})
+        self.offset += len(data)
+        self.events += len(self.lines)
+        self.lines = []
+
+    def close(self):
+        if self.stream.closed:
+            return
+        self.flush_block()
+        self.stream.close()
+        index = {
+            'version': INDEX_VERSION,
+            'block_events': self.block_events,
+            'events': self.events,
+            'blocks': self.blocks,
+        }
+        index_path(self.path).write_text(json.dumps(index))
+
+
+class TraceReader:
+    """
+    Random access to the events of a seekable trace file.
+    reader[i] is one line and reader[a:b] is a list of lines. Recently read blocks are cached.
+    """
+
+    def __init__(self, path, cache_blocks=4):
+        self.path = Path(path)
+        self.index = json.loads(index_path(self.path).read_text())
+        if self.index['version'] != INDEX_VERSION:
+            raise ValueError(f'unsupported index version {self.index["version"]} for {path}')
+        self.block_events = self.index['block_events']
+        self.blocks = self.index['blocks']
+        self.stream = open(self.path, 'rb')
+        self.cache = OrderedDict()
+        self.cache_blocks = cache_blocks
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return self.index['events']
+
+    def block(self, b):
+        """Get the lines of block b"""
+        if b in self.cache:
+            self.cache.move_to_end(b)
+            return self.cache[b]
+        block = self.blocks[b]
+        self.stream.seek(block['offset'])
+        lines = gzip.decompress(self.stream.read(block['length'])).decode().splitlines(keepends=True)
+        self.cache[b] = lines
+        if len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+        return lines
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            lines = []
+            i = start
+            while i < stop:
+                b, j = divmod(i, self.block_events)
+                block = self.block(b)
+                lines += block[j:j + stop - i]
+                i = (b + 1) * self.block_events
+            return lines
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('event out of range')
+        b, j = divmod(key, self.block_events)
+        return self.block(b)[j]
+
+    def find(self, file, line=None, start=0):
+        """
+        Get the number of the first event at or after start in file (at line, if given), or None.
+        Traces record absolute paths, so a relative file matches every traced path ending with it, like src/expr.c for /home/me/proj/src/expr.c.
+        Blocks which do not contain the file are skipped without reading them.
+        """
+        line = None if line is None else str(line)
+        for b in range(start // self.block_events, len(self.blocks)):
+            paths = {f for f in self.blocks[b]['files'] if f == file or (not file.startswith('/') and f.endswith(f'/{file}'))}
+            if not paths:
+                continue
+            first = b * self.block_events
+            for j, l in enumerate(self.block(b)[max(start - first, 0):], max(start - first, 0)):
+                path, _, rest = l.rstrip('\n').partition(':')
+                if path in paths and (line is None or rest.split(':', 1)[0] == line):
+                    return first + j
+        return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='trace seek', description='Read events from a seekable trace (see trace --seekable)')
+    parser.add_argument('trace', help='Seekable trace file')
+    parser.add_argument('events', nargs='?', help='Event number or range START:END to print. Default: the number of events')
+    parser.add_argument('--find', metavar='FILE[:LINE]', help='Print the number of the first event in FILE (at LINE), at or after the first event number given. '
+                        'A relative FILE matches every traced path ending with it')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+
+    with TraceReader(args.trace) as reader:
+        if args.find:
+            file, _, line = args.find.rpartition(':')
+            if not file or not line.isdigit():
+                file, line = args.find, None
+            start = int(args.events.split(':')[0] or 0) if args.events else 0
+            event = reader.find(file, line, start)
+            if event is None:
+                log.error(f'{args.find} not found')
+                return 1
+            print(event)
+        elif args.events is None:
+            print(len(reader))
+        elif ':' in args.events:
+            start, stop = (int(e) if e else None for e in args.events.split(':', 1))
+            sys.stdout.writelines(reader[start:stop])
+        else:
+            sys.stdout.write(reader[int(args.events)])
+    return 0
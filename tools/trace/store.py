@@ -0,0 +1,199 @@
+"""
+Deduplicating store for trace outputs.
+
+Traces are split into chunks of lines at content-defined boundaries, so that traces which share
+a region share the chunks covering it. Each unique chunk is stored once, compressed and named by its hash,
+and each trace is a manifest listing its chunks in order.
+
+<root>/objects/<2 hex digits>/<sha256>  zlib-compressed chunk
+<root>/traces/<name>.json               manifest
+"""
+
+from fileutils import write_atomic
+from mylog import log
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import time
+import zlib
+
+default_root = Path('.paltools') / 'traces'
+
+# A line ends a chunk when the low bits of a rolling hash over the previous lines are zero.
+# Each line shifts the hash left by one bit, so only the last 8 lines decide a boundary,
+# and chunking gets back in step with another trace soon after the traces stop differing.
+BOUNDARY_MASK = (1 << 8) - 1  # chunks of about 256 lines, a few KiB compressed
+MIN_CHUNK_LINES = 32
+MAX_CHUNK_LINES = 4096
+HASH_MASK = (1 << 64) - 1
+
+
+def chunks(lines):
+    """Split an iterable of lines into lists of lines at content-defined boundaries"""
+    chunk = []
+    h = 0
+    for line in lines:
+        chunk.append(line)
+        h = ((h << 1) + zlib.crc32(line.encode())) & HASH_MASK
+        if len(chunk) >= MAX_CHUNK_LINES or (len(chunk) >= MIN_CHUNK_LINES and h & BOUNDARY_MASK == 0):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class TraceStore:
+    """Content-addressed store of traces"""
+
+    def __init__(self, root=default_root):
+        self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.traces = self.root / 'traces'
+
+    def object_path(self, digest):
+        return self.objects / digest[:2] / digest
+
+    def manifest_path(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise ValueError(f'invalid trace name: {name!r}')
+        return self.traces / f'{name}.json'
+
+    def put_chunk(self, data):
+        """Store a chunk unless it is already stored. Returns its digest and whether it was new."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if path.is_file():
+            return digest, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, zlib.compress(data))
+        return digest, True
+
+    def get_chunk(self, digest):
+        return zlib.decompress(self.object_path(digest).read_bytes())
+
+    def ingest(self, name, lines):
+        """Store a trace from an iterable of lines, each ending with a newline"""
+        manifest_path = self.manifest_path(name)
+        self.traces.mkdir(parents=True, exist_ok=True)
+        digests = []
+        new_chunks = 0
+        new_bytes = 0
+        total_bytes = 0
+        num_lines = 0
+        whole = hashlib.sha256()
+        for chunk in chunks(lines):
+            data = ''.join(chunk).encode()
+            digest, new = self.put_chunk(data)
+            digests.append(digest)
+            whole.update(data)
+            num_lines += len(chunk)
+            total_bytes += len(data)
+            if new:
+                new_chunks += 1
+                new_bytes += len(data)
+        manifest = {
+            'name': name,
+            'created': time.time(),
+            'lines': num_lines,
+            'bytes': total_bytes,
+            'sha256': whole.hexdigest(),
+            'chunks': digests,
+        }
+        write_atomic(manifest_path, json.dumps(manifest).encode())
+        log.info(f'stored trace {name}: {num_lines} lines in {len(digests)} chunks, '
+                 f'{new_chunks} new chunks ({new_bytes} of {total_bytes} bytes)')
+        return manifest
+
+    def manifest(self, name):
+        path = self.manifest_path(name)
+        if not path.is_file():
+            raise KeyError(f'no such trace: {name}')
+        return json.loads(path.read_text())
+
+    def names(self):
+        if not self.traces.is_dir():
+            return []
+        return sorted(p.stem for p in self.traces.glob('*.json'))
+
+    def export(self, name, stream):
+        """Write a trace to a binary stream"""
+        for digest in self.manifest(name)['chunks']:
+            stream.write(self.get_chunk(digest))
+
+    def remove(self, name):
+        self.manifest(name)
+        self.manifest_path(name).unlink()
+
+    def gc(self):
+        """
+        Delete the chunks which no trace refers to. Returns the number of chunks and bytes deleted.
+        Do not run while traces are being ingested: a chunk which an ingest found already stored could be deleted.
+        """
+        live = set()
+        for name in self.names():
+            live.update(self.manifest(name)['chunks'])
+        deleted = 0
+        deleted_bytes = 0
+        if self.objects.is_dir():
+            for path in self.objects.glob('*/*'):
+                if path.name not in live and not path.name.startswith('.'):
+                    deleted_bytes += path.stat().st_size
+                    path.unlink()
+                    deleted += 1
+        log.info(f'deleted {deleted} unreferenced chunks ({deleted_bytes} bytes)')
+        return deleted, deleted_bytes
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='trace store', description='Deduplicating store for trace outputs')
+    parser.add_argument('-r', '--root', type=Path, default=default_root, help=f'Root directory of the store. Default: {default_root}')
+    parser.add_argument('-l', '--log-level', help='Display logs at a certain level (DEBUG, INFO, ERROR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='Store a trace')
+    ingest.add_argument('name', help='Name of the trace')
+    ingest.add_argument('file', nargs='?', default='-', help='Trace file. Default: stdin')
+    commands.add_parser('list', help='List the stored traces')
+    export = commands.add_parser('export', help='Write a stored trace')
+    export.add_argument('name', help='Name of the trace')
+    export.add_argument('-o', '--output-file', help='Output to a file instead of stdout')
+    rm = commands.add_parser('rm', help='Remove stored traces. Their chunks are deleted by gc')
+    rm.add_argument('names', nargs='+', help='Names of the traces')
+    commands.add_parser('gc', help='Delete the chunks which no trace refers to')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.log_level:
+        log.setLevel(logging.getLevelName(args.log_level))
+    store = TraceStore(args.root)
+
+    try:
+        if args.command == 'ingest':
+            if args.file == '-':
+                store.ingest(args.name, sys.stdin)
+            else:
+                with open(args.file) as f:
+                    store.ingest(args.name, f)
+        elif args.command == 'list':
+            for name in store.names():
+                m = store.manifest(name)
+                print(f'{name}\t{m["lines"]}\t{m["bytes"]}\t{len(m["chunks"])}')
+        elif args.command == 'export':
+            if args.output_file:
+                with open(args.output_file, 'wb') as f:
+                    store.export(args.name, f)
+            else:
+                store.export(args.name, sys.stdout.buffer)
+        elif args.command == 'rm':
+            for name in args.names:
+                store.remove(name)
+        elif args.command == 'gc':
+            store.gc()
+    except (KeyError, ValueError) as e:
+        log.error(e.args[0])
+        return 1
+    return 0
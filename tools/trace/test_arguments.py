@@ -1,3 +1,5 @@
+import contextlib
+import io
 import unittest
 from tools.trace.trace import parse_args
 
@@ -22,5 +24,13 @@ class TestArgParse(unittest.TestCase):
             args = parse_args(argv, do_wizard=False)
             self.assertListEqual(expected, args.target)
 
+    def test_seekable_requires_output_file(self):
+        for argv in (['trace', '--seekable', '--', 'g'], ['trace', '--seekable', '--store', 'traces', '--', 'g']):
+            with self.assertRaises(SystemExit) as cm, contextlib.redirect_stderr(io.StringIO()) as err:
+                parse_args(argv, do_wizard=False)
+            self.assertEqual(cm.exception.code, 2)
+            self.assertIn('--seekable requires -o', err.getvalue())
+        self.assertTrue(parse_args(['trace', '--seekable', '-o', 'trace.gz', '--', 'g'], do_wizard=False).seekable)
+
 if __name__ == '__main__':
     unittest.main()
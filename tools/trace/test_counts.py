@@ -0,0 +1,32 @@
+from tools.trace.counts import LineCounts
+from tools.trace.location import Location
+import io
+import unittest
+from unittest import mock
+
+
+class TestLineCounts(unittest.TestCase):
+
+    def test_counts_across_batches(self):
+        counts = LineCounts()
+        locs = [Location('a.c', i % 3 + 1, 1) for i in range(10)] + [Location('b.c', 7, 1)] * 4
+        with mock.patch('tools.trace.counts.BATCH_EVENTS', 4):
+            passed = list(counts.tap(locs))
+        self.assertEqual(passed, locs)
+        self.assertEqual(counts.total, 14)
+        self.assertEqual(counts.most_common(), [(('a.c', 1), 4), (('b.c', 7), 4), (('a.c', 2), 3), (('a.c', 3), 3)])
+
+    def test_profile_and_annotation(self):
+        counts = LineCounts()
+        for lineno in [1, 2, 2, 2]:
+            counts.add('a.c', lineno)
+        profile = io.StringIO()
+        counts.write_profile(profile)
+        self.assertEqual(profile.getvalue().splitlines(), ['count\tpercent\tlocation', '3\t75.00\ta.c:2', '1\t25.00\ta.c:1'])
+        annotated = io.StringIO()
+        counts.write_annotated(annotated, {'a.c': [(1, 'int main() {'), (2, '  f();')]})
+        self.assertEqual(annotated.getvalue().splitlines(), ['a.c', '         1      1  int main() {', '         3      2    f();'])
+
+
+if __name__ == '__main__':
+    unittest.main()
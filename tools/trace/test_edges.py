@@ -0,0 +1,39 @@
+from tools.trace.edges import EdgeCounts, merge, read_edges, write_edges
+from tools.trace.location import Location
+import io
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+
+
+class TestEdges(unittest.TestCase):
+
+    def test_counts_transitions_between_lines(self):
+        counts = EdgeCounts()
+        linenos = [1, 2, 2, 3, 2, 3, 4]
+        passed = list(counts.tap(Location('a.c', lineno, 1) for lineno in linenos))
+        self.assertEqual(len(passed), len(linenos))
+        self.assertEqual(counts.edges(), Counter({
+            ('a.c:1', 'a.c:2'): 1,
+            ('a.c:2', 'a.c:3'): 2,
+            ('a.c:3', 'a.c:2'): 1,
+            ('a.c:3', 'a.c:4'): 1,
+        }))
+
+    def test_write_read_and_merge(self):
+        edges = Counter({('a.c:1', 'a.c:2'): 3, ('a.c:2', 'b.c:9'): 1})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [Path(tmpdir) / 'one.tsv', Path(tmpdir) / 'two.tsv']
+            for path in paths:
+                with open(path, 'w') as f:
+                    write_edges(f, edges)
+            self.assertEqual(merge(paths), edges + edges)
+        stream = io.StringIO()
+        write_edges(stream, edges)
+        stream.seek(0)
+        self.assertEqual(read_edges(stream), edges)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -115,6 +115,28 @@ class TestStaticInfo(unittest.TestCase):
         assert any('mytype i;' in l for l in lines)
         assert any('mytype2 j;' in l for l in lines)
 
+    def test_returns_plain_data(self):
+        filename = get_testpath('tests/smorg.c')
+        smorg = get_node(filename, 'smorgasboard')
+
+        smorg_loc = Location(smorg.location.file.name, smorg.location.line, smorg.location.column)
+        static_locations = get_static_locations([smorg_loc], [])
+        assert smorg_loc.spelling == 'smorgasboard'
+        assert smorg_loc.code.startswith('int smorgasboard')
+        assert all(type(l) is Location for l in static_locations)
+        assert all(type(l.code) is str and type(l.spelling) is str for l in static_locations)
+        assert any(l.code.startswith('case 0') for l in static_locations)
+
+    def test_code_only_when_included(self):
+        filename = get_testpath('tests/smorg.c')
+        smorg = get_node(filename, 'smorgasboard')
+
+        smorg_loc = Location(smorg.location.file.name, smorg.location.line, smorg.location.column)
+        static_locations = get_static_locations([smorg_loc], [], include_code=False)
+        assert smorg_loc.code is None and smorg_loc.spelling == 'smorgasboard'
+        assert static_locations and all(l.code is None for l in static_locations)
+        assert any(l.spelling == 'a' for l in static_locations)
+
 
 if __name__ == '__main__':
     unittest.main()
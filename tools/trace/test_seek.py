@@ -0,0 +1,59 @@
+from contextlib import redirect_stdout
+from tools.trace.seek import TraceReader, TraceWriter, main
+import gzip
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+lines = [f'/root/src/file{i % 7 if i < 900 else 9}.c:{i % 13}:{i}\n' for i in range(1000)]
+
+
+class TestSeekableTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'trace.gz'
+        with TraceWriter(self.path, block_events=64) as writer:
+            writer.writelines(lines)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_readable_as_gzip(self):
+        self.assertEqual(gzip.decompress(self.path.read_bytes()).decode(), ''.join(lines))
+
+    def test_index_and_slice(self):
+        with TraceReader(self.path) as reader:
+            self.assertEqual(len(reader), len(lines))
+            self.assertEqual(reader[0], lines[0])
+            self.assertEqual(reader[-1], lines[-1])
+            self.assertEqual(reader[500], lines[500])
+            self.assertEqual(reader[60:200], lines[60:200])
+            self.assertEqual(reader[990:], lines[990:])
+            self.assertEqual(reader[10:100:7], lines[10:100:7])
+
+    def test_find(self):
+        with TraceReader(self.path) as reader:
+            self.assertEqual(reader.find('/root/src/file9.c'), 900)
+            self.assertEqual(reader.find('/root/src/file3.c', 4), 17)
+            self.assertEqual(reader.find('/root/src/file3.c', 4, start=18), 108)
+            self.assertEqual(reader.find('/root/src/file3.c', 4, start=109), 199)
+            self.assertIsNone(reader.find('/root/src/file8.c'))
+            self.assertIsNone(reader.find('/root/src/file3.c', 1, start=900))
+
+    def test_find_relative_path(self):
+        with TraceReader(self.path) as reader:
+            self.assertEqual(reader.find('src/file3.c', 4), 17)
+            self.assertEqual(reader.find('file9.c'), 900)
+            self.assertIsNone(reader.find('rc/file9.c'))
+            self.assertIsNone(reader.find('/src/file9.c'))
+
+    def test_main_find(self):
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(main([str(self.path), '18', '--find', 'src/file3.c:4']), 0)
+        self.assertEqual(out.getvalue(), '108\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
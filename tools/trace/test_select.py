@@ -0,0 +1,92 @@
+from tools.trace.pin import iter_pinlog
+from tools.trace.location import Location
+from tools.trace.trace import iter_in_function, select_dynamic_locations
+import tempfile
+import unittest
+from pathlib import Path
+
+
+class TestSelectDynamicLocations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        root = Path(self.tmpdir.name)
+        self.source = root / 'a.c'
+        self.source.write_text('int main() {}\n')
+        self.logfile = root / 'pin.log'
+        lines = [f'{self.source}:{i}:1' for i in range(1, 11)]
+        lines.insert(3, '/usr/include/stdio.h:1:1')
+        lines.insert(5, f'{root}/missing.c:1:1')
+        self.logfile.write_text('\n'.join(lines) + '\n')
+        self.prefixes = [str(root)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def linenos(self, **kwargs):
+        return [l.lineno for l in select_dynamic_locations(iter_pinlog(self.logfile), self.prefixes, **kwargs)]
+
+    def test_filters_prefixes_and_missing_files(self):
+        self.assertEqual(self.linenos(), list(range(1, 11)))
+
+    def test_tail(self):
+        self.assertEqual(self.linenos(tail=3), [8, 9, 10])
+
+    def test_head(self):
+        self.assertEqual(self.linenos(head=3), [1, 2, 3])
+
+    def test_head_and_tail(self):
+        self.assertEqual(self.linenos(head=5, tail=2), [4, 5])
+
+
+calls = '''int leaf(int x) {
+  return x + 1;
+}
+
+int middle(int x) {
+  int y = leaf(x);
+  return leaf(y);
+}
+
+int target(int x) {
+  int y = middle(x);
+  return y;
+}
+
+int main(int argc, char **argv) {
+  int a = leaf(argc);
+  int b = target(a);
+  return b;
+}
+'''
+
+
+class TestInFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tmpdir.name) / 'calls.c'
+        self.source.write_text(calls)
+        # main -> leaf -> main -> target -> middle -> leaf -> middle -> leaf -> middle -> target -> main
+        self.linenos = [16, 2, 16, 17, 11, 6, 2, 6, 7, 2, 7, 12, 17, 18]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def in_function(self, name, depth=0):
+        locs = [Location(str(self.source), lineno, 1) for lineno in self.linenos]
+        return [l.lineno for l in iter_in_function(locs, name, depth)]
+
+    def test_only_function(self):
+        self.assertEqual(self.in_function('target'), [11, 12])
+
+    def test_callees_to_depth(self):
+        self.assertEqual(self.in_function('target', depth=1), [11, 6, 6, 7, 7, 12])
+        self.assertEqual(self.in_function('target', depth=2), [11, 6, 2, 6, 7, 2, 7, 12])
+
+    def test_function_not_called(self):
+        self.assertEqual(self.in_function('missing', depth=5), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from tools.trace.store import TraceStore, chunks
+import io
+import random
+import tempfile
+import unittest
+
+
+def trace_lines(seed, n):
+    rng = random.Random(seed)
+    return [f'/root/src/file{rng.randint(0, 9)}.c:{rng.randint(1, 500)}\n' for _ in range(n)]
+
+
+class TestTraceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = TraceStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def export(self, name):
+        stream = io.BytesIO()
+        self.store.export(name, stream)
+        return stream.getvalue().decode()
+
+    def test_round_trip(self):
+        lines = trace_lines(0, 5000)
+        self.store.ingest('a', lines)
+        self.assertEqual(self.export('a'), ''.join(lines))
+        self.assertEqual(self.store.names(), ['a'])
+
+    def test_similar_traces_share_chunks(self):
+        a = trace_lines(0, 5000)
+        b = a[:2500] + trace_lines(1, 10) + a[2500:]
+        manifest_a = self.store.ingest('a', a)
+        manifest_b = self.store.ingest('b', b)
+        new = set(manifest_b['chunks']) - set(manifest_a['chunks'])
+        self.assertLessEqual(len(new), 2)
+        self.assertEqual(self.export('b'), ''.join(b))
+
+    def test_gc_keeps_referenced_chunks(self):
+        a = trace_lines(0, 3000)
+        b = trace_lines(1, 3000)
+        self.store.ingest('a', a)
+        self.store.ingest('b', b)
+        self.store.remove('a')
+        deleted, _ = self.store.gc()
+        self.assertGreater(deleted, 0)
+        self.assertEqual(self.export('b'), ''.join(b))
+        with self.assertRaises(KeyError):
+            self.export('a')
+
+    def test_chunks_cover_all_lines(self):
+        lines = trace_lines(2, 10000)
+        self.assertEqual(sum(chunks(lines), []), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,31 @@
 #!/bin/python3
 
-from mylog import log, CappedLog
+from mylog import log, CappedLog, lazy, counts as log_counts
+import compdb
+import metrics
+import mylog
 import argparse
 import logging
 import nodeutils
 from clang.cindex import Config, Cursor, CursorKind, File, SourceLocation, TranslationUnitLoadError
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
+import bisect
 import sys
 from .pin import Pin
 from .location import Location, SlimLocation
+from . import edges, seek, store
+from .store import TraceStore
+import os
+import time
 import traceback
 
 
-node_log = CappedLog()
-staticloc_log = CappedLog()
-dynloc_log = CappedLog()
-printcode_log = CappedLog()
+node_log = CappedLog(category='node')
+staticloc_log = CappedLog(category='static location')
+dynloc_log = CappedLog(category='dynamic location')
+printcode_log = CappedLog(category='code')
 
 
 def parse_args(argv=sys.argv, do_wizard=True):
@@ -57,7 +66,35 @@ def parse_args(argv=sys.argv, do_wizard=True):
                         'then add it here as an argument. '
                         'WARNING: if you do specify an argument, then '
                         'the defaults /home and /root will not be included.')
+    parser.add_argument('--head', type=int,
+                        help='Keep only the first N locations of the trace. Static analysis only runs on the kept locations')
+    parser.add_argument('--tail', type=int,
+                        help='Keep only the last N locations of the trace, e.g. the locations leading up to a crash. '
+                        'Static analysis only runs on the kept locations. With --head, keeps the last N of the first locations')
+    parser.add_argument('--function', type=str,
+                        help='Keep only the locations inside calls to the function NAME. Static analysis only runs on the kept locations', metavar='NAME')
+    parser.add_argument('--depth', type=int, default=0,
+                        help='With --function, also keep the locations in callees up to K calls deep. Default: 0', metavar='K')
+    parser.add_argument('--counts', type=str, metavar='FILE',
+                        help='Write a flat profile of how many times each line ran, hottest first. '
+                        'Counts every event kept by the source prefixes and --function, before --head and --tail. Requires NumPy')
+    parser.add_argument('--annotate', type=str, metavar='FILE',
+                        help='Write the source of each executed line with how many times it ran. Requires NumPy')
+    parser.add_argument('--edges', type=str, metavar='FILE',
+                        help='Write a table of how many times execution moved from one line to another. '
+                        'Counts the same events as --counts. Tables from several runs can be summed with trace edges merge')
+    parser.add_argument('--seekable', action='store_true',
+                        help='Write the -o trace as blocks of gzip with an index in <output>.idx.json, for random access with trace seek')
+    parser.add_argument('--store', type=str, metavar='DIR',
+                        help='Add the trace to the trace store at DIR (see trace store -h). The trace is only written elsewhere if -o is given')
+    parser.add_argument('--store-name', type=str,
+                        help='Name of the trace in the store. Default: the target name, a timestamp and the process ID')
+    compdb.add_arguments(parser)
+    mylog.add_arguments(parser)
+    metrics.add_arguments(parser)
     arguments = parser.parse_args(argv[1:])
+    if arguments.seekable and not arguments.output_file:
+        parser.error('--seekable requires -o')
 
     if after_dash is None:
         raise argparse.ArgumentTypeError(
@@ -68,6 +105,9 @@ def parse_args(argv=sys.argv, do_wizard=True):
 
     if arguments.log_level:
         log.setLevel(logging.getLevelName(arguments.log_level))
+    mylog.configure(arguments)
+    metrics.configure(arguments)
+    compdb.configure(arguments)
 
     if arguments.verbose:
         global verbose
@@ -115,75 +155,86 @@ def get_code(node):
     return ' '.join(t.spelling for t in node.get_tokens())
 
 
-def get_static_locations(dynamic_locations, clang_include_paths):
+def ancestor_node(n):
+    """
+    Get the nearest significant ancestor.
+    """
+    if n.kind == CursorKind.FUNCTION_DECL:
+        return n
+    else:
+        if n.semantic_parent is None:
+            return n
+        else:
+            return ancestor_node(n.semantic_parent)
+
+
+def good(n):
+    """
+    Node should be added to the trace.
+    """
+    if n.kind in (CursorKind.VAR_DECL, CursorKind.CASE_STMT, CursorKind.DEFAULT_STMT):
+        return True
+    else:
+        return False
+
+
+def static_locations_in_file(filepath, locations, clang_include_paths, include_code=True):
+    """
+    Get the static locations in one file and fill in the code (if include_code) and spelling of its dynamic locations.
+    Only plain data is returned, so the file's translation unit is freed when this returns.
+    """
+    root = nodeutils.parse(filepath, clang_include_paths)
+    ancestors = []
+    file = File.from_name(root.translation_unit, filepath)
+    positions = {}
+    for l in locations:
+        position = (l.lineno, l.column)
+        if position not in positions:
+            source_location = SourceLocation.from_position(
+                root.translation_unit, file, l.lineno, l.column)
+            node = Cursor.from_location(root.translation_unit, source_location)
+            positions[position] = (get_code(node) if include_code else None, node.spelling)
+            if not node.kind.is_invalid():
+                ancestor = ancestor_node(node)
+                if ancestor not in ancestors:
+                    node_log(lambda: f'node {nodeutils.pp(node)} has ancestor {nodeutils.pp(ancestor)}')
+                    ancestors.append(ancestor)
+        l.code, l.spelling = positions[position]
+
+    static_locations = []
+    for a in ancestors:
+        if a.kind.is_translation_unit():
+            continue  # Do not include global constructs
+        else:
+            for n in nodeutils.find(a, good):
+                code = get_code(n) if include_code else None
+                l = Location(n.location.file.name, n.location.line, n.location.column, code, n.spelling)
+                staticloc_log('static location %s', l)
+                static_locations.append(l)
+    return static_locations
+
+
+def get_static_locations(dynamic_locations, clang_include_paths, include_code=True):
     """
     Get locations for certain constructs which are only available statically.
     - Variable declarations without any executable code "int i;"
     - Case statements "case foo:"
     - Default statements "default: "
 
-    Also adds .node attribute to all dynamic locations (used to retrieve code line).
+    Also fills in the spelling of all dynamic locations, and their code if include_code.
+    Files are parsed one at a time and each translation unit is freed before the next one is parsed,
+    so peak memory is bounded by the largest translation unit.
     """
     static_locations = []
-
-    def ancestor_node(n):
-        """
-        Get the nearest significant ancestor.
-        """
-        if n.kind == CursorKind.FUNCTION_DECL:
-            return n
-        else:
-            if n.semantic_parent is None:
-                return n
-            else:
-                return ancestor_node(n.semantic_parent)
-
-    def good(n):
-        """
-        Node should be added to the trace.
-        """
-        if n.kind in (CursorKind.VAR_DECL, CursorKind.CASE_STMT, CursorKind.DEFAULT_STMT):
-            return True
-        else:
-            return False
-
     filepaths = defaultdict(list)
     for l in dynamic_locations:
         filepaths[l.filepath].append(l)
     for filepath, locations in filepaths.items():
-        log.debug(
-            f'Parsing source file {filepath} with args {clang_include_paths}')
-        root = None
+        log.debug('Parsing source file %s with args %s', filepath, clang_include_paths)
         try:
-            root = nodeutils.parse(filepath, clang_include_paths)
+            static_locations += static_locations_in_file(filepath, locations, clang_include_paths, include_code)
         except TranslationUnitLoadError:
             log.warn(f'error parsing file: {filepath}')
-            continue
-        ancestors = []
-        file = File.from_name(root.translation_unit, filepath)
-        for l in locations:
-            source_location = SourceLocation.from_position(
-                root.translation_unit, file, l.lineno, l.column)
-            node = Cursor.from_location(root.translation_unit, source_location)
-            l.node = node
-            if node.kind.is_invalid():
-                continue
-            ancestor = ancestor_node(node)
-            if ancestor not in ancestors:
-                node_log(
-                    f'node {nodeutils.pp(node)} has ancestor {nodeutils.pp(ancestor)}')
-                ancestors.append(ancestor)
-        for a in ancestors:
-            if a.kind.is_translation_unit():
-                continue  # Do not include global constructs
-            else:
-                nodes = nodeutils.find(a, good)
-                locations = [Location(
-                    n.location.file.name, n.location.line, n.location.column, n) for n in nodes]
-                for l in locations:
-                    staticloc_log(f'static location {l}')
-                static_locations += locations
-
     return static_locations
 
 
@@ -196,66 +247,186 @@ def slim(locations, add_column, add_code):
             column = l.column
         code = None
         if add_code:
-            code = get_code(l.node)
+            code = l.code
         sl = SlimLocation(l.filepath, l.lineno, column, code)
         if len(slim_locations) == 0 or slim_locations[-1] != sl:
             slim_locations.append(sl)
     return slim_locations
 
 
-def filter_to_prefixes(locs, prefixes):
-    accepted_locs = []
-    rejected_locs = []
+def iter_to_prefixes(locs, prefixes, rejected_loc_files):
+    """Stream the locations in files under the prefixes, counting the rejected locations by file"""
     for l in locs:
         if any(l.filepath.startswith(p) for p in prefixes):
-            accepted_locs.append(l)
+            yield l
         else:
-            rejected_locs.append(l)
+            rejected_loc_files[l.filepath] += 1
+
+
+def iter_existing(locs, verbose=False):
+    """Stream the locations in source files which exist, checking each file once"""
+    exists = {}
+    for l in locs:
+        if l.filepath not in exists:
+            exists[l.filepath] = Path(l.filepath).exists()
+        if exists[l.filepath]:
+            yield l
+        elif verbose:
+            dynloc_log('dynamic location %s\n^^^ file does not exist ^^^', l)
+
+
+def bounded(locs, head=None, tail=None):
+    """Keep the first head locations, then the last tail of those, holding at most head or tail locations in memory"""
+    if head is not None:
+        locs = islice(locs, head)
+    if tail is not None:
+        return deque(locs, maxlen=tail)
+    return locs
+
+
+class FunctionExtents:
+    """Find the function defined around a line, parsing each source file once"""
+
+    def __init__(self, clang_args=[], parse=nodeutils.parse):
+        self.clang_args = clang_args
+        self.parse = parse
+        self.files = {}
+
+    def definitions(self, filepath):
+        if filepath not in self.files:
+            try:
+                definitions = sorted((line, end_line, name) for name, line, end_line in nodeutils.function_definitions(filepath, self.clang_args, self.parse))
+            except TranslationUnitLoadError:
+                log.warn(f'error parsing file: {filepath}')
+                definitions = []
+            self.files[filepath] = ([d[0] for d in definitions], definitions)
+        return self.files[filepath]
+
+    def function_at(self, filepath, lineno):
+        starts, definitions = self.definitions(filepath)
+        i = bisect.bisect_right(starts, lineno) - 1
+        if i >= 0 and definitions[i][1] >= lineno:
+            return (filepath, definitions[i][2])
+        return None
+
+
+def iter_in_function(locs, name, depth=0, clang_args=[], parse=nodeutils.parse):
+    """
+    Stream the locations inside the dynamic activations of the function name,
+    including callees up to depth calls deep.
+    Traces have no call or return events, so the call stack is a heuristic:
+    moving to a function which is on the stack returns to it, moving to any other function calls it.
+    """
+    extents = FunctionExtents(clang_args, parse)
+    stack = []
+    for l in locs:
+        function = extents.function_at(l.filepath, l.lineno)
+        if function is None:
+            continue
+        if function in stack:
+            del stack[stack.index(function)+1:]
+        else:
+            stack.append(function)
+        for i, (_, n) in enumerate(stack):
+            if n == name:
+                if len(stack) - 1 - i <= depth:
+                    yield l
+                break
+
+
+def select_dynamic_locations(locs, prefixes, head=None, tail=None, verbose=False, scope=None, tap=None):
+    """
+    Filter a stream of dynamic locations to existing files under the prefixes, then to scope if given,
+    pass them through tap if given, and bound their number
+    """
     rejected_loc_files = defaultdict(int)
-    for l in rejected_locs:
-        rejected_loc_files[l.filepath] += 1
+    locs = iter_existing(iter_to_prefixes(locs, prefixes, rejected_loc_files), verbose)
+    if scope is not None:
+        locs = scope(locs)
+    if tap is not None:
+        locs = tap(locs)
+    selected = list(bounded(locs, head, tail))
+    log_rejected(rejected_loc_files)
+    return selected
+
+
+def log_rejected(rejected_loc_files):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
     rejected_loc_str = "\n".join(
         f"- {fname}: {count}"
         for fname, count in
         sorted(rejected_loc_files.items(), key=lambda p: p[1], reverse=True)
     )
     log.debug(f'Rejected {len(rejected_loc_files)} files:\n{rejected_loc_str}')
-    return accepted_locs
+
+
+def write_counts(line_counts, profile_file, annotate_file):
+    """Write the flat profile and the annotated source of the executed lines"""
+    log.info(f'{line_counts.total} events at {len(line_counts.keys)} lines')
+    if profile_file:
+        with open(profile_file, 'w') as f:
+            line_counts.write_profile(f)
+    if annotate_file:
+        source_lines = debug_print_code([SlimLocation(filepath, lineno, None, None) for filepath, lineno in line_counts.keys])
+        with open(annotate_file, 'w') as f:
+            line_counts.write_annotated(f, source_lines)
 
 
 def main():
+    if sys.argv[1:2] == ['store']:
+        return store.main(sys.argv[2:])
+    if sys.argv[1:2] == ['seek']:
+        return seek.main(sys.argv[2:])
+    if sys.argv[1:2] == ['edges']:
+        return edges.main(sys.argv[2:])
+
     global args
     args = parse_args()
 
     target = Path(args.target[0])
     target_args = args.target[1:]
+    clang_include_paths = [f'-I{p}' for p in args.clang_include_paths]
+    scope = None
+    if args.function:
+        def scope(locs):
+            return iter_in_function(locs, args.function, args.depth, clang_include_paths)
+    taps = []
+    line_counts = None
+    if args.counts or args.annotate:
+        from .counts import LineCounts
+        line_counts = LineCounts()
+        taps.append(line_counts.tap)
+    edge_counts = None
+    if args.edges:
+        edge_counts = edges.EdgeCounts()
+        taps.append(edge_counts.tap)
+
+    def tap(locs):
+        for t in taps:
+            locs = t(locs)
+        return locs
     try:
-        dynamic_locations = args.pin.run(target, target_args)
+        with metrics.timer('pin'):
+            dynamic_locations = args.pin.run(target, target_args, lambda locs: select_dynamic_locations(
+                locs, args.include_source_prefix, args.head, args.tail, args.verbose, scope, tap))
     except Exception as e:
         log.error(e)
         log.error(traceback.format_exc())
         return -1
     log.debug(f'{len(dynamic_locations)} logs')
-
-    dynamic_locations = filter_to_prefixes(
-        dynamic_locations, args.include_source_prefix)
+    metrics.count('dynamic_locations', len(dynamic_locations))
 
     for l in dynamic_locations:
-        if Path(l.filepath).exists():
-            printed = dynloc_log(f'dynamic location {l}')
-        elif args.verbose:
-            printed = dynloc_log(f'dynamic location {l}\n^^^ file does not exist ^^^')
-        if not printed:
+        if not dynloc_log('dynamic location %s', l):
             break
 
-    dynamic_locations = [
-        d for d in dynamic_locations if Path(d.filepath).exists()]
-    
     static_locations = []
-    clang_include_paths = [f'-I{p}' for p in args.clang_include_paths]
     if args.include_code or args.include_static:
-        static_locations = get_static_locations(
-            dynamic_locations, clang_include_paths)
+        with metrics.timer('static_locations'):
+            static_locations = get_static_locations(
+                dynamic_locations, clang_include_paths, args.include_code)
+        metrics.count('static_locations', len(static_locations))
 
     # Store only filepath and lineno and dedup
     all_locations = slim(
@@ -268,11 +439,7 @@ def main():
         log.error('No traces generated. Check if the source file was moved.')
         return 1
 
-    # Output trace locations to file
-    if args.output_file:
-        output_stream = open(args.output_file, 'w')
-    else:
-        output_stream = sys.stdout
+    lines = []
     for l in all_locations:
         s = f'{l.filepath}:{l.lineno}'
         if args.include_column:
@@ -280,15 +447,38 @@ def main():
         if args.include_code:
             s += f':{l.code}'
         s += '\n'
-        output_stream.write(s)
-    if output_stream is not sys.stdout:
-        output_stream.close()
-
-    debug_info = debug_print_code(all_locations)
-    for filepath, content in debug_info.items():
-        log.debug(filepath)
-        for lineno, text in content:
-            printcode_log(f'{lineno:4} {text}')
+        lines.append(s)
+
+    # Output trace locations to file
+    if args.output_file or not args.store:
+        if args.output_file and args.seekable:
+            output_stream = seek.TraceWriter(args.output_file)
+        elif args.output_file:
+            output_stream = open(args.output_file, 'w')
+        else:
+            output_stream = sys.stdout
+        output_stream.writelines(lines)
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+    if line_counts is not None:
+        write_counts(line_counts, args.counts, args.annotate)
+    if edge_counts is not None:
+        with open(args.edges, 'w') as f:
+            edges.write_edges(f, edge_counts.edges())
+
+    if args.store:
+        name = args.store_name or f'{target.name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}'
+        with metrics.timer('store'):
+            TraceStore(args.store).ingest(name, lines)
+
+    if printcode_log.enabled():
+        debug_info = debug_print_code(all_locations)
+        for filepath, content in debug_info.items():
+            log.debug(filepath)
+            for lineno, text in content:
+                printcode_log('%4d %s', lineno, text)
+    log.debug('log counts: %s', lazy(dict, log_counts))
     return 0
 
 